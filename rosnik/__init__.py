@@ -1,5 +1,5 @@
-from .client import init, context
-from .frameworks import flask_rosnik, django
+from .client import init, context, flush, shutdown
+from .frameworks import flask_rosnik, django, asgi
 from .events.user import track_user_feedback, track_user_interaction
 
 __all__ = [
@@ -8,5 +8,8 @@ __all__ = [
     "track_user_interaction",
     "track_user_feedback",
     "django",
+    "asgi",
     "context",
+    "flush",
+    "shutdown",
 ]
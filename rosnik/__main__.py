@@ -0,0 +1,70 @@
+"""Command line tools.
+
+```sh
+python -m rosnik upload --help
+```
+"""
+import argparse
+import logging
+import sys
+
+from rosnik import api, config, upload
+
+
+def _upload(args) -> int:
+    config.Config.api_key = args.api_key
+    config.Config.compression = args.compression
+    if config.Config.api_key is None and not args.dry_run:
+        print("An API key is required. Pass --api-key or set ROSNIK_API_KEY.", file=sys.stderr)
+        return 2
+
+    files = upload.find_files(args.paths)
+    uploader = upload.Uploader(
+        base_url=args.url,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        checkpoint=upload.Checkpoint(None if args.no_checkpoint else args.checkpoint),
+        dry_run=args.dry_run,
+    )
+    result = uploader.upload(files)
+    print(
+        f"Uploaded {result.uploaded} events from {len(files)} files. "
+        f"Skipped {result.invalid} invalid lines."
+    )
+    return 1 if result.failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m rosnik")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log progress")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    upload_parser = commands.add_parser(
+        "upload", help="upload NDJSON event files to the ingest API"
+    )
+    upload_parser.add_argument(
+        "paths", nargs="+", help="NDJSON files, or directories containing them"
+    )
+    upload_parser.add_argument("--api-key", help="defaults to ROSNIK_API_KEY")
+    upload_parser.add_argument("--url", default=api._base_url, help="ingest events endpoint")
+    upload_parser.add_argument("--batch-size", type=int, default=100)
+    upload_parser.add_argument("--concurrency", type=int, default=4)
+    upload_parser.add_argument("--compression", choices=["gzip", "zstd", "none"], default="gzip")
+    upload_parser.add_argument(
+        "--checkpoint",
+        default=upload.DEFAULT_CHECKPOINT,
+        help="file recording upload progress, so reruns resume where they stopped",
+    )
+    upload_parser.add_argument("--no-checkpoint", action="store_true")
+    upload_parser.add_argument(
+        "--dry-run", action="store_true", help="validate the files without uploading"
+    )
+    upload_parser.set_defaults(handler=_upload)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
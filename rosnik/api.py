@@ -1,15 +1,29 @@
+import gzip
 import logging
+import threading
+import time
+from enum import Enum
+from typing import List
+
 from urllib3.util import Retry
 
-from rosnik import config
+from rosnik import config, serialize
 from rosnik.types import core
 
 import requests
 from requests.adapters import HTTPAdapter
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 logger = logging.getLogger(__name__)
 
 _base_url = "https://ingest.rosnik.ai/api/v1/events"
+_batch_url = f"{_base_url}/batch"
+# Sent once in the header of every batch.
+_static_metadata = serialize.to_dict(core.static_metadata)
 
 _NUM_RETRIES = 3
 
@@ -20,13 +34,138 @@ retry_strategy = Retry(
     status_forcelist=_retry_status_code,
     allowed_methods=["POST"],
 )
-adapter = HTTPAdapter(max_retries=retry_strategy)
+
+_GZIP = "gzip"
+_ZSTD = "zstd"
+# zlib's default level: most of the size win at a fraction of level 9's CPU cost.
+_GZIP_LEVEL = 6
+_ZSTD_LEVEL = 3
+
+
+def compress(body: bytes, encoding: str):
+    """Compress `body`, returning the bytes and the `Content-Encoding` used.
+
+    Falls back to gzip if zstd is requested but `zstandard` isn't installed.
+    """
+    if encoding == _ZSTD:
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(body), _ZSTD
+        logger.debug("zstandard is not installed. Falling back to gzip.")
+    return gzip.compress(body, compresslevel=_GZIP_LEVEL), _GZIP
+
+
+class CircuitState(str, Enum):
+    # Requests flow normally.
+    CLOSED = "closed"
+    # The endpoint is failing. Requests are short-circuited.
+    OPEN = "open"
+    # The reset timeout has passed. A single probe request is let through.
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops sending to an endpoint after consecutive failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    requests fail immediately instead of waiting out retries and timeouts.
+    Once `reset_timeout` seconds pass, one probe request is let through:
+    if it succeeds the circuit closes, otherwise it opens again.
+
+    Limits default to `config.Config` and are read on every call, so a
+    breaker created at import time picks up settings passed to `init`.
+    A `failure_threshold` of 0 disables the breaker.
+    """
+
+    def __init__(self, failure_threshold=None, reset_timeout=None, clock=time.monotonic):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        # Number of requests short-circuited while the circuit was open.
+        self.rejected = 0
+
+    @property
+    def failure_threshold(self):
+        if self._failure_threshold is None:
+            return config.Config.circuit_failure_threshold
+        return self._failure_threshold
+
+    @property
+    def reset_timeout(self):
+        if self._reset_timeout is None:
+            return config.Config.circuit_reset_timeout_ms / 1000
+        return self._reset_timeout
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            if self._state == CircuitState.OPEN and self._reset_elapsed(self._opened_at):
+                return CircuitState.HALF_OPEN
+            return self._state
+
+    def _reset_elapsed(self, since):
+        return self._clock() - since >= self.reset_timeout
+
+    def allow_request(self) -> bool:
+        if not self.failure_threshold:
+            return True
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return True
+            if self._state == CircuitState.OPEN and self._reset_elapsed(self._opened_at):
+                self._state = CircuitState.HALF_OPEN
+                self._probe_started_at = None
+            if self._state == CircuitState.HALF_OPEN:
+                # Let one probe through at a time. If a probe never reports
+                # back, allow another once the reset timeout passes again.
+                if self._probe_started_at is None or self._reset_elapsed(self._probe_started_at):
+                    self._probe_started_at = self._clock()
+                    return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CircuitState.CLOSED:
+                logger.info("rosnik ingest API recovered. Closing circuit.")
+            self._state = CircuitState.CLOSED
+            self._failures = 0
+            self._probe_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            threshold = self.failure_threshold
+            if self._state == CircuitState.HALF_OPEN or (threshold and self._failures >= threshold):
+                if self._state != CircuitState.OPEN:
+                    logger.warning(
+                        f"rosnik ingest API is failing. Pausing sends for {self.reset_timeout}s."
+                    )
+                self._state = CircuitState.OPEN
+                self._opened_at = self._clock()
+                self._probe_started_at = None
+
+
+def _is_endpoint_failure(error: requests.exceptions.HTTPError) -> bool:
+    """Client errors like a bad API key mean the endpoint itself is healthy."""
+    response = error.response
+    return response is None or response.status_code in _retry_status_code
 
 
 class IngestClient:
-    def __init__(self):
+    def __init__(self, base_url=_base_url, circuit_breaker: CircuitBreaker = None):
+        self.event_url = base_url
+        self.batch_url = f"{base_url}/batch"
+        # Pass the same breaker to several clients to share their view of the endpoint.
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
         self.session = requests.Session()
-        self.session.mount("https://", adapter)
+        # A fresh adapter per client so connection pools are never shared
+        # between worker threads or across a fork.
+        self.session.mount("https://", HTTPAdapter(max_retries=retry_strategy))
 
     @property
     def headers(self):
@@ -38,16 +177,64 @@ class IngestClient:
     def _post(self, *args, **kwargs):
         # Wait up to 3 seconds before giving up
         kwargs["timeout"] = 3
+        if "json" in kwargs:
+            body = serialize.dumps(kwargs.pop("json"))
+            encoding = config.Config.compression
+            if encoding and len(body) >= config.Config.compression_threshold:
+                body, encoding = compress(body, encoding)
+                kwargs["headers"] = {**kwargs.get("headers", {}), "Content-Encoding": encoding}
+            kwargs["data"] = body
         return self.session.post(*args, **kwargs)
 
-    def send_event(self, event: core.Event, url=_base_url):
-        logger.debug(
-            f"Sending {event.event_type} event to {url} with event ID {event.event_id} and journey ID {event.journey_id}"  # noqa
-        )
+    def _send(self, url, payload, description) -> bool:
+        if not self.circuit_breaker.allow_request():
+            logger.debug(f"Circuit is open. Not sending {description}")
+            return False
         try:
-            response = self._post(url, headers=self.headers, json=event.to_dict())
+            response = self._post(url, headers=self.headers, json=payload)
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
-            logger.warning(f"Failed to send event: {e}")
+            logger.warning(f"Failed to send {description}: {e}")
+            if _is_endpoint_failure(e):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            return False
         except requests.exceptions.RetryError as e:
-            logger.warning(f"Failed to send event after {_NUM_RETRIES} attempts: {e}")
+            logger.warning(f"Failed to send {description} after {_NUM_RETRIES} attempts: {e}")
+            self.circuit_breaker.record_failure()
+            return False
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Failed to send {description}: {e}")
+            self.circuit_breaker.record_failure()
+            return False
+        self.circuit_breaker.record_success()
+        return True
+
+    def send_event(self, event: core.Event, url=None) -> bool:
+        """Send a single event. Returns False if it could not be delivered."""
+        url = url or self.event_url
+        logger.debug(
+            f"Sending {event.event_type} event to {url} with event ID {event.event_id} and journey ID {event.journey_id}"  # noqa
+        )
+        return self._send(url, serialize.to_dict(event), "event")
+
+    def send_batch(self, events: List[core.Event], url=None) -> bool:
+        """Ship several events in one request body.
+
+        The body is `{"metadata": ..., "events": [...]}`, with the static
+        metadata sent once rather than in each event.
+        """
+        payloads = [serialize.to_dict(event, include_static=False) for event in events]
+        return self.send_serialized_batch(payloads, url)
+
+    def send_serialized_batch(self, payloads: List[dict], url=None) -> bool:
+        """Like `send_batch`, for events already converted with `serialize.to_dict`.
+
+        Static metadata included in an event, e.g. one replayed from a file
+        written by another process, takes precedence over the batch's.
+        """
+        url = url or self.batch_url
+        logger.debug(f"Sending batch of {len(payloads)} events to {url}")
+        body = {"metadata": _static_metadata, "events": payloads}
+        return self._send(url, body, f"batch of {len(payloads)} events")
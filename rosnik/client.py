@@ -1,8 +1,10 @@
+import atexit
 import logging
 import warnings
 from contextlib import contextmanager
 
 from rosnik import config, state
+from rosnik.events import queue
 from rosnik.providers import openai as openai_
 from rosnik.providers import openai_v1 as openai_v1_
 
@@ -10,11 +12,82 @@ from rosnik.providers import openai_v1 as openai_v1_
 logger = logging.getLogger(__name__)
 
 
-def init(api_key=None, sync_mode=None, environment=None, event_context_hook=None):
+def init(
+    api_key=None,
+    sync_mode=None,
+    environment=None,
+    event_context_hook=None,
+    batch_size=None,
+    flush_interval_ms=None,
+    max_queue_size=None,
+    max_queue_bytes=None,
+    queue_overflow_policy=None,
+    enqueue_timeout_ms=None,
+    compression=None,
+    compression_threshold=None,
+    num_workers=None,
+    shutdown_on_exit=None,
+    shutdown_timeout_ms=None,
+    fingerprint_depth=None,
+    circuit_failure_threshold=None,
+    circuit_reset_timeout_ms=None,
+    max_request_payload_bytes=None,
+    max_response_payload_bytes=None,
+    sample_rate=None,
+    sample_rules=None,
+    sample_keep_errors=None,
+    sample_by_journey=None,
+    exporter=None,
+    export_path=None,
+    export_max_bytes=None,
+    spool_dir=None,
+    spool_max_bytes=None,
+    spool_segment_bytes=None,
+    spool_fsync=None,
+    spool_high_water=None,
+    count_tokens=None,
+    tokenizer=None,
+    defer_events=None,
+    event_context_cache=None,
+    event_context_ttl_ms=None,
+):
     config.Config.api_key = api_key
     config.Config.sync_mode = sync_mode
     config.Config.environment = environment
     config.Config.event_context_hook = event_context_hook
+    config.Config.batch_size = batch_size
+    config.Config.flush_interval_ms = flush_interval_ms
+    config.Config.max_queue_size = max_queue_size
+    config.Config.max_queue_bytes = max_queue_bytes
+    config.Config.queue_overflow_policy = queue_overflow_policy
+    config.Config.enqueue_timeout_ms = enqueue_timeout_ms
+    config.Config.compression = compression
+    config.Config.compression_threshold = compression_threshold
+    config.Config.num_workers = num_workers
+    config.Config.shutdown_on_exit = shutdown_on_exit
+    config.Config.shutdown_timeout_ms = shutdown_timeout_ms
+    config.Config.fingerprint_depth = fingerprint_depth
+    config.Config.circuit_failure_threshold = circuit_failure_threshold
+    config.Config.circuit_reset_timeout_ms = circuit_reset_timeout_ms
+    config.Config.max_request_payload_bytes = max_request_payload_bytes
+    config.Config.max_response_payload_bytes = max_response_payload_bytes
+    config.Config.sample_rate = sample_rate
+    config.Config.sample_rules = sample_rules
+    config.Config.sample_keep_errors = sample_keep_errors
+    config.Config.sample_by_journey = sample_by_journey
+    config.Config.exporter = exporter
+    config.Config.export_path = export_path
+    config.Config.export_max_bytes = export_max_bytes
+    config.Config.spool_dir = spool_dir
+    config.Config.spool_max_bytes = spool_max_bytes
+    config.Config.spool_segment_bytes = spool_segment_bytes
+    config.Config.spool_fsync = spool_fsync
+    config.Config.spool_high_water = spool_high_water
+    config.Config.count_tokens = count_tokens
+    config.Config.tokenizer = tokenizer
+    config.Config.defer_events = defer_events
+    config.Config.event_context_cache = event_context_cache
+    config.Config.event_context_ttl_ms = event_context_ttl_ms
 
     if config.Config.api_key is None:
         warnings.warn("`api_key` is not set and an API token was not provided on init")
@@ -34,6 +107,31 @@ def init(api_key=None, sync_mode=None, environment=None, event_context_hook=None
     if config.Config.sync_mode:
         logger.debug("Running in sync mode")
 
+    if config.Config.shutdown_on_exit:
+        # Unregister first so repeated init calls don't stack handlers.
+        atexit.unregister(_shutdown_at_exit)
+        atexit.register(_shutdown_at_exit)
+
+
+def flush(timeout: float = None) -> bool:
+    """Wait up to `timeout` seconds for queued events to be sent.
+
+    Returns True if every queued event was sent in time.
+    """
+    return queue.flush(timeout)
+
+
+def shutdown(timeout: float = None) -> bool:
+    """Send any queued events and stop the background workers, waiting up to
+    `timeout` seconds. Events tracked after shutdown are dropped.
+    """
+    return queue.shutdown(timeout)
+
+
+def _shutdown_at_exit():
+    if not shutdown(config.Config.shutdown_timeout_ms / 1000):
+        logger.warning("Timed out sending rosnik events before exit")
+
 
 @contextmanager
 def context(prompt_name: str = None, **kwargs):
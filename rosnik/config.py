@@ -6,15 +6,243 @@ API_KEY = f"{constants.NAMESPACE}_API_KEY"
 # we will send values synchronously.
 SYNC_MODE = f"{constants.NAMESPACE}_SYNC_MODE"
 ENVIRONMENT = f"{constants.NAMESPACE}_ENVIRONMENT"
+# Maximum number of events shipped in a single upload.
+# Defaults to 1, which sends each event on its own.
+BATCH_SIZE = f"{constants.NAMESPACE}_BATCH_SIZE"
+# How long the background worker waits to fill a batch before flushing it.
+FLUSH_INTERVAL_MS = f"{constants.NAMESPACE}_FLUSH_INTERVAL_MS"
+# Capacity of the in-memory event queue, by count and by approximate bytes.
+# 0 disables the respective limit.
+MAX_QUEUE_SIZE = f"{constants.NAMESPACE}_MAX_QUEUE_SIZE"
+MAX_QUEUE_BYTES = f"{constants.NAMESPACE}_MAX_QUEUE_BYTES"
+# What to do when the queue is full: drop_newest, drop_oldest, drop_priority or block.
+QUEUE_OVERFLOW_POLICY = f"{constants.NAMESPACE}_QUEUE_OVERFLOW_POLICY"
+# How long the `block` overflow policy waits for room before dropping the event.
+ENQUEUE_TIMEOUT_MS = f"{constants.NAMESPACE}_ENQUEUE_TIMEOUT_MS"
+# Number of background threads sending events.
+NUM_WORKERS = f"{constants.NAMESPACE}_NUM_WORKERS"
+# If set to a non-0 value, drain queued events when the process exits,
+# waiting up to SHUTDOWN_TIMEOUT_MS.
+SHUTDOWN_ON_EXIT = f"{constants.NAMESPACE}_SHUTDOWN_ON_EXIT"
+SHUTDOWN_TIMEOUT_MS = f"{constants.NAMESPACE}_SHUTDOWN_TIMEOUT_MS"
+# How many calling functions make up an AI event's function fingerprint.
+# 0 disables fingerprinting.
+FINGERPRINT_DEPTH = f"{constants.NAMESPACE}_FINGERPRINT_DEPTH"
+# Compress upload bodies with `gzip` or `zstd` (requires `zstandard`).
+# Unset or `none` sends them uncompressed.
+COMPRESSION = f"{constants.NAMESPACE}_COMPRESSION"
+# Bodies smaller than this many bytes are sent uncompressed.
+COMPRESSION_THRESHOLD = f"{constants.NAMESPACE}_COMPRESSION_THRESHOLD"
+# Consecutive failed uploads after which sends are paused, and for how long
+# before a single probe request checks whether the ingest API has recovered.
+# A threshold of 0 disables the circuit breaker.
+CIRCUIT_FAILURE_THRESHOLD = f"{constants.NAMESPACE}_CIRCUIT_FAILURE_THRESHOLD"
+CIRCUIT_RESET_TIMEOUT_MS = f"{constants.NAMESPACE}_CIRCUIT_RESET_TIMEOUT_MS"
+# Approximate size limits, in bytes, for request and response payloads.
+# Larger payloads are truncated before they're queued. 0 disables the limit.
+MAX_REQUEST_PAYLOAD_BYTES = f"{constants.NAMESPACE}_MAX_REQUEST_PAYLOAD_BYTES"
+MAX_RESPONSE_PAYLOAD_BYTES = f"{constants.NAMESPACE}_MAX_RESPONSE_PAYLOAD_BYTES"
+# Fraction of AI requests to track, between 0 and 1. Defaults to 1.
+# Per-model, per-action and per-environment rates can be passed to `init`
+# as `sample_rules`.
+SAMPLE_RATE = f"{constants.NAMESPACE}_SAMPLE_RATE"
+# If set to 0, failed requests are sampled like any other.
+# By default they're always tracked.
+SAMPLE_KEEP_ERRORS = f"{constants.NAMESPACE}_SAMPLE_KEEP_ERRORS"
+# If set to a non-0 value, every request in a journey is sampled the same way.
+SAMPLE_BY_JOURNEY = f"{constants.NAMESPACE}_SAMPLE_BY_JOURNEY"
+# Where to send events: a comma-separated list of `ingest` (the default),
+# `stdout`, `file` and `memory`. `init` also accepts an `Exporter`.
+EXPORTER = f"{constants.NAMESPACE}_EXPORTER"
+# NDJSON file written by the `file` exporter, and the size at which it's rotated.
+EXPORT_PATH = f"{constants.NAMESPACE}_EXPORT_PATH"
+EXPORT_MAX_BYTES = f"{constants.NAMESPACE}_EXPORT_MAX_BYTES"
+# Directory to spool events to when they can't be delivered. Unset disables spooling.
+SPOOL_DIR = f"{constants.NAMESPACE}_SPOOL_DIR"
+# Disk usage cap for the spool. The oldest segments are discarded past it.
+SPOOL_MAX_BYTES = f"{constants.NAMESPACE}_SPOOL_MAX_BYTES"
+# Size at which a spool segment is sealed and a new one started.
+SPOOL_SEGMENT_BYTES = f"{constants.NAMESPACE}_SPOOL_SEGMENT_BYTES"
+# When to fsync spool writes: always, segment or never.
+SPOOL_FSYNC = f"{constants.NAMESPACE}_SPOOL_FSYNC"
+# Once more than this many events are queued, workers spool new batches
+# instead of sending them. Defaults to half of MAX_QUEUE_SIZE.
+SPOOL_HIGH_WATER = f"{constants.NAMESPACE}_SPOOL_HIGH_WATER"
+# Set to 0 to stop counting tokens locally for streamed responses that don't
+# report usage. Counting needs `tiktoken`, or a `Tokenizer` passed to `init`.
+COUNT_TOKENS = f"{constants.NAMESPACE}_COUNT_TOKENS"
+# If set to a non-0 value, AI events are built by the background workers rather
+# than on the caller's thread, which only captures what they're built from.
+DEFER_EVENTS = f"{constants.NAMESPACE}_DEFER_EVENTS"
+# How long to reuse the result of `event_context_hook`: event (call it for every
+# event), request (once per request or journey) or ttl (for EVENT_CONTEXT_TTL_MS).
+EVENT_CONTEXT_CACHE = f"{constants.NAMESPACE}_EVENT_CONTEXT_CACHE"
+EVENT_CONTEXT_TTL_MS = f"{constants.NAMESPACE}_EVENT_CONTEXT_TTL_MS"
+
+_DEFAULT_BATCH_SIZE = 1
+_DEFAULT_FLUSH_INTERVAL_MS = 1000
+_DEFAULT_MAX_QUEUE_SIZE = 10_000
+_DEFAULT_QUEUE_OVERFLOW_POLICY = "drop_newest"
+_DEFAULT_ENQUEUE_TIMEOUT_MS = 100
+_DEFAULT_COMPRESSION_THRESHOLD = 1024
+_DEFAULT_NUM_WORKERS = 1
+_DEFAULT_SHUTDOWN_TIMEOUT_MS = 5000
+_DEFAULT_FINGERPRINT_DEPTH = 10
+_DEFAULT_CIRCUIT_FAILURE_THRESHOLD = 5
+_DEFAULT_CIRCUIT_RESET_TIMEOUT_MS = 30_000
+_DEFAULT_SAMPLE_RATE = 1.0
+_DEFAULT_EXPORT_PATH = "rosnik-events.ndjson"
+_DEFAULT_EXPORT_MAX_BYTES = 10 * 1024 * 1024
+_DEFAULT_SPOOL_MAX_BYTES = 100 * 1024 * 1024
+_DEFAULT_SPOOL_SEGMENT_BYTES = 4 * 1024 * 1024
+_DEFAULT_SPOOL_FSYNC = "segment"
+_DEFAULT_EVENT_CONTEXT_CACHE = "event"
+_DEFAULT_EVENT_CONTEXT_TTL_MS = 1000
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def _env_float(name):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return None
+    return float(value)
 
 
 class _Config:
-    def __init__(self, api_key=None, sync_mode=None, environment=None, event_context_hook=None):
+    def __init__(
+        self,
+        api_key=None,
+        sync_mode=None,
+        environment=None,
+        event_context_hook=None,
+        batch_size=None,
+        flush_interval_ms=None,
+        max_queue_size=None,
+        max_queue_bytes=None,
+        queue_overflow_policy=None,
+        enqueue_timeout_ms=None,
+        compression=None,
+        compression_threshold=None,
+        num_workers=None,
+        shutdown_on_exit=None,
+        shutdown_timeout_ms=None,
+        fingerprint_depth=None,
+        circuit_failure_threshold=None,
+        circuit_reset_timeout_ms=None,
+        max_request_payload_bytes=None,
+        max_response_payload_bytes=None,
+        sample_rate=None,
+        sample_rules=None,
+        sample_keep_errors=None,
+        sample_by_journey=None,
+        exporter=None,
+        export_path=None,
+        export_max_bytes=None,
+        spool_dir=None,
+        spool_max_bytes=None,
+        spool_segment_bytes=None,
+        spool_fsync=None,
+        spool_high_water=None,
+        count_tokens=None,
+        tokenizer=None,
+        defer_events=None,
+        event_context_cache=None,
+        event_context_ttl_ms=None,
+    ):
         self._api_key = api_key or os.environ.get(API_KEY)
         _sync = sync_mode or os.environ.get(SYNC_MODE)
         self._sync_mode = _sync and _sync != "0"
         self._environment = environment or os.environ.get(ENVIRONMENT)
         self._event_context_hook = event_context_hook
+        self._batch_size = batch_size or _env_int(BATCH_SIZE)
+        self._flush_interval_ms = flush_interval_ms or _env_int(FLUSH_INTERVAL_MS)
+        self._max_queue_size = (
+            max_queue_size if max_queue_size is not None else _env_int(MAX_QUEUE_SIZE)
+        )
+        self._max_queue_bytes = (
+            max_queue_bytes if max_queue_bytes is not None else _env_int(MAX_QUEUE_BYTES)
+        )
+        self._queue_overflow_policy = queue_overflow_policy or os.environ.get(QUEUE_OVERFLOW_POLICY)
+        self._enqueue_timeout_ms = (
+            enqueue_timeout_ms if enqueue_timeout_ms is not None else _env_int(ENQUEUE_TIMEOUT_MS)
+        )
+        self._compression = compression or os.environ.get(COMPRESSION)
+        self._compression_threshold = (
+            compression_threshold
+            if compression_threshold is not None
+            else _env_int(COMPRESSION_THRESHOLD)
+        )
+        self._num_workers = num_workers or _env_int(NUM_WORKERS)
+        _shutdown_on_exit = shutdown_on_exit or os.environ.get(SHUTDOWN_ON_EXIT)
+        self._shutdown_on_exit = _shutdown_on_exit and _shutdown_on_exit != "0"
+        self._shutdown_timeout_ms = (
+            shutdown_timeout_ms
+            if shutdown_timeout_ms is not None
+            else _env_int(SHUTDOWN_TIMEOUT_MS)
+        )
+        self._fingerprint_depth = (
+            fingerprint_depth if fingerprint_depth is not None else _env_int(FINGERPRINT_DEPTH)
+        )
+        self._circuit_failure_threshold = (
+            circuit_failure_threshold
+            if circuit_failure_threshold is not None
+            else _env_int(CIRCUIT_FAILURE_THRESHOLD)
+        )
+        self._circuit_reset_timeout_ms = (
+            circuit_reset_timeout_ms
+            if circuit_reset_timeout_ms is not None
+            else _env_int(CIRCUIT_RESET_TIMEOUT_MS)
+        )
+        self._max_request_payload_bytes = (
+            max_request_payload_bytes
+            if max_request_payload_bytes is not None
+            else _env_int(MAX_REQUEST_PAYLOAD_BYTES)
+        )
+        self._max_response_payload_bytes = (
+            max_response_payload_bytes
+            if max_response_payload_bytes is not None
+            else _env_int(MAX_RESPONSE_PAYLOAD_BYTES)
+        )
+        self._sample_rate = sample_rate if sample_rate is not None else _env_float(SAMPLE_RATE)
+        self._sample_rules = sample_rules
+        _keep_errors = (
+            sample_keep_errors
+            if sample_keep_errors is not None
+            else os.environ.get(SAMPLE_KEEP_ERRORS)
+        )
+        self._sample_keep_errors = (
+            None if _keep_errors is None else _keep_errors not in (False, "0", "")
+        )
+        _by_journey = sample_by_journey or os.environ.get(SAMPLE_BY_JOURNEY)
+        self._sample_by_journey = _by_journey and _by_journey != "0"
+        self._exporter = exporter or os.environ.get(EXPORTER)
+        self._export_path = export_path or os.environ.get(EXPORT_PATH)
+        self._export_max_bytes = (
+            export_max_bytes if export_max_bytes is not None else _env_int(EXPORT_MAX_BYTES)
+        )
+        self._spool_dir = spool_dir or os.environ.get(SPOOL_DIR)
+        self._spool_max_bytes = spool_max_bytes or _env_int(SPOOL_MAX_BYTES)
+        self._spool_segment_bytes = spool_segment_bytes or _env_int(SPOOL_SEGMENT_BYTES)
+        self._spool_fsync = spool_fsync or os.environ.get(SPOOL_FSYNC)
+        self._spool_high_water = (
+            spool_high_water if spool_high_water is not None else _env_int(SPOOL_HIGH_WATER)
+        )
+        _count_tokens = count_tokens if count_tokens is not None else os.environ.get(COUNT_TOKENS)
+        self._count_tokens = (
+            None if _count_tokens is None else _count_tokens not in (False, "0", "")
+        )
+        # Only configurable through `init`.
+        self._tokenizer = tokenizer
+        _defer = defer_events or os.environ.get(DEFER_EVENTS)
+        self._defer_events = _defer and _defer != "0"
+        self._event_context_cache = event_context_cache or os.environ.get(EVENT_CONTEXT_CACHE)
+        self._event_context_ttl_ms = event_context_ttl_ms or _env_int(EVENT_CONTEXT_TTL_MS)
 
     @property
     def api_key(self):
@@ -56,5 +284,367 @@ class _Config:
             return
         self._event_context_hook = value
 
+    @property
+    def batch_size(self):
+        return max(self._batch_size or _DEFAULT_BATCH_SIZE, 1)
+
+    @batch_size.setter
+    def batch_size(self, value):
+        if self._batch_size is not None:
+            return
+        self._batch_size = value
+
+    @property
+    def flush_interval_ms(self):
+        if self._flush_interval_ms is None:
+            return _DEFAULT_FLUSH_INTERVAL_MS
+        return self._flush_interval_ms
+
+    @flush_interval_ms.setter
+    def flush_interval_ms(self, value):
+        if self._flush_interval_ms is not None:
+            return
+        self._flush_interval_ms = value
+
+    @property
+    def max_queue_size(self):
+        if self._max_queue_size is None:
+            return _DEFAULT_MAX_QUEUE_SIZE
+        return self._max_queue_size
+
+    @max_queue_size.setter
+    def max_queue_size(self, value):
+        if self._max_queue_size is not None:
+            return
+        self._max_queue_size = value
+
+    @property
+    def max_queue_bytes(self):
+        return self._max_queue_bytes or 0
+
+    @max_queue_bytes.setter
+    def max_queue_bytes(self, value):
+        if self._max_queue_bytes is not None:
+            return
+        self._max_queue_bytes = value
+
+    @property
+    def queue_overflow_policy(self):
+        return self._queue_overflow_policy or _DEFAULT_QUEUE_OVERFLOW_POLICY
+
+    @queue_overflow_policy.setter
+    def queue_overflow_policy(self, value):
+        if self._queue_overflow_policy is not None:
+            return
+        self._queue_overflow_policy = value
+
+    @property
+    def enqueue_timeout_ms(self):
+        if self._enqueue_timeout_ms is None:
+            return _DEFAULT_ENQUEUE_TIMEOUT_MS
+        return self._enqueue_timeout_ms
+
+    @enqueue_timeout_ms.setter
+    def enqueue_timeout_ms(self, value):
+        if self._enqueue_timeout_ms is not None:
+            return
+        self._enqueue_timeout_ms = value
+
+    @property
+    def compression(self):
+        if not self._compression or self._compression == "none":
+            return None
+        return self._compression
+
+    @compression.setter
+    def compression(self, value):
+        if self._compression is not None:
+            return
+        self._compression = value
+
+    @property
+    def compression_threshold(self):
+        if self._compression_threshold is None:
+            return _DEFAULT_COMPRESSION_THRESHOLD
+        return self._compression_threshold
+
+    @compression_threshold.setter
+    def compression_threshold(self, value):
+        if self._compression_threshold is not None:
+            return
+        self._compression_threshold = value
+
+    @property
+    def num_workers(self):
+        return max(self._num_workers or _DEFAULT_NUM_WORKERS, 1)
+
+    @num_workers.setter
+    def num_workers(self, value):
+        if self._num_workers is not None:
+            return
+        self._num_workers = value
+
+    @property
+    def shutdown_on_exit(self):
+        return bool(self._shutdown_on_exit)
+
+    @shutdown_on_exit.setter
+    def shutdown_on_exit(self, value):
+        if self._shutdown_on_exit is not None:
+            return
+        self._shutdown_on_exit = value
+
+    @property
+    def shutdown_timeout_ms(self):
+        if self._shutdown_timeout_ms is None:
+            return _DEFAULT_SHUTDOWN_TIMEOUT_MS
+        return self._shutdown_timeout_ms
+
+    @shutdown_timeout_ms.setter
+    def shutdown_timeout_ms(self, value):
+        if self._shutdown_timeout_ms is not None:
+            return
+        self._shutdown_timeout_ms = value
+
+    @property
+    def fingerprint_depth(self):
+        if self._fingerprint_depth is None:
+            return _DEFAULT_FINGERPRINT_DEPTH
+        return self._fingerprint_depth
+
+    @fingerprint_depth.setter
+    def fingerprint_depth(self, value):
+        if self._fingerprint_depth is not None:
+            return
+        self._fingerprint_depth = value
+
+    @property
+    def circuit_failure_threshold(self):
+        if self._circuit_failure_threshold is None:
+            return _DEFAULT_CIRCUIT_FAILURE_THRESHOLD
+        return self._circuit_failure_threshold
+
+    @circuit_failure_threshold.setter
+    def circuit_failure_threshold(self, value):
+        if self._circuit_failure_threshold is not None:
+            return
+        self._circuit_failure_threshold = value
+
+    @property
+    def circuit_reset_timeout_ms(self):
+        if self._circuit_reset_timeout_ms is None:
+            return _DEFAULT_CIRCUIT_RESET_TIMEOUT_MS
+        return self._circuit_reset_timeout_ms
+
+    @circuit_reset_timeout_ms.setter
+    def circuit_reset_timeout_ms(self, value):
+        if self._circuit_reset_timeout_ms is not None:
+            return
+        self._circuit_reset_timeout_ms = value
+
+    @property
+    def max_request_payload_bytes(self):
+        return self._max_request_payload_bytes or 0
+
+    @max_request_payload_bytes.setter
+    def max_request_payload_bytes(self, value):
+        if self._max_request_payload_bytes is not None:
+            return
+        self._max_request_payload_bytes = value
+
+    @property
+    def max_response_payload_bytes(self):
+        return self._max_response_payload_bytes or 0
+
+    @max_response_payload_bytes.setter
+    def max_response_payload_bytes(self, value):
+        if self._max_response_payload_bytes is not None:
+            return
+        self._max_response_payload_bytes = value
+
+    @property
+    def sample_rate(self):
+        if self._sample_rate is None:
+            return _DEFAULT_SAMPLE_RATE
+        return self._sample_rate
+
+    @sample_rate.setter
+    def sample_rate(self, value):
+        if self._sample_rate is not None:
+            return
+        self._sample_rate = value
+
+    @property
+    def sample_rules(self):
+        return self._sample_rules
+
+    @sample_rules.setter
+    def sample_rules(self, value):
+        if self._sample_rules is not None:
+            return
+        self._sample_rules = value
+
+    @property
+    def sample_keep_errors(self):
+        if self._sample_keep_errors is None:
+            return True
+        return self._sample_keep_errors
+
+    @sample_keep_errors.setter
+    def sample_keep_errors(self, value):
+        if self._sample_keep_errors is not None:
+            return
+        self._sample_keep_errors = value
+
+    @property
+    def sample_by_journey(self):
+        return bool(self._sample_by_journey)
+
+    @sample_by_journey.setter
+    def sample_by_journey(self, value):
+        if self._sample_by_journey is not None:
+            return
+        self._sample_by_journey = value
+
+    @property
+    def exporter(self):
+        if not self._exporter:
+            return None
+        if isinstance(self._exporter, str):
+            return [name.strip() for name in self._exporter.split(",") if name.strip()]
+        return self._exporter
+
+    @exporter.setter
+    def exporter(self, value):
+        if self._exporter is not None:
+            return
+        self._exporter = value
+
+    @property
+    def export_path(self):
+        return self._export_path or _DEFAULT_EXPORT_PATH
+
+    @export_path.setter
+    def export_path(self, value):
+        if self._export_path is not None:
+            return
+        self._export_path = value
+
+    @property
+    def export_max_bytes(self):
+        if self._export_max_bytes is None:
+            return _DEFAULT_EXPORT_MAX_BYTES
+        return self._export_max_bytes
+
+    @export_max_bytes.setter
+    def export_max_bytes(self, value):
+        if self._export_max_bytes is not None:
+            return
+        self._export_max_bytes = value
+
+    @property
+    def spool_dir(self):
+        return self._spool_dir or None
+
+    @spool_dir.setter
+    def spool_dir(self, value):
+        if self._spool_dir is not None:
+            return
+        self._spool_dir = value
+
+    @property
+    def spool_max_bytes(self):
+        return self._spool_max_bytes or _DEFAULT_SPOOL_MAX_BYTES
+
+    @spool_max_bytes.setter
+    def spool_max_bytes(self, value):
+        if self._spool_max_bytes is not None:
+            return
+        self._spool_max_bytes = value
+
+    @property
+    def spool_segment_bytes(self):
+        return self._spool_segment_bytes or _DEFAULT_SPOOL_SEGMENT_BYTES
+
+    @spool_segment_bytes.setter
+    def spool_segment_bytes(self, value):
+        if self._spool_segment_bytes is not None:
+            return
+        self._spool_segment_bytes = value
+
+    @property
+    def spool_fsync(self):
+        return self._spool_fsync or _DEFAULT_SPOOL_FSYNC
+
+    @spool_fsync.setter
+    def spool_fsync(self, value):
+        if self._spool_fsync is not None:
+            return
+        self._spool_fsync = value
+
+    @property
+    def spool_high_water(self):
+        if self._spool_high_water is None:
+            return self.max_queue_size // 2
+        return self._spool_high_water
+
+    @spool_high_water.setter
+    def spool_high_water(self, value):
+        if self._spool_high_water is not None:
+            return
+        self._spool_high_water = value
+
+    @property
+    def count_tokens(self):
+        if self._count_tokens is None:
+            return True
+        return self._count_tokens
+
+    @count_tokens.setter
+    def count_tokens(self, value):
+        if self._count_tokens is not None:
+            return
+        self._count_tokens = value
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, value):
+        if self._tokenizer is not None:
+            return
+        self._tokenizer = value
+
+    @property
+    def defer_events(self):
+        return bool(self._defer_events)
+
+    @defer_events.setter
+    def defer_events(self, value):
+        if self._defer_events is not None:
+            return
+        self._defer_events = value
+
+    @property
+    def event_context_cache(self):
+        return self._event_context_cache or _DEFAULT_EVENT_CONTEXT_CACHE
+
+    @event_context_cache.setter
+    def event_context_cache(self, value):
+        if self._event_context_cache is not None:
+            return
+        self._event_context_cache = value
+
+    @property
+    def event_context_ttl_ms(self):
+        return self._event_context_ttl_ms or _DEFAULT_EVENT_CONTEXT_TTL_MS
+
+    @event_context_ttl_ms.setter
+    def event_context_ttl_ms(self, value):
+        if self._event_context_ttl_ms is not None:
+            return
+        self._event_context_ttl_ms = value
+
 
 Config = _Config()
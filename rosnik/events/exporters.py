@@ -0,0 +1,205 @@
+"""Destinations for events.
+
+`EventProcessor` hands every batch to an `Exporter`. By default that's the
+ingest API, but events can also be written to stdout, appended to rotating
+NDJSON files for later upload, kept in memory, or fanned out to several
+exporters at once.
+
+```py
+from rosnik.events import exporters
+
+rosnik.init(exporter=exporters.NDJSONFileExporter("/var/log/rosnik/events.ndjson"))
+```
+
+Or set `ROSNIK_EXPORTER` to a comma-separated list of `ingest`, `stdout`,
+`file` and `memory`.
+"""
+import logging
+import os
+import sys
+import threading
+from typing import List
+
+from rosnik import api, config, serialize
+from rosnik.types.core import Event
+
+logger = logging.getLogger(__name__)
+
+INGEST = "ingest"
+STDOUT = "stdout"
+FILE = "file"
+MEMORY = "memory"
+
+
+class Exporter:
+    """Base class for event destinations.
+
+    Subclasses implement `export_serialized`, and may override `export`
+    if they can do better than serializing each event with `serialize.to_dict`.
+    Both return False if the events couldn't be delivered.
+    """
+
+    def export(self, events: List[Event]) -> bool:
+        return self.export_serialized([serialize.to_dict(event) for event in events])
+
+    def export_serialized(self, payloads: List[dict]) -> bool:
+        raise NotImplementedError
+
+    def shutdown(self):
+        """Release any resources held by the exporter."""
+
+
+class IngestExporter(Exporter):
+    """Send events to the ingest API."""
+
+    def __init__(self, client: api.IngestClient = None):
+        self.client = client or api.IngestClient()
+
+    def export(self, events: List[Event]) -> bool:
+        if len(events) == 1:
+            return self.client.send_event(events[0])
+        return self.client.send_batch(events)
+
+    def export_serialized(self, payloads: List[dict]) -> bool:
+        return self.client.send_serialized_batch(payloads)
+
+
+class StdoutExporter(Exporter):
+    """Write each event as a line of JSON to stdout."""
+
+    def __init__(self, stream=None):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def export_serialized(self, payloads: List[dict]) -> bool:
+        # Resolve stdout late, so redirection (e.g. by test runners) is respected.
+        stream = self._stream or sys.stdout
+        data = "".join(serialize.dumps(payload).decode("utf-8") + "\n" for payload in payloads)
+        with self._lock:
+            stream.write(data)
+            stream.flush()
+        return True
+
+
+class NDJSONFileExporter(Exporter):
+    """Append events to an NDJSON file, rotating it once it reaches `max_bytes`.
+
+    Rotation works like `logging.handlers.RotatingFileHandler`: the full file
+    is renamed to `<path>.1`, older files shift up, and at most `backup_count`
+    are kept. A `max_bytes` of 0 disables rotation.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def export_serialized(self, payloads: List[dict]) -> bool:
+        data = b"".join(serialize.dumps(payload) + b"\n" for payload in payloads)
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._open()
+                if (
+                    self.max_bytes
+                    and self._file.tell()
+                    and self._file.tell() + len(data) > self.max_bytes
+                ):
+                    self._rotate()
+                    self._open()
+                self._file.write(data)
+                self._file.flush()
+        except OSError as e:
+            logger.warning(f"Failed to write {len(payloads)} events to {self.path}: {e}")
+            return False
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class InMemoryExporter(Exporter):
+    """Keep serialized events in `events`. Useful in tests and benchmarks."""
+
+    def __init__(self):
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+
+    def export_serialized(self, payloads: List[dict]) -> bool:
+        with self._lock:
+            self.events.extend(payloads)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+
+class FanOutExporter(Exporter):
+    """Send every batch to each of `exporters`.
+
+    Returns False if any of them failed. Retrying then resends to all of
+    them, so the others may receive duplicates.
+    """
+
+    def __init__(self, exporters: List[Exporter]):
+        self.exporters = exporters
+
+    def export(self, events: List[Event]) -> bool:
+        # Serialize once, unless an exporter has its own way of sending events.
+        payloads = None
+        delivered = True
+        for exporter in self.exporters:
+            if type(exporter).export is not Exporter.export:
+                delivered = exporter.export(events) and delivered
+                continue
+            if payloads is None:
+                payloads = [serialize.to_dict(event) for event in events]
+            delivered = exporter.export_serialized(payloads) and delivered
+        return delivered
+
+    def export_serialized(self, payloads: List[dict]) -> bool:
+        delivered = True
+        for exporter in self.exporters:
+            delivered = exporter.export_serialized(payloads) and delivered
+        return delivered
+
+    def shutdown(self):
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+
+def create(name: str) -> Exporter:
+    """Create one of the built-in exporters, other than `ingest`, by name."""
+    if name == STDOUT:
+        return StdoutExporter()
+    if name == FILE:
+        return NDJSONFileExporter(
+            config.Config.export_path, max_bytes=config.Config.export_max_bytes
+        )
+    if name == MEMORY:
+        return InMemoryExporter()
+    raise ValueError(f"Unknown rosnik exporter: {name}")
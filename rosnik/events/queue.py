@@ -1,54 +1,648 @@
+import asyncio
+import collections
+import contextvars
 import logging
 import threading
+import time
 import queue
 import os
+from enum import Enum
+from typing import Callable, Optional
 
 from rosnik import api
 from rosnik import config
-from rosnik.types.core import Event
+from rosnik import serialize
+from rosnik import state
+from rosnik.events import exporters, truncate
+from rosnik.events.spool import Spool
+from rosnik.types.core import Event, _generate_event_id
 
 logger = logging.getLogger(__name__)
 
 
+class OverflowPolicy(str, Enum):
+    DROP_NEWEST = "drop_newest"
+    DROP_OLDEST = "drop_oldest"
+    DROP_PRIORITY = "drop_priority"
+    BLOCK = "block"
+
+
+# Lower values are shed first under the `drop_priority` policy.
+_EVENT_PRIORITIES = {
+    "ai.request.start.stream": 0,
+    "ai.request.start": 1,
+    "ai.request.finish": 2,
+}
+_DEFAULT_PRIORITY = 1
+# Tells a worker to exit once it has drained everything queued ahead of it.
+_STOP = object()
+_STOP_PRIORITY = max(_EVENT_PRIORITIES.values()) + 1
+# Rough fixed cost of an event's own fields, on top of its payloads.
+_EVENT_OVERHEAD_BYTES = 512
+# Spooled events are replayed through the batch endpoint at least this many at a time.
+_REPLAY_BATCH_SIZE = 100
+
+
+def _approximate_event_size(event: Event) -> int:
+    size = _EVENT_OVERHEAD_BYTES
+    for attr in ("request_payload", "response_payload", "context"):
+        payload = getattr(event, attr, None)
+        if payload:
+            size += truncate.approximate_size(payload)
+    return size
+
+
+class Deferred:
+    """Stands in for an event in the queue, keeping work off the thread that
+    enqueued it. A worker resolves it into the event just before it's sent.
+
+    Either wraps an `event` that `prepare` finishes off, e.g. by counting
+    tokens, or holds the `fields` to build one with `build`. Building runs in
+    `context`, a snapshot of the enqueuing thread's contextvars, so the event
+    picks up the same journey, user interaction and context it would have had.
+    Until then, attributes are read from `fields`.
+    """
+
+    __slots__ = ("event", "prepare", "build", "fields", "context")
+
+    def __init__(
+        self,
+        event: Event = None,
+        prepare: Callable[[Event], None] = None,
+        build: Callable[..., Event] = None,
+        fields: dict = None,
+        context: contextvars.Context = None,
+    ):
+        self.event = event
+        self.prepare = prepare
+        self.build = build
+        self.fields = fields
+        self.context = context
+
+    def __getattr__(self, name):
+        # The worker sets `event` before it clears `fields`.
+        fields = self.fields
+        if fields is not None and name in fields:
+            return fields[name]
+        if self.event is None:
+            raise AttributeError(name)
+        return getattr(self.event, name)
+
+    def resolve(self) -> Optional[Event]:
+        if self.event is None:
+            try:
+                event = self.context.run(self.build, **self.fields)
+            except Exception:
+                logger.exception(f"Failed to build event {self.fields.get('event_id')}")
+                return None
+            truncate.truncate_event(event)
+            self.event = event
+            # Let go of the caller's objects as soon as we're done with them.
+            self.build = self.fields = self.context = None
+        if self.prepare is not None:
+            try:
+                self.prepare(self.event)
+            except Exception:
+                # Better to send the event as it is than not at all.
+                logger.exception(f"Failed to prepare event {self.event.event_id}")
+        return self.event
+
+
+def _resolve(events: list) -> list:
+    resolved = []
+    for event in events:
+        if isinstance(event, Deferred):
+            event = event.resolve()
+            if event is None:
+                continue
+        resolved.append(event)
+    return resolved
+
+
+class EventQueue(queue.Queue):
+    """FIFO queue that enforces a capacity by event count and approximate bytes,
+    applying an `OverflowPolicy` when an event doesn't fit.
+
+    Items are stored alongside their size and priority so that eviction and
+    byte accounting don't need to recompute them.
+    """
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self.bytes = 0
+        self.dropped = collections.Counter()
+        self._priority_counts = collections.Counter()
+
+    def put(self, event, block=True, timeout=None):
+        """Unbounded put that bypasses capacity checks; prefer `offer`."""
+        priority = _EVENT_PRIORITIES.get(event.event_type, _DEFAULT_PRIORITY)
+        super().put((0, priority, event), block=block, timeout=timeout)
+
+    def put_stop(self):
+        super().put((0, _STOP_PRIORITY, _STOP))
+
+    def record_dropped(self, events):
+        """Count events that were dequeued but couldn't be delivered."""
+        with self.mutex:
+            for event in events:
+                self.dropped[event.event_type] += 1
+
+    def join(self, timeout=None) -> bool:
+        """Wait until every queued event has been processed.
+
+        Returns False if `timeout` seconds elapse first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                if deadline is None:
+                    self.all_tasks_done.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.all_tasks_done.wait(remaining)
+        return True
+
+    def _put(self, item):
+        size, priority, _ = item
+        self.queue.append(item)
+        self.bytes += size
+        self._priority_counts[priority] += 1
+
+    def _get(self):
+        size, priority, event = self.queue.popleft()
+        self.bytes -= size
+        self._priority_counts[priority] -= 1
+        return event
+
+    def _fits(self, size, max_events, max_bytes):
+        # Always accept an event into an empty queue, even an oversized one.
+        if not self.queue:
+            return True
+        if max_events and len(self.queue) >= max_events:
+            return False
+        if max_bytes and self.bytes + size > max_bytes:
+            return False
+        return True
+
+    def _enqueue(self, item):
+        self._put(item)
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+
+    def _evict(self, index):
+        size, priority, event = self.queue[index]
+        del self.queue[index]
+        self.bytes -= size
+        self._priority_counts[priority] -= 1
+        self.dropped[event.event_type] += 1
+        # The evicted event will never be processed, so mark it done.
+        self.unfinished_tasks -= 1
+        if self.unfinished_tasks == 0:
+            self.all_tasks_done.notify_all()
+
+    def _evict_lower_priority(self, priority):
+        """Evict the oldest event of the lowest priority below `priority`."""
+        for lower in range(priority):
+            if self._priority_counts[lower] <= 0:
+                continue
+            for index, (_, item_priority, _) in enumerate(self.queue):
+                if item_priority == lower:
+                    self._evict(index)
+                    return True
+        return False
+
+    def offer(
+        self,
+        event: Event,
+        policy=OverflowPolicy.DROP_NEWEST,
+        max_events=0,
+        max_bytes=0,
+        timeout=0.0,
+    ) -> bool:
+        """Add `event` to the queue, returning False if it was dropped."""
+        size = _approximate_event_size(event) if max_bytes else 0
+        priority = _EVENT_PRIORITIES.get(event.event_type, _DEFAULT_PRIORITY)
+        item = (size, priority, event)
+        with self.not_full:
+            if policy == OverflowPolicy.BLOCK:
+                deadline = time.monotonic() + timeout
+                while not self._fits(size, max_events, max_bytes):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.dropped[event.event_type] += 1
+                        return False
+                    self.not_full.wait(remaining)
+            elif policy == OverflowPolicy.DROP_OLDEST:
+                while not self._fits(size, max_events, max_bytes):
+                    self._evict(0)
+            elif policy == OverflowPolicy.DROP_PRIORITY:
+                while not self._fits(size, max_events, max_bytes):
+                    if not self._evict_lower_priority(priority):
+                        self.dropped[event.event_type] += 1
+                        return False
+            elif not self._fits(size, max_events, max_bytes):
+                self.dropped[event.event_type] += 1
+                return False
+
+            self._enqueue(item)
+            return True
+
+
 class EventProcessor(threading.Thread):
-    def __init__(self, queue: queue.Queue, api_client: api.IngestClient):
+    def __init__(
+        self,
+        queue: queue.Queue,
+        api_client: api.IngestClient,
+        spool: Spool = None,
+        exporter: exporters.Exporter = None,
+    ):
         super().__init__()
         self.daemon = True
         self.started = False
         self.event_queue = queue
         self.api_client = api_client
+        self.spool = spool
+        # Without an explicit exporter, send to the ingest API with our own client.
+        self.exporter = exporter or exporters.IngestExporter(api_client)
         self.pid = os.getpid()
+        self.stopped = False
 
     def run(self):
         self.started = True
         self.process_events()
 
     def process_events(self):
-        while True:
-            event = self.event_queue.get()
-            self.api_client.send_event(event)
+        while not self.stopped:
+            events = self.next_batch()
+            try:
+                self.send(events)
+            except Exception:
+                logger.exception(f"Failed to send {len(events)} events")
+            finally:
+                for _ in events:
+                    self.event_queue.task_done()
+
+    def send(self, events):
+        if not events:
+            # Idle. Use the time to catch up on spooled events.
+            self.replay()
+            return
+        events = _resolve(events)
+        try:
+            delivered = self._deliver(events)
+        except (TypeError, ValueError):
+            # Raised by the JSON encoder, which would lose the whole batch
+            # for one bad event. Drop only the events it can't encode.
+            events = _drop_unencodable(events, self.event_queue)
+            delivered = bool(events) and self._deliver(events)
+        if delivered:
+            # The endpoint is reachable, so replay a batch of spooled events.
+            self.replay()
 
+    def _deliver(self, events) -> bool:
+        """Export `events`, or spool them. Returns True if they were exported."""
+        if self.spool is not None and self._above_high_water():
+            # We're falling behind. Park the batch on disk rather than
+            # letting the queue overflow and drop events.
+            self.spool.write([serialize.to_dict(event) for event in events])
+            return False
+        if self.exporter.export(events):
+            return True
+        if self.spool is not None:
+            self.spool.write([serialize.to_dict(event) for event in events])
+        else:
+            self.event_queue.record_dropped(events)
+        return False
 
-event_queue = queue.Queue()
+    def _above_high_water(self):
+        high_water = config.Config.spool_high_water
+        return bool(high_water) and self.event_queue.qsize() > high_water
+
+    def replay(self):
+        """Send the next batch of spooled events, if any."""
+        if self.spool is None or not self.spool.pending():
+            return
+        # Another worker is already replaying, and would be sending the same batch.
+        if not self.spool.replay_lock.acquire(blocking=False):
+            return
+        try:
+            payloads = self.spool.read_batch(max(config.Config.batch_size, _REPLAY_BATCH_SIZE))
+            # Left unacknowledged on failure, so the same batch is retried next time.
+            if not payloads or self.exporter.export_serialized(payloads):
+                self.spool.ack()
+        finally:
+            self.spool.replay_lock.release()
+
+    def _get(self, timeout=None):
+        event = self.event_queue.get(timeout=timeout)
+        if event is _STOP:
+            self.event_queue.task_done()
+            self.stopped = True
+        return event
+
+    def next_batch(self):
+        """Block until an event is available, then keep draining until we either
+        fill a batch or the flush interval elapses.
+
+        While there are spooled events to replay, give up waiting after one
+        flush interval and return an empty batch instead.
+        """
+        flush_interval = config.Config.flush_interval_ms / 1000
+        try:
+            event = self._get(timeout=flush_interval if self._has_spooled() else None)
+        except queue.Empty:
+            return []
+        if self.stopped:
+            return []
+        events = [event]
+        batch_size = config.Config.batch_size
+        deadline = time.monotonic() + flush_interval
+        while len(events) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = self._get(timeout=remaining)
+            except queue.Empty:
+                break
+            if self.stopped:
+                break
+            events.append(event)
+        return events
+
+    def _has_spooled(self):
+        return self.spool is not None and self.spool.pending()
+
+
+event_queue = EventQueue()
 api_client = api.IngestClient()
-event_processor = None
+# Sender threads sharing `event_queue`.
+event_processors = []
+# Shared by the workers when `spool_dir` is configured.
+spool = None
+# Non-ingest exporters built from config, shared by the workers and sync mode.
+_shared_exporters = {}
+_processors_lock = threading.Lock()
+_is_shutdown = False
+_pid = os.getpid()
+
+
+def _reinit_after_fork():
+    """Threads don't survive a fork, and the parent's queue, locks and pooled
+    connections can't be shared with the child, so rebuild them. Events the
+    parent had queued stay with the parent.
+    """
+    global event_queue, api_client, event_processors, spool, _processors_lock, _pid
+    global _shared_exporters
+    _pid = os.getpid()
+    event_queue = EventQueue()
+    api_client = api.IngestClient()
+    event_processors = []
+    # The parent keeps its open segment. The child starts its own.
+    spool = None
+    _shared_exporters = {}
+    _processors_lock = threading.Lock()
+
 
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def _build_exporter(client: api.IngestClient):
+    """Build the configured exporter around `client`.
+
+    Returns None for the default of sending to the ingest API.
+    """
+    configured = config.Config.exporter
+    if configured is None or isinstance(configured, exporters.Exporter):
+        return configured
+    built = []
+    for name in configured:
+        if name == exporters.INGEST:
+            built.append(exporters.IngestExporter(client))
+            continue
+        if name not in _shared_exporters:
+            _shared_exporters[name] = exporters.create(name)
+        built.append(_shared_exporters[name])
+    if len(built) == 1:
+        return built[0]
+    return exporters.FanOutExporter(built)
+
+
+def _start_processors():
+    global spool
+    with _processors_lock:
+        if event_processors:
+            return
+        if spool is None and config.Config.spool_dir:
+            spool = Spool(
+                config.Config.spool_dir,
+                max_bytes=config.Config.spool_max_bytes,
+                segment_bytes=config.Config.spool_segment_bytes,
+                fsync=config.Config.spool_fsync,
+            )
+        num_workers = config.Config.num_workers
+        logger.debug(f"Starting {num_workers} event processor(s).")
+        # Workers share a breaker so they stop sending together during an outage.
+        circuit_breaker = api.CircuitBreaker()
+        for _ in range(num_workers):
+            # requests.Session isn't thread-safe, so each worker gets its own client.
+            client = api.IngestClient(circuit_breaker=circuit_breaker)
+            processor = EventProcessor(event_queue, client, spool, _build_exporter(client))
+            processor.start()
+            event_processors.append(processor)
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _drop_unencodable(events, event_queue: EventQueue) -> list:
+    """Return the events that can be encoded as JSON, counting the rest as dropped."""
+    encodable = []
+    for event in events:
+        try:
+            serialize.dumps(serialize.to_dict(event))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Dropping event {event.event_id} that can't be encoded as JSON: {e}")
+            event_queue.record_dropped([event])
+            continue
+        encodable.append(event)
+    return encodable
+
+
+def _export_sync(event: Event):
+    exporter = _build_exporter(api_client)
+    try:
+        if exporter is None:
+            api_client.send_event(event)
+            return
+        exporter.export([event])
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Dropping event {event.event_id} that can't be encoded as JSON: {e}")
+        event_queue.record_dropped([event])
+
+
+def _check_fork():
+    # Covers forks that bypass `os.register_at_fork`, e.g. from C extensions.
+    if _pid != os.getpid():
+        logger.debug("Detected a fork. Rebuilding the event pipeline.")
+        _reinit_after_fork()
+
+
+def _offer(event):
+    if _is_shutdown:
+        logger.debug(f"Dropping event {event.event_id} enqueued after shutdown")
+        return
+
+    # If we're sending events in the background, start the worker threads.
+    if not event_processors:
+        _start_processors()
+
+    policy = config.Config.queue_overflow_policy
+    timeout = config.Config.enqueue_timeout_ms / 1000
+    if policy == OverflowPolicy.BLOCK and _in_event_loop():
+        # Never stall an event loop waiting for room in the queue.
+        timeout = 0
+
+    logger.debug(f"Enqueuing event {event.event_id}")
+    enqueued = event_queue.offer(
+        event,
+        policy=policy,
+        max_events=config.Config.max_queue_size,
+        max_bytes=config.Config.max_queue_bytes,
+        timeout=timeout,
+    )
+    if not enqueued:
+        logger.warning("rosnik events queue is full")
+
+
+def enqueue_event(event: Event, prepare: Callable[[Event], None] = None):
+    """Queue `event` to be sent in the background.
+
+    `prepare`, if given, is called with the event on the worker just before it's sent.
+    """
+    _check_fork()
+
+    # Shrink oversized payloads first, so the originals can be freed right away.
+    truncate.truncate_event(event)
 
-def enqueue_event(event: Event):
     if config.Config.sync_mode:
         logger.debug(f"Enqueuing event in sync mode: {event.event_id}")
-        api_client.send_event(event)
+        if prepare is not None:
+            event = Deferred(event=event, prepare=prepare).resolve()
+        _export_sync(event)
         return
 
-    global event_processor
-    # If we're sending events in the background, start this thread.
-    if event_processor is None:
-        logger.debug("Event processor is None. Starting a new one.")
-        event_processor = EventProcessor(event_queue, api_client)
-        event_processor.start()
+    _offer(event if prepare is None else Deferred(event=event, prepare=prepare))
 
-    try:
-        logger.debug(f"Enqueuing event {event.event_id}")
-        event_queue.put(event, block=False)
-    except queue.Full:
-        logger.warning("rosnik events queue is full")
+
+def capture_payload(payload):
+    """Copy the containers of a request payload, so the caller's later changes,
+    such as appending the reply to `messages`, don't reach it. Strings and
+    other values are shared, so this is cheap even for large prompts.
+    """
+    if not isinstance(payload, dict):
+        return payload
+    captured = {}
+    for key, value in payload.items():
+        if isinstance(value, list):
+            value = [dict(item) if isinstance(item, dict) else item for item in value]
+        captured[key] = value
+    return captured
+
+
+def enqueue_new_event(
+    cls,
+    fields: dict,
+    build: Callable[..., Event] = None,
+    prepare: Callable[[Event], None] = None,
+):
+    """Create an event of type `cls` by calling `build` (`cls` itself by
+    default) with `fields`, and queue it.
+
+    With `defer_events` set, only the event ID, time and state IDs are captured
+    now, along with a snapshot of the caller's contextvars. A worker builds
+    the event later, so `build` must only depend on `fields`, and any
+    `request_payload` is copied with `capture_payload`. Returns the event, or
+    a `Deferred` standing in for it.
+    """
+    build = build or cls
+    if not config.Config.defer_events or config.Config.sync_mode:
+        event = build(**fields)
+        enqueue_event(event, prepare)
+        return event
+
+    _check_fork()
+    fields.setdefault("event_type", cls.__dataclass_fields__["event_type"].default)
+    fields.setdefault("event_id", _generate_event_id())
+    fields.setdefault("sent_at", int(time.time_ns() / 1000000))
+    # A new journey is stored in the caller's context, so it can't wait for the worker.
+    fields.setdefault("journey_id", state.get_journey_id())
+    # Captured too, so later events, such as a stream's finish, can copy them.
+    current = state.snapshot()
+    fields.setdefault("user_interaction_id", current.user_interaction_id)
+    fields.setdefault("device_id", current.device_id)
+    if "request_payload" in fields:
+        # It's the caller's kwargs, which they may change before the worker gets to it.
+        fields["request_payload"] = capture_payload(fields["request_payload"])
+    deferred = Deferred(
+        prepare=prepare, build=build, fields=fields, context=contextvars.copy_context()
+    )
+    _offer(deferred)
+    return deferred
+
+
+def flush(timeout=None) -> bool:
+    """Block until every queued event has been sent, or `timeout` seconds pass.
+
+    Returns True if the queue was fully drained.
+    """
+    return event_queue.join(timeout)
+
+
+def shutdown(timeout=None) -> bool:
+    """Stop accepting events, drain the queue and stop the worker threads.
+
+    Returns True if every worker finished within `timeout` seconds.
+    """
+    global _is_shutdown
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _processors_lock:
+        _is_shutdown = True
+        # Each worker exits when it reaches a stop marker, which sits behind
+        # everything already queued.
+        for _ in event_processors:
+            event_queue.put_stop()
+        for processor in event_processors:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            processor.join(remaining)
+        finished = not any(processor.is_alive() for processor in event_processors)
+        event_processors.clear()
+        if spool is not None:
+            # Seal the segment being written so the next process can replay it.
+            spool.close()
+        _shutdown_exporters()
+    return finished
+
+
+def _shutdown_exporters():
+    configured = config.Config.exporter
+    if isinstance(configured, exporters.Exporter):
+        configured.shutdown()
+    for exporter in _shared_exporters.values():
+        exporter.shutdown()
+
+
+def dropped_events() -> dict:
+    """Number of events dropped because the queue was full or they couldn't be
+    delivered, keyed by event type.
+    """
+    with event_queue.mutex:
+        return dict(event_queue.dropped)
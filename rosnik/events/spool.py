@@ -0,0 +1,260 @@
+"""Durable on-disk spool for events that couldn't be delivered.
+
+Events are appended as NDJSON to segment files in a spool directory.
+Segments move through three states, encoded in their file names:
+
+- `<stem>.open`: the segment a process is currently appending to.
+- `<stem>.ndjson`: a sealed segment, ready to be replayed.
+- `<stem>.<pid>.replay`: a sealed segment claimed by process `<pid>` for replay.
+
+`stem` is `<time_ns>-<pid of the writer>`, so segments sort oldest first.
+Claiming a segment is an atomic rename, so several processes can share a
+spool directory. Segments left behind by processes that died are sealed
+again on startup, which makes delivery at-least-once: a segment that was
+partially replayed before a crash is replayed in full.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from enum import Enum
+from typing import List
+
+from rosnik import serialize
+
+logger = logging.getLogger(__name__)
+
+_OPEN = ".open"
+_SEALED = ".ndjson"
+_REPLAY = ".replay"
+
+
+class FsyncPolicy(str, Enum):
+    # fsync after every write.
+    ALWAYS = "always"
+    # fsync when a segment is sealed.
+    SEGMENT = "segment"
+    # Leave it to the OS.
+    NEVER = "never"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Spool:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 100 * 1024 * 1024,
+        segment_bytes: int = 4 * 1024 * 1024,
+        fsync=FsyncPolicy.SEGMENT,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        # Number of events discarded to stay under `max_bytes`.
+        self.dropped = 0
+        self._lock = threading.Lock()
+        # Held by the worker replaying a batch, as `read_batch` hands the same
+        # events to every caller until they're acknowledged.
+        self.replay_lock = threading.Lock()
+        self._active = None
+        self._active_path = None
+        self._active_bytes = 0
+        # [path, lines, offset, lines handed out by read_batch] of the segment being replayed.
+        self._replaying = None
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._bytes = self._disk_usage()
+        # Bytes in segments this process can replay. Others' open and claimed
+        # segments count towards `max_bytes`, but aren't pending here.
+        self._claimable_bytes = self._claimable_usage()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _size(paths) -> int:
+        total = 0
+        for path in paths:
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _disk_usage(self) -> int:
+        patterns = (f"*{_OPEN}", f"*{_SEALED}", f"*{_REPLAY}")
+        return self._size(path for pattern in patterns for path in glob.glob(self._path(pattern)))
+
+    def _claimable_usage(self) -> int:
+        """Size of the sealed segments, and of this process's own."""
+        paths = self._sealed_segments()
+        paths += glob.glob(self._path(f"*.{os.getpid()}{_REPLAY}"))
+        if self._active_path is not None:
+            paths.append(self._active_path)
+        return self._size(paths)
+
+    def _sealed_segments(self) -> List[str]:
+        return sorted(glob.glob(self._path(f"*{_SEALED}")))
+
+    def _recover(self):
+        """Seal segments that were open or being replayed by processes that are gone."""
+        for path in glob.glob(self._path(f"*{_OPEN}")) + glob.glob(self._path(f"*{_REPLAY}")):
+            name = os.path.basename(path)
+            if name.endswith(_OPEN):
+                stem = name[: -len(_OPEN)]
+                owner = stem.rsplit("-", 1)[-1]
+            else:
+                stem, owner = name[: -len(_REPLAY)].rsplit(".", 1)
+            try:
+                owner_pid = int(owner)
+            except ValueError:
+                continue
+            if owner_pid != os.getpid() and _pid_alive(owner_pid):
+                continue
+            try:
+                os.rename(path, self._path(stem + _SEALED))
+            except FileNotFoundError:
+                # Another process recovered it first.
+                pass
+
+    def _open_segment(self):
+        stem = f"{time.time_ns():020d}-{os.getpid()}"
+        self._active_path = self._path(stem + _OPEN)
+        self._active = open(self._active_path, "ab")
+        self._active_bytes = 0
+
+    def _seal(self):
+        if self._active is None:
+            return
+        self._active.flush()
+        if self.fsync != FsyncPolicy.NEVER:
+            os.fsync(self._active.fileno())
+        self._active.close()
+        os.rename(self._active_path, self._active_path[: -len(_OPEN)] + _SEALED)
+        self._active = None
+        self._active_path = None
+        self._active_bytes = 0
+        # Resync with anything other processes wrote to the directory.
+        self._bytes = self._disk_usage()
+        self._claimable_bytes = self._claimable_usage()
+
+    def _evict_oldest(self) -> bool:
+        for path in self._sealed_segments():
+            try:
+                with open(path, "rb") as f:
+                    contents = f.read()
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.dropped += contents.count(b"\n")
+            self._bytes -= len(contents)
+            self._claimable_bytes -= len(contents)
+            logger.warning(f"rosnik spool is full. Discarded {path}")
+            return True
+        return False
+
+    def write(self, payloads: List[dict]) -> bool:
+        """Append serialized events to the spool.
+
+        Returns False if they were dropped because the spool is full.
+        """
+        if not payloads:
+            return True
+        data = b"".join(serialize.dumps(payload) + b"\n" for payload in payloads)
+        with self._lock:
+            while self._bytes + len(data) > self.max_bytes:
+                if not self._evict_oldest():
+                    self.dropped += len(payloads)
+                    logger.warning(f"rosnik spool is full. Dropped {len(payloads)} events")
+                    return False
+            if self._active is None:
+                self._open_segment()
+            self._active.write(data)
+            self._active.flush()
+            if self.fsync == FsyncPolicy.ALWAYS:
+                os.fsync(self._active.fileno())
+            self._active_bytes += len(data)
+            self._bytes += len(data)
+            self._claimable_bytes += len(data)
+            if self._active_bytes >= self.segment_bytes:
+                self._seal()
+        return True
+
+    def pending(self) -> bool:
+        """Whether there may be spooled events waiting to be replayed by this process."""
+        return self._claimable_bytes > 0
+
+    def _claim(self) -> bool:
+        for path in self._sealed_segments():
+            claimed = f"{path[: -len(_SEALED)]}.{os.getpid()}{_REPLAY}"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Another process claimed it first.
+                continue
+            with open(claimed, "rb") as f:
+                lines = f.read().splitlines()
+            self._replaying = [claimed, lines, 0, 0]
+            return True
+        return False
+
+    def read_batch(self, max_events: int) -> List[dict]:
+        """Return up to `max_events` of the oldest spooled events.
+
+        The same events are returned until they're acknowledged with `ack`.
+        """
+        with self._lock:
+            if self._replaying is None and not self._claim():
+                # Nothing sealed yet. Seal what we're writing so it can be replayed.
+                if not self._active_bytes:
+                    # Other processes may have claimed what we counted.
+                    self._claimable_bytes = self._claimable_usage()
+                    return []
+                self._seal()
+                if not self._claim():
+                    return []
+            _, lines, offset, _ = self._replaying
+            batch = lines[offset : offset + max_events]
+            self._replaying[3] = len(batch)
+            payloads = []
+            for line in batch:
+                try:
+                    payloads.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping malformed line in rosnik spool")
+            return payloads
+
+    def ack(self):
+        """Mark the events from the last `read_batch` as delivered."""
+        with self._lock:
+            if self._replaying is None:
+                return
+            self._replaying[2] += self._replaying[3]
+            self._replaying[3] = 0
+            path, lines, offset, _ = self._replaying
+            if offset < len(lines):
+                return
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._bytes -= size
+                self._claimable_bytes -= size
+            except FileNotFoundError:
+                pass
+            self._replaying = None
+
+    def close(self):
+        with self._lock:
+            self._seal()
@@ -0,0 +1,163 @@
+"""Size limits for request and response payloads.
+
+Long message histories can make a single payload hundreds of KB. Payloads
+over their limit are shrunk deterministically before the event is queued:
+
+1. Every string is capped at the largest length that fits the limit,
+   keeping its head and tail around a marker of how much was cut.
+2. If that isn't enough, lists are capped the same way, keeping their
+   first and last items.
+
+Nothing is mutated in place. Containers are copied only along the paths
+that change, so the caller's kwargs are left untouched and anything we
+don't keep can be reclaimed as soon as the event is queued.
+"""
+from typing import List, Tuple
+
+from rosnik import config
+from rosnik.types.core import Event
+
+# Payload fields that limits apply to, and the config option holding each limit.
+_LIMITED_FIELDS = {
+    "request_payload": "max_request_payload_bytes",
+    "response_payload": "max_response_payload_bytes",
+}
+# Strings are never cut shorter than this, so truncated text stays legible.
+_MIN_STRING_LENGTH = 64
+_MIN_LIST_LENGTH = 2
+_MARKER = "…[{} chars truncated]…"
+
+
+def approximate_size(value) -> int:
+    """Cheap estimate of how many bytes `value` would take once serialized."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k)) + approximate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(approximate_size(v) for v in value)
+    return 8
+
+
+def _truncate_string(value: str, max_length: int) -> str:
+    cut = len(value) - max_length
+    head = max_length - max_length // 2
+    tail = max_length // 2
+    return value[:head] + _MARKER.format(cut) + (value[-tail:] if tail else "")
+
+
+def _cap(value, max_string, max_list):
+    """Return `value` with strings and lists capped, and its approximate size.
+
+    Returns `value` itself if nothing needed capping.
+    """
+    if isinstance(value, str):
+        if max_string is not None and len(value) > max_string:
+            value = _truncate_string(value, max_string)
+        return value, len(value)
+    if isinstance(value, dict):
+        capped = None
+        size = 0
+        for key, item in value.items():
+            new_item, item_size = _cap(item, max_string, max_list)
+            size += len(str(key)) + item_size
+            if new_item is not item:
+                if capped is None:
+                    capped = dict(value)
+                capped[key] = new_item
+        return (value if capped is None else capped), size
+    if isinstance(value, (list, tuple)):
+        items = value
+        if max_list is not None and len(value) > max_list:
+            head = max_list - max_list // 2
+            tail = max_list // 2
+            items = list(value[:head]) + (list(value[-tail:]) if tail else [])
+        capped = None if items is value else list(items)
+        size = 0
+        for index, item in enumerate(items):
+            new_item, item_size = _cap(item, max_string, max_list)
+            size += item_size
+            if new_item is not item:
+                if capped is None:
+                    capped = list(items)
+                capped[index] = new_item
+        return (value if capped is None else capped), size
+    return value, 8
+
+
+def _longest(value, kind) -> int:
+    if isinstance(value, kind):
+        longest = len(value)
+    else:
+        longest = 0
+    if isinstance(value, dict):
+        children = value.values()
+    elif isinstance(value, (list, tuple)):
+        children = value
+    else:
+        return longest
+    return max([longest, *(_longest(child, kind) for child in children)])
+
+
+def _search_cap(max_bytes, low, high, cap):
+    """Binary search for the largest limit in [low, high] that fits `max_bytes`."""
+    best = None
+    while low <= high:
+        mid = (low + high) // 2
+        capped, size = cap(mid)
+        if size <= max_bytes:
+            best = capped
+            low = mid + 1
+        else:
+            high = mid - 1
+    return best
+
+
+def truncate_payload(payload, max_bytes: int) -> Tuple[object, bool]:
+    """Shrink `payload` to roughly `max_bytes`.
+
+    Returns the payload, which is a copy if anything was cut, and whether it was truncated.
+    """
+    if not max_bytes or approximate_size(payload) <= max_bytes:
+        return payload, False
+
+    longest_string = _longest(payload, str)
+    if longest_string > _MIN_STRING_LENGTH:
+        capped = _search_cap(
+            max_bytes,
+            _MIN_STRING_LENGTH,
+            longest_string - 1,
+            lambda max_string: _cap(payload, max_string, None),
+        )
+        if capped is not None:
+            return capped, True
+
+    longest_list = _longest(payload, (list, tuple))
+    capped = _search_cap(
+        max_bytes,
+        _MIN_LIST_LENGTH,
+        longest_list - 1,
+        lambda max_list: _cap(payload, _MIN_STRING_LENGTH, max_list),
+    )
+    if capped is None:
+        # Even the smallest caps don't fit. Send what they leave.
+        capped, _ = _cap(payload, _MIN_STRING_LENGTH, _MIN_LIST_LENGTH)
+    return capped, True
+
+
+def truncate_event(event: Event) -> List[str]:
+    """Apply the configured payload limits to `event`, replacing any payloads
+    that were truncated. Returns the names of the truncated fields.
+    """
+    truncated = []
+    for field, option in _LIMITED_FIELDS.items():
+        payload = getattr(event, field, None)
+        if not payload:
+            continue
+        payload, was_truncated = truncate_payload(payload, getattr(config.Config, option))
+        if was_truncated:
+            setattr(event, field, payload)
+            truncated.append(field)
+    if truncated:
+        event._metadata.truncated_fields = truncated
+    return truncated
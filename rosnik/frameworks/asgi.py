@@ -0,0 +1,56 @@
+"""ASGI middleware for Starlette, FastAPI and other ASGI 3 frameworks.
+
+```py
+from rosnik.frameworks.asgi import RosnikMiddleware
+
+app.add_middleware(RosnikMiddleware, api_key="api-key", environment="development")
+```
+"""
+from rosnik import client, headers, state
+
+# ASGI header names are lowercased bytes.
+_JOURNEY_ID_HEADER = headers.JOURNEY_ID_KEY.lower().encode("latin-1")
+_INTERACTION_ID_HEADER = headers.INTERACTION_ID_KEY.lower().encode("latin-1")
+_DEVICE_ID_HEADER = headers.DEVICE_ID_KEY.lower().encode("latin-1")
+
+
+class RosnikMiddleware:
+    def __init__(
+        self, app, api_key=None, sync_mode=None, environment=None, event_context_hook=None
+    ):
+        self.app = app
+        client.init(
+            api_key=api_key,
+            sync_mode=sync_mode,
+            environment=environment,
+            event_context_hook=event_context_hook,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Read our headers straight off the raw header list,
+        # without building a Request object.
+        journey_id = interaction_id = device_id = None
+        for name, value in scope["headers"]:
+            if name == _JOURNEY_ID_HEADER:
+                journey_id = value.decode("latin-1")
+            elif name == _INTERACTION_ID_HEADER:
+                interaction_id = value.decode("latin-1")
+            elif name == _DEVICE_ID_HEADER:
+                device_id = value.decode("latin-1")
+
+        # Each request is considered a distinct Journey, unless a Journey ID is supplied.
+        state.store_request(journey_id, interaction_id, device_id)
+
+        async def send_with_journey_id(message):
+            if message["type"] == "http.response.start":
+                # Pass our Journey ID back to the client,
+                # so we can use it for subsequent requests.
+                journey_header = (_JOURNEY_ID_HEADER, state.get_journey_id().encode("latin-1"))
+                message = {**message, "headers": [*message.get("headers", ()), journey_header]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_journey_id)
@@ -23,15 +23,9 @@ def rosnik_middleware(get_response):
     def middleware(request):
         """Each request is considered a distinct Journey, unless a Journey ID is supplied."""
         journey_id = request.META.get(_to_django_header(headers.JOURNEY_ID_KEY))
-        if journey_id is None:
-            journey_id = state.create_journey_id()
-        state.store(state.State.JOURNEY_ID, journey_id)
-
         interaction_id = request.META.get(_to_django_header(headers.INTERACTION_ID_KEY))
-        state.store(state.State.USER_INTERACTION_ID, interaction_id)
-
         device_id = request.META.get(_to_django_header(headers.DEVICE_ID_KEY))
-        state.store(state.State.DEVICE_ID, device_id)
+        state.store_request(journey_id, interaction_id, device_id)
 
         response = get_response(request)
 
@@ -0,0 +1,91 @@
+"""Monotonic ULIDs for event and journey IDs.
+
+A ULID is a 48-bit millisecond timestamp followed by 80 random bits, written
+as 26 characters of Crockford base32, so IDs sort by creation time. Within a
+millisecond, each ID increments the random bits of the last one rather than
+drawing new ones, so IDs from this process always sort in the order they were
+generated, even within a batch.
+
+Random bits come from a buffered pool of `os.urandom`, refilled as it's used
+up and after a fork, and the timestamp's encoding is reused for every ID in
+the same millisecond.
+"""
+import os
+import threading
+import time
+
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Every pair of characters, indexed by the 10 bits they encode.
+_PAIRS = [a + b for a in _ALPHABET for b in _ALPHABET]
+_RANDOM_BYTES = 10
+_RANDOM_LIMIT = 1 << (_RANDOM_BYTES * 8)
+_POOL_BYTES = _RANDOM_BYTES * 256
+
+_lock = threading.Lock()
+_pool = b""
+_pool_offset = 0
+_last_ms = -1
+_last_random = 0
+_last_timestamp = ""
+
+
+def _encode_timestamp(ms: int) -> str:
+    # 48 bits in 10 characters.
+    return "".join(_PAIRS[(ms >> shift) & 0x3FF] for shift in (40, 30, 20, 10, 0))
+
+
+def _encode_random(value: int, pairs=_PAIRS) -> str:
+    # 80 bits in 16 characters. Unrolled, as this runs for every ID.
+    return (
+        pairs[value >> 70]
+        + pairs[(value >> 60) & 0x3FF]
+        + pairs[(value >> 50) & 0x3FF]
+        + pairs[(value >> 40) & 0x3FF]
+        + pairs[(value >> 30) & 0x3FF]
+        + pairs[(value >> 20) & 0x3FF]
+        + pairs[(value >> 10) & 0x3FF]
+        + pairs[value & 0x3FF]
+    )
+
+
+def _next_random() -> int:
+    global _pool, _pool_offset
+    if _pool_offset + _RANDOM_BYTES > len(_pool):
+        _pool = os.urandom(_POOL_BYTES)
+        _pool_offset = 0
+    value = int.from_bytes(_pool[_pool_offset : _pool_offset + _RANDOM_BYTES], "big")
+    _pool_offset += _RANDOM_BYTES
+    return value
+
+
+def new() -> str:
+    """Return a new ULID string, greater than any returned before it in this process."""
+    global _last_ms, _last_random, _last_timestamp
+    ms = time.time_ns() // 1_000_000
+    with _lock:
+        if ms > _last_ms:
+            _last_ms = ms
+            _last_random = _next_random()
+            _last_timestamp = _encode_timestamp(ms)
+        else:
+            # The same millisecond, or the clock went backwards.
+            _last_random += 1
+            if _last_random >= _RANDOM_LIMIT:
+                # Out of room in this millisecond, so borrow the next one.
+                _last_ms += 1
+                _last_random = _next_random()
+                _last_timestamp = _encode_timestamp(_last_ms)
+        return _last_timestamp + _encode_random(_last_random)
+
+
+def _reinit_after_fork():
+    """The child mustn't reuse random bits the parent has already handed out."""
+    global _lock, _pool, _pool_offset, _last_ms
+    _lock = threading.Lock()
+    _pool = b""
+    _pool_offset = 0
+    _last_ms = -1
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
@@ -4,8 +4,10 @@ import logging
 import time
 from typing import Callable, Iterator, Union
 
-from rosnik import constants
+from rosnik import constants, sampling
 from rosnik.events import queue
+from rosnik.providers import stream, tokens
+from rosnik.providers.stream import StreamAccumulator
 from rosnik.types.core import AIEvent, Metadata
 from rosnik.wrap import wrap_class_method
 from rosnik.types.ai import (
@@ -21,6 +23,8 @@ from rosnik.types.ai import (
 logger = logging.getLogger(__name__)
 
 _OAI = "openai"
+# Azure calls name their deployment instead of a model.
+_MODEL_KEYS = ("model", "deployment_id", "engine")
 
 
 def hook_with_metadata(hook: Callable, generate_metadata: Callable[[], AIFunctionMetadata]):
@@ -34,10 +38,12 @@ def request_hook(
     prior_event: AIEvent = None,
     generate_metadata: Callable[[], AIFunctionMetadata] = None,
     instance=None,
+    sent_at: int = None,
 ) -> AIRequestStart:
     """`payload` is a dictionary of the `kwargs` provided to `create`.
 
     Given those kwargs and metadata, generate a AIRequestStart event.
+    `sent_at` overrides the start time for events built after the call.
     """
     if not payload:
         return None
@@ -64,19 +70,20 @@ def request_hook(
     )
     user_id = payload.get("user")
 
-    event = AIRequestStart(
-        ai_model=ai_model,
-        ai_provider=metadata.ai_provider,
-        ai_action=metadata.ai_action,
-        ai_metadata=metadata,
-        request_payload=payload,
-        user_id=user_id,
-        _metadata=Metadata(
+    fields = {
+        "ai_model": ai_model,
+        "ai_provider": metadata.ai_provider,
+        "ai_action": metadata.ai_action,
+        "ai_metadata": metadata,
+        "request_payload": payload,
+        "user_id": user_id,
+        "_metadata": Metadata(
             function_fingerprint=function_fingerprint, stream=payload.get("stream", False)
         ),
-    )
-    queue.enqueue_event(event)
-    return event
+    }
+    if sent_at is not None:
+        fields["sent_at"] = sent_at
+    return queue.enqueue_new_event(AIRequestStart, fields)
 
 
 def response_hook(
@@ -129,13 +136,9 @@ def response_hook(
         # These don't exist. `payload` is a generator.
         # Make this None
         event_kwargs.pop("response_payload")
-        event = AIRequestStartStream(**event_kwargs)
-        queue.enqueue_event(event)
-        return event
+        return queue.enqueue_new_event(AIRequestStartStream, event_kwargs)
 
-    event = AIRequestFinish(**event_kwargs)
-    queue.enqueue_event(event)
-    return event
+    return queue.enqueue_new_event(AIRequestFinish, event_kwargs)
 
 
 def streamed_response_hook(
@@ -144,75 +147,103 @@ def streamed_response_hook(
     prior_event: AIEvent = None,
     generate_metadata: Callable[[], AIFunctionMetadata] = None,
     instance=None,
+    started_ns: int = None,
+    request_payload: dict = None,
 ):
     """Wrap the response generator with our own function so that the
     user can still yield results, and we can automatically
     figure out the duration of the stream.
+
+    `request_payload` is the kwargs provided to `create`, before any truncation.
     """
+    if request_payload is None:
+        request_payload = getattr(prior_event, "request_payload", None)
 
-    content_parts = []
+    accumulator = StreamAccumulator.for_request(request_payload, started_ns=started_ns)
     # Load openai here and use values defined at this point.
     import openai
 
+    def _finish(end_reason: str = None, error: Exception = None):
+        metadata = generate_metadata()
+        metadata.openai_attributes = OpenAIAttributes(
+            api_base=openai.api_base,
+            api_type=openai.api_type,
+            api_version=openai.api_version,
+            organization=openai.organization,
+        )
+        now = int(time.time_ns() / 1000000)
+        fields = {
+            "ai_model": accumulator.model or prior_event.ai_model,
+            "ai_provider": metadata.ai_provider,
+            "ai_action": metadata.ai_action,
+            "ai_metadata": metadata,
+            "sent_at": now,
+            "response_ms": (now - prior_event.sent_at),
+            "ai_request_start_event_id": prior_event.event_id,
+            "user_id": prior_event.user_id,
+            # The stream may be closed from another thread, task or a finalizer.
+            "journey_id": prior_event.journey_id,
+            "user_interaction_id": prior_event.user_interaction_id,
+            "device_id": prior_event.device_id,
+            "stream_end_reason": end_reason,
+            "error_data": None if error is None else stream.error_data(error),
+            "_metadata": Metadata(function_fingerprint=function_fingerprint, stream=True),
+        }
+        # Count tokens on the worker if the stream didn't report usage. Completions are
+        # counted from the accumulator, as the event's payload may be truncated by then.
+        prepare = None
+        if accumulator.usage is None:
+            prepare = tokens.usage_counter(request_payload, accumulator.response_payload)
+        queue.enqueue_new_event(AIRequestFinish, fields, build=_build_finish, prepare=prepare)
+
+    def _build_finish(**fields) -> AIRequestFinish:
+        # No more chunks are added once we've finished, so this is safe on the worker.
+        return AIRequestFinish(
+            # Mimic the OpenAI response payload.
+            response_payload=accumulator.response_payload(),
+            stream_metrics=accumulator.metrics(),
+            **fields,
+        )
+
     def _stream_hook(line: "OpenAIObject"):
-        """For each chunk, either add it to our content_parts
-        or emit an event because we're done.
-        """
+        """Fold each chunk into the accumulator, and emit an event once every choice is done."""
         if not line:
             logger.debug("Line not seen on stream.")
             return
 
-        choices = line.get("choices")
-        if not choices or len(choices) < 1:
-            logger.debug("Missing choices on stream.")
+        if accumulator.finished or not accumulator.add(line):
             return
 
-        content = choices[0].get("delta", {}).get("content")
-        if content:
-            content_parts.append(content)
-
-        finish_reason = choices[0].get("finish_reason")
-        if finish_reason:
-            metadata = generate_metadata()
-            metadata.openai_attributes = OpenAIAttributes(
-                api_base=openai.api_base,
-                api_type=openai.api_type,
-                api_version=openai.api_version,
-                organization=openai.organization,
-            )
-            now = int(time.time_ns() / 1000000)
-            finish_event = AIRequestFinish(
-                ai_model=line.get("model"),
-                ai_provider=metadata.ai_provider,
-                ai_action=metadata.ai_action,
-                ai_metadata=metadata,
-                # Mimic the OpenAI response payload.
-                # Missing `usage`, TODO: what do?
-                response_payload={
-                    "choices": [
-                        {
-                            "finish_reason": finish_reason,
-                            "index": 0,
-                            "message": {"content": "".join(content_parts), "role": "assistant"},
-                        }
-                    ],
-                    "model": line.get("model"),
-                    "created": line.get("created"),
-                    "object": line.get("object"),
-                    "id": line.get("id"),
-                },
-                sent_at=now,
-                response_ms=(now - prior_event.sent_at),
-                ai_request_start_event_id=prior_event.event_id,
-                user_id=prior_event.user_id,
-                _metadata=Metadata(function_fingerprint=function_fingerprint, stream=True),
-            )
-            queue.enqueue_event(finish_event)
+        try:
+            _finish()
+        except Exception:
+            # Never break the caller's loop over the stream.
+            logger.exception("Failed to record the end of a stream.")
+
+    def _end_early(end_reason: str, error: Exception = None):
+        """Emit what we have if the stream stopped before every choice was done."""
+        if accumulator.finished:
+            return
+        try:
+            _finish(end_reason, error)
+        except Exception:
+            # Never replace the caller's exception, or GeneratorExit, with our own.
+            logger.exception("Failed to record the end of a stream.")
 
     def _stream_response_wrapper(response: Iterator):
-        for line in response:
-            _stream_hook(line)
-            yield line
+        # Exceptions are handled outside the loop, so chunks cost nothing extra.
+        try:
+            for line in response:
+                _stream_hook(line)
+                yield line
+        except GeneratorExit:
+            # Closed, or garbage collected, before the stream was exhausted.
+            _end_early(stream.ABORTED)
+            raise
+        except Exception as e:
+            _end_early(stream.ERROR, e)
+            raise
+        _end_early(stream.INCOMPLETE)
 
     return _stream_response_wrapper(response)
 
@@ -290,6 +321,7 @@ def _patch_completion(openai):
             streamed_response_hook,
             lambda: AIFunctionMetadata(ai_provider=_OAI, ai_action="completions"),
         ),
+        sampler=sampling.sampler("completions", model_keys=_MODEL_KEYS),
     )
 
 
@@ -317,6 +349,7 @@ def _patch_chat_completion(openai):
             streamed_response_hook,
             lambda: AIFunctionMetadata(ai_provider=_OAI, ai_action="chat.completions"),
         ),
+        sampler=sampling.sampler("chat.completions", model_keys=_MODEL_KEYS),
     )
 
 
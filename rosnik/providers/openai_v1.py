@@ -2,20 +2,22 @@
 
     Currently supports:
     - `openai.OpenAI` and `openai.AzureOpenAI`
+    - `openai.AsyncOpenAI` and `openai.AsyncAzureOpenAI`
     - `chat`
     - `completions`
 
     Not currently supporting (but let us know if you need it!):
-    - `openai.AsyncOpenAI`
     - non-chat models
 """
 import functools
 import logging
 import time
-from typing import Callable, Iterator, Union
+from typing import AsyncIterator, Callable, Iterator, Union
 
-from rosnik import constants
+from rosnik import constants, sampling
 from rosnik.events import queue
+from rosnik.providers import stream, tokens
+from rosnik.providers.stream import StreamAccumulator
 from rosnik.types.core import AIEvent, Metadata
 from rosnik.wrap import wrap_class_method
 from rosnik.types.ai import (
@@ -59,10 +61,12 @@ def request_hook(
     prior_event: AIEvent = None,
     generate_metadata: Callable[[], AIFunctionMetadata] = None,
     instance: object = None,
+    sent_at: int = None,
 ) -> AIRequestStart:
     """`payload` is a dictionary of the `kwargs` provided to `create`.
 
     Given those kwargs and metadata, generate a AIRequestStart event.
+    `sent_at` overrides the start time for events built after the call.
     """
     if not payload:
         return None
@@ -74,24 +78,25 @@ def request_hook(
     metadata = _populate_metadata(generate_metadata(), instance)
     user_id = payload.get("user")
 
-    event = AIRequestStart(
+    fields = {
         # OpenAI and Azure both use model now
-        ai_model=payload.get("model"),
-        ai_provider=metadata.ai_provider,
-        ai_action=metadata.ai_action,
-        ai_metadata=metadata,
-        request_payload=payload,
-        user_id=user_id,
-        _metadata=Metadata(
+        "ai_model": payload.get("model"),
+        "ai_provider": metadata.ai_provider,
+        "ai_action": metadata.ai_action,
+        "ai_metadata": metadata,
+        "request_payload": payload,
+        "user_id": user_id,
+        "_metadata": Metadata(
             function_fingerprint=function_fingerprint, stream=payload.get("stream", False)
         ),
-    )
-    queue.enqueue_event(event)
-    return event
+    }
+    if sent_at is not None:
+        fields["sent_at"] = sent_at
+    return queue.enqueue_new_event(AIRequestStart, fields)
 
 
 def response_hook(
-    payload: Union[object, Iterator],
+    payload: Union[object, Iterator, AsyncIterator],
     function_fingerprint: str,
     prior_event: AIEvent = None,
     generate_metadata: Callable[[], AIFunctionMetadata] = None,
@@ -108,7 +113,7 @@ def response_hook(
         logger.warning("`generate_metadata` not provided. Bailing.")
         return
 
-    is_stream_response = isinstance(payload, Iterator)
+    is_stream_response = isinstance(payload, (Iterator, AsyncIterator))
 
     metadata = _populate_metadata(generate_metadata(), instance)
 
@@ -119,8 +124,8 @@ def response_hook(
         "ai_provider": metadata.ai_provider,
         "ai_action": metadata.ai_action,
         "ai_metadata": metadata,
-        # These are pydantic models, so we need to convert them to dicts.
-        "response_payload": None if is_stream_response else payload.model_dump(),
+        # Converted to a dict when the event is built.
+        "response": None if is_stream_response else payload,
         "sent_at": now,
         "response_ms": (now - prior_event.sent_at),
         "ai_request_start_event_id": prior_event.event_id,
@@ -131,84 +136,128 @@ def response_hook(
     if is_stream_response:
         # These don't exist. `payload` is a generator.
         # Make this None
-        event_kwargs.pop("response_payload")
-        event = AIRequestStartStream(**event_kwargs)
-        queue.enqueue_event(event)
-        return event
+        event_kwargs.pop("response")
+        return queue.enqueue_new_event(AIRequestStartStream, event_kwargs)
+
+    return queue.enqueue_new_event(AIRequestFinish, event_kwargs, build=_finish_from_response)
 
-    event = AIRequestFinish(**event_kwargs)
-    queue.enqueue_event(event)
-    return event
+
+def _finish_from_response(response: "BaseModel", **fields) -> AIRequestFinish:
+    # These are pydantic models, so we need to convert them to dicts.
+    return AIRequestFinish(response_payload=response.model_dump(), **fields)
 
 
 def streamed_response_hook(
-    response: Iterator,
+    response: Union[Iterator, AsyncIterator],
     function_fingerprint: str,
     prior_event: AIEvent = None,
     generate_metadata: Callable[[], AIFunctionMetadata] = None,
     instance: object = None,
+    started_ns: int = None,
+    request_payload: dict = None,
 ):
     """Wrap the response generator with our own function so that the
     user can still yield results, and we can automatically
     figure out the duration of the stream.
-    """
 
-    content_parts = []
-    # Load openai here and use values defined at this point.
+    `request_payload` is the kwargs provided to `create`, before any truncation.
+    """
+    if request_payload is None:
+        request_payload = getattr(prior_event, "request_payload", None)
+
+    accumulator = StreamAccumulator.for_request(request_payload, started_ns=started_ns)
+
+    def _finish(end_reason: str = None, error: Exception = None):
+        metadata = _populate_metadata(generate_metadata(), instance)
+        now = int(time.time_ns() / 1000000)
+        fields = {
+            "ai_model": accumulator.model or prior_event.ai_model,
+            "ai_provider": metadata.ai_provider,
+            "ai_action": metadata.ai_action,
+            "ai_metadata": metadata,
+            "sent_at": now,
+            "response_ms": (now - prior_event.sent_at),
+            "ai_request_start_event_id": prior_event.event_id,
+            "user_id": prior_event.user_id,
+            # The stream may be closed from another thread, task or a finalizer.
+            "journey_id": prior_event.journey_id,
+            "user_interaction_id": prior_event.user_interaction_id,
+            "device_id": prior_event.device_id,
+            "stream_end_reason": end_reason,
+            "error_data": None if error is None else stream.error_data(error),
+            "_metadata": Metadata(function_fingerprint=function_fingerprint, stream=True),
+        }
+        # Count tokens on the worker if the stream didn't report usage. Completions are
+        # counted from the accumulator, as the event's payload may be truncated by then.
+        prepare = None
+        if accumulator.usage is None:
+            prepare = tokens.usage_counter(request_payload, accumulator.response_payload)
+        queue.enqueue_new_event(AIRequestFinish, fields, build=_build_finish, prepare=prepare)
+
+    def _build_finish(**fields) -> AIRequestFinish:
+        # No more chunks are added once we've finished, so this is safe on the worker.
+        return AIRequestFinish(
+            # Mimic the OpenAI response payload.
+            response_payload=accumulator.response_payload(),
+            stream_metrics=accumulator.metrics(),
+            **fields,
+        )
 
     def _stream_hook(line: "BaseModel"):
-        """For each chunk, either add it to our content_parts
-        or emit an event because we're done.
-        """
+        """Fold each chunk into the accumulator, and emit an event once every choice is done."""
         if not line:
             logger.debug("Line not seen on stream.")
             return
 
-        if not line.choices or len(line.choices) < 1:
-            logger.debug("Missing choices on stream.")
+        if accumulator.finished or not accumulator.add(line):
             return
 
-        content = line.choices[0].delta.content
-        if content:
-            content_parts.append(content)
-
-        finish_reason = line.choices[0].finish_reason
-        if finish_reason:
-            metadata = _populate_metadata(generate_metadata(), instance)
-            now = int(time.time_ns() / 1000000)
-            finish_event = AIRequestFinish(
-                ai_model=line.model,
-                ai_provider=metadata.ai_provider,
-                ai_action=metadata.ai_action,
-                ai_metadata=metadata,
-                # Mimic the OpenAI response payload.
-                # Missing `usage`, TODO: what do?
-                response_payload={
-                    "choices": [
-                        {
-                            "finish_reason": finish_reason,
-                            "index": 0,
-                            "message": {"content": "".join(content_parts), "role": "assistant"},
-                        }
-                    ],
-                    "model": line.model,
-                    "created": line.created,
-                    "object": line.object,
-                    "id": line.id,
-                },
-                sent_at=now,
-                response_ms=(now - prior_event.sent_at),
-                ai_request_start_event_id=prior_event.event_id,
-                user_id=prior_event.user_id,
-                _metadata=Metadata(function_fingerprint=function_fingerprint, stream=True),
-            )
-            queue.enqueue_event(finish_event)
+        try:
+            _finish()
+        except Exception:
+            # Never break the caller's loop over the stream.
+            logger.exception("Failed to record the end of a stream.")
 
-    def _stream_response_wrapper(response: Iterator):
-        for line in response:
-            _stream_hook(line)
-            yield line
+    def _end_early(end_reason: str, error: Exception = None):
+        """Emit what we have if the stream stopped before every choice was done."""
+        if accumulator.finished:
+            return
+        try:
+            _finish(end_reason, error)
+        except Exception:
+            # Never replace the caller's exception, or GeneratorExit, with our own.
+            logger.exception("Failed to record the end of a stream.")
 
+    def _stream_response_wrapper(response: Iterator):
+        # Exceptions are handled outside the loop, so chunks cost nothing extra.
+        try:
+            for line in response:
+                _stream_hook(line)
+                yield line
+        except GeneratorExit:
+            # Closed, or garbage collected, before the stream was exhausted.
+            _end_early(stream.ABORTED)
+            raise
+        except Exception as e:
+            _end_early(stream.ERROR, e)
+            raise
+        _end_early(stream.INCOMPLETE)
+
+    async def _async_stream_response_wrapper(response: AsyncIterator):
+        try:
+            async for line in response:
+                _stream_hook(line)
+                yield line
+        except GeneratorExit:
+            _end_early(stream.ABORTED)
+            raise
+        except Exception as e:
+            _end_early(stream.ERROR, e)
+            raise
+        _end_early(stream.INCOMPLETE)
+
+    if isinstance(response, AsyncIterator):
+        return _async_stream_response_wrapper(response)
     return _stream_response_wrapper(response)
 
 
@@ -257,7 +306,7 @@ def error_hook(
     return event
 
 
-def _patch_completion(completions_class):
+def _patch_completion(completions_class, is_async=False):
     if getattr(completions_class, f"__{constants.NAMESPACE}_patch", False):
         logger.warning("Not patching. Already patched.")
         return
@@ -280,12 +329,14 @@ def _patch_completion(completions_class):
             streamed_response_hook,
             lambda: AIFunctionMetadata(ai_provider=_OAI, ai_action="completions"),
         ),
+        is_async=is_async,
+        sampler=sampling.sampler("completions"),
     )
 
     setattr(completions_class, f"__{constants.NAMESPACE}_patch", True)
 
 
-def _patch_chat_completion(completions_class):
+def _patch_chat_completion(completions_class, is_async=False):
     if getattr(completions_class, f"__{constants.NAMESPACE}_patch", False):
         logger.warning("Not patching. Already patched.")
         return
@@ -309,6 +360,8 @@ def _patch_chat_completion(completions_class):
             streamed_response_hook,
             lambda: AIFunctionMetadata(ai_provider=_OAI, ai_action="chat.completions"),
         ),
+        is_async=is_async,
+        sampler=sampling.sampler("chat.completions"),
     )
 
     setattr(completions_class, f"__{constants.NAMESPACE}_patch", True)
@@ -326,4 +379,8 @@ def patch():
         _patch_completion(completions.Completions)
     if getattr(chat_completions, "Completions", None):
         _patch_chat_completion(chat_completions.Completions)
+    if getattr(completions, "AsyncCompletions", None):
+        _patch_completion(completions.AsyncCompletions, is_async=True)
+    if getattr(chat_completions, "AsyncCompletions", None):
+        _patch_chat_completion(chat_completions.AsyncCompletions, is_async=True)
 
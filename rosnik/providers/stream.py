@@ -0,0 +1,354 @@
+"""Accumulate streamed completion chunks into a full response payload.
+
+Works with OpenAI v1 chunk models and pre-v1 `OpenAIObject`s alike, since
+both support attribute access. Chunks are folded in as they arrive and the
+pieces of each choice are only joined once, when the payload is built.
+
+Timing is taken from `time.perf_counter_ns` as each chunk is added, so it's
+monotonic and unaffected by wall-clock adjustments.
+"""
+import time
+
+from rosnik.types.ai import ErrorResponseData, StreamMetrics
+
+# Logprobs fields that arrive in pieces: `content` and `refusal` for chat,
+# the rest for completions.
+_LOGPROBS_FIELDS = ("content", "refusal", "tokens", "token_logprobs", "top_logprobs", "text_offset")
+# Inter-chunk gaps are counted in power-of-two buckets of microseconds:
+# bucket i holds gaps under 2**i µs, and the last bucket everything slower.
+_HISTOGRAM_BUCKETS = 24
+
+# Why a stream ended before every choice had a finish reason.
+# Closed by the caller, e.g. by breaking out of the loop, or garbage collected.
+ABORTED = "aborted"
+# The SDK raised mid-stream.
+ERROR = "error"
+# The response ended without a finish reason.
+INCOMPLETE = "incomplete"
+
+
+class _ToolCall:
+    __slots__ = ("id", "type", "name", "arguments")
+
+    def __init__(self):
+        self.id = None
+        self.type = None
+        self.name = None
+        self.arguments = []
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": self.type or "function",
+            "function": {"name": self.name, "arguments": "".join(self.arguments)},
+        }
+
+
+class _Choice:
+    __slots__ = (
+        "role",
+        "content",
+        "refusal",
+        "function_name",
+        "function_arguments",
+        "tool_calls",
+        "logprobs",
+        "finish_reason",
+    )
+
+    def __init__(self):
+        self.role = None
+        # Chat message content, or completion text.
+        self.content = []
+        self.refusal = None
+        self.function_name = None
+        self.function_arguments = None
+        self.tool_calls = None
+        self.logprobs = None
+        self.finish_reason = None
+
+
+class StreamAccumulator:
+    """Builds the response payload of a streamed chat completion or completion.
+
+    `add` each chunk as it arrives; it returns True once `expected_choices`
+    choices have a finish reason and, if `expect_usage` is set, the usage
+    chunk has arrived. `response_payload` then mimics the payload of the
+    equivalent non-streamed response, and `metrics` summarises the timing
+    of the stream.
+    """
+
+    __slots__ = (
+        "expected_choices",
+        "expect_usage",
+        "id",
+        "model",
+        "created",
+        "object",
+        "usage",
+        "_chat",
+        "_choices",
+        "_finished",
+        "_started_ns",
+        "_first_chunk_ns",
+        "_first_token_ns",
+        "_last_chunk_ns",
+        "_last_token_ns",
+        "_chunks",
+        "_tokens",
+        "_histogram",
+    )
+
+    def __init__(
+        self, expected_choices: int = 1, expect_usage: bool = False, started_ns: int = None
+    ):
+        self.expected_choices = expected_choices
+        self.expect_usage = expect_usage
+        self.id = None
+        self.model = None
+        self.created = None
+        self.object = None
+        self.usage = None
+        self._chat = None
+        self._choices = {}
+        self._finished = 0
+        # `perf_counter_ns` when the request was sent, if known.
+        self._started_ns = started_ns
+        self._first_chunk_ns = None
+        self._first_token_ns = None
+        self._last_chunk_ns = None
+        self._last_token_ns = None
+        self._chunks = 0
+        # Chunks that carried content for a choice; roughly one token each.
+        self._tokens = 0
+        self._histogram = [0] * _HISTOGRAM_BUCKETS
+
+    @classmethod
+    def for_request(
+        cls, request_payload: dict = None, started_ns: int = None
+    ) -> "StreamAccumulator":
+        """Create an accumulator for the stream returned by a request with these kwargs."""
+        request_payload = request_payload or {}
+        stream_options = request_payload.get("stream_options") or {}
+        return cls(
+            expected_choices=request_payload.get("n") or 1,
+            expect_usage=bool(stream_options.get("include_usage")),
+            started_ns=started_ns,
+        )
+
+    @property
+    def finished(self) -> bool:
+        if self.expect_usage and self.usage is None:
+            return False
+        return self._finished >= self.expected_choices
+
+    def add(self, chunk, now_ns: int = None) -> bool:
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        if self._last_chunk_ns is None:
+            self._first_chunk_ns = now_ns
+        else:
+            bucket = ((now_ns - self._last_chunk_ns) // 1000).bit_length()
+            self._histogram[min(bucket, _HISTOGRAM_BUCKETS - 1)] += 1
+        self._last_chunk_ns = now_ns
+        self._chunks += 1
+
+        # Each is taken from the first chunk that has it. Azure's first chunk
+        # only carries `prompt_filter_results`, with an empty ID and model.
+        if not self.id:
+            self.id = getattr(chunk, "id", None) or None
+        if not self.model:
+            self.model = getattr(chunk, "model", None) or None
+        if not self.created:
+            self.created = getattr(chunk, "created", None) or None
+        if not self.object:
+            self.object = getattr(chunk, "object", None) or None
+        usage = getattr(chunk, "usage", None)
+        if usage:
+            # Sent on a final chunk of its own when `stream_options` asks for it.
+            self.usage = usage
+
+        choices = getattr(chunk, "choices", None)
+        if not choices:
+            return self.finished
+
+        for choice in choices:
+            index = getattr(choice, "index", None) or 0
+            state = self._choices.get(index)
+            if state is None:
+                state = self._choices[index] = _Choice()
+
+            delta = getattr(choice, "delta", None)
+            if self._chat is None:
+                self._chat = delta is not None
+            has_content = False
+            if delta is not None:
+                content = getattr(delta, "content", None)
+                if content:
+                    state.content.append(content)
+                    has_content = True
+                if state.role is None:
+                    state.role = getattr(delta, "role", None)
+                tool_calls = getattr(delta, "tool_calls", None)
+                if tool_calls:
+                    self._add_tool_calls(state, tool_calls)
+                    has_content = True
+                function_call = getattr(delta, "function_call", None)
+                if function_call:
+                    self._add_function_call(state, function_call)
+                    has_content = True
+                refusal = getattr(delta, "refusal", None)
+                if refusal:
+                    if state.refusal is None:
+                        state.refusal = []
+                    state.refusal.append(refusal)
+                    has_content = True
+            else:
+                text = getattr(choice, "text", None)
+                if text:
+                    state.content.append(text)
+                    has_content = True
+            if has_content:
+                if self._first_token_ns is None:
+                    self._first_token_ns = now_ns
+                self._last_token_ns = now_ns
+                self._tokens += 1
+
+            logprobs = getattr(choice, "logprobs", None)
+            if logprobs:
+                self._add_logprobs(state, logprobs)
+
+            finish_reason = getattr(choice, "finish_reason", None)
+            if finish_reason and state.finish_reason is None:
+                state.finish_reason = finish_reason
+                self._finished += 1
+
+        return self.finished
+
+    @staticmethod
+    def _add_tool_calls(state: _Choice, tool_calls):
+        if state.tool_calls is None:
+            state.tool_calls = {}
+        for delta in tool_calls:
+            index = getattr(delta, "index", None) or 0
+            call = state.tool_calls.get(index)
+            if call is None:
+                call = state.tool_calls[index] = _ToolCall()
+            if call.id is None:
+                call.id = getattr(delta, "id", None)
+            if call.type is None:
+                call.type = getattr(delta, "type", None)
+            function = getattr(delta, "function", None)
+            if function is None:
+                continue
+            if call.name is None:
+                call.name = getattr(function, "name", None)
+            arguments = getattr(function, "arguments", None)
+            if arguments:
+                call.arguments.append(arguments)
+
+    @staticmethod
+    def _add_function_call(state: _Choice, function_call):
+        if state.function_arguments is None:
+            state.function_arguments = []
+        if state.function_name is None:
+            state.function_name = getattr(function_call, "name", None)
+        arguments = getattr(function_call, "arguments", None)
+        if arguments:
+            state.function_arguments.append(arguments)
+
+    @staticmethod
+    def _add_logprobs(state: _Choice, logprobs):
+        if state.logprobs is None:
+            state.logprobs = {}
+        for field in _LOGPROBS_FIELDS:
+            values = getattr(logprobs, field, None)
+            if values:
+                state.logprobs.setdefault(field, []).extend(values)
+
+    def _choice_payload(self, index: int, state: _Choice) -> dict:
+        choice = {"finish_reason": state.finish_reason, "index": index}
+        if self._chat:
+            message = {"content": "".join(state.content), "role": state.role or "assistant"}
+            if state.tool_calls:
+                message["tool_calls"] = [
+                    state.tool_calls[i].to_dict() for i in sorted(state.tool_calls)
+                ]
+            if state.function_arguments is not None:
+                message["function_call"] = {
+                    "name": state.function_name,
+                    "arguments": "".join(state.function_arguments),
+                }
+            if state.refusal:
+                message["refusal"] = "".join(state.refusal)
+            choice["message"] = message
+        else:
+            choice["text"] = "".join(state.content)
+        if state.logprobs is not None:
+            choice["logprobs"] = state.logprobs
+        return choice
+
+    def response_payload(self) -> dict:
+        payload = {
+            "choices": [
+                self._choice_payload(index, self._choices[index]) for index in sorted(self._choices)
+            ],
+            "model": self.model,
+            "created": self.created,
+            "object": self.object,
+            "id": self.id,
+        }
+        if self.usage is not None:
+            usage = self.usage
+            payload["usage"] = usage.model_dump() if hasattr(usage, "model_dump") else usage
+        return payload
+
+    def metrics(self) -> StreamMetrics:
+        tokens = self._tokens
+        completion_tokens = getattr(self.usage, "completion_tokens", None)
+        if completion_tokens is None and isinstance(self.usage, dict):
+            completion_tokens = self.usage.get("completion_tokens")
+        if completion_tokens:
+            tokens = completion_tokens
+
+        # Generation rate after the first token, so it isn't skewed by time to first token.
+        # Usage can report tokens, e.g. reasoning tokens, that no chunk carried.
+        tokens_per_second = None
+        if (
+            tokens > 1
+            and self._first_token_ns is not None
+            and self._last_token_ns > self._first_token_ns
+        ):
+            tokens_per_second = (tokens - 1) * 1e9 / (self._last_token_ns - self._first_token_ns)
+
+        started_ns = self._started_ns
+        if started_ns is None:
+            duration_ns = _elapsed(self._first_chunk_ns, self._last_chunk_ns)
+        else:
+            duration_ns = _elapsed(started_ns, self._last_chunk_ns)
+        return StreamMetrics(
+            time_to_first_chunk_ns=_elapsed(started_ns, self._first_chunk_ns),
+            time_to_first_token_ns=_elapsed(started_ns, self._first_token_ns),
+            duration_ns=duration_ns,
+            chunks=self._chunks,
+            tokens=tokens,
+            tokens_per_second=tokens_per_second,
+            inter_chunk_histogram=[
+                [2**bucket, count] for bucket, count in enumerate(self._histogram) if count
+            ],
+        )
+
+
+def _elapsed(start_ns, end_ns):
+    if start_ns is None or end_ns is None:
+        return None
+    return end_ns - start_ns
+
+
+def error_data(error: Exception) -> ErrorResponseData:
+    """Describe an error raised mid-stream, after the response was returned."""
+    return ErrorResponseData(
+        message=str(error),
+        user_message=getattr(error, "message", None),
+        code=getattr(error, "code", None),
+    )
@@ -0,0 +1,211 @@
+"""Count tokens locally for streamed responses.
+
+Streams only report usage when `stream_options={"include_usage": True}` is
+set. Otherwise we count prompt and completion tokens ourselves, on the
+background worker just before the finish event is sent, so counting never
+delays the chunks being streamed to the caller.
+
+Counting uses tiktoken when it's installed, or any `Tokenizer` passed to
+`rosnik.init(tokenizer=...)`. Counts of prompt messages are cached, since
+the same system prompt and message history are sent on every turn of a
+conversation. Counts follow OpenAI's accounting for chat models, and are
+estimates: tool definitions and images aren't counted.
+"""
+import functools
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from rosnik import config
+from rosnik.events import queue
+from rosnik.types.ai import AIRequestFinish
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Chat messages are wrapped in tokens of their own, and the reply is primed
+# with a few more.
+_TOKENS_PER_MESSAGE = 3
+_TOKENS_PER_NAME = 1
+_REPLY_PRIMING_TOKENS = 3
+# Used for models tiktoken doesn't know about.
+_DEFAULT_ENCODING = "cl100k_base"
+_PROMPT_CACHE_SIZE = 4096
+
+
+class Tokenizer:
+    """Counts the tokens in text sent to or received from `model`."""
+
+    def count(self, text: str, model: Optional[str]) -> int:
+        raise NotImplementedError
+
+
+class TiktokenTokenizer(Tokenizer):
+    def count(self, text: str, model: Optional[str]) -> int:
+        # Special tokens in user content are counted as plain text.
+        return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+@functools.lru_cache(maxsize=64)
+def _encoding(model: Optional[str]):
+    try:
+        return tiktoken.encoding_for_model(model or "")
+    except KeyError:
+        return tiktoken.get_encoding(_DEFAULT_ENCODING)
+
+
+_default_tokenizer = None
+
+
+def get_tokenizer() -> Optional[Tokenizer]:
+    """The configured tokenizer, or tiktoken's if it's installed."""
+    global _default_tokenizer
+    if config.Config.tokenizer is not None:
+        return config.Config.tokenizer
+    if tiktoken is None:
+        return None
+    if _default_tokenizer is None:
+        _default_tokenizer = TiktokenTokenizer()
+    return _default_tokenizer
+
+
+# Recent prompt counts, least recently used first. Keyed by a digest of the
+# text rather than the text itself, so large prompts aren't kept alive.
+_prompt_counts: "OrderedDict[tuple, int]" = OrderedDict()
+_prompt_counts_lock = threading.Lock()
+
+
+def _count_cached(tokenizer: Tokenizer, text: str, model: Optional[str]) -> int:
+    digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    key = (tokenizer, model, digest)
+    with _prompt_counts_lock:
+        count = _prompt_counts.get(key)
+        if count is not None:
+            _prompt_counts.move_to_end(key)
+            return count
+    count = tokenizer.count(text, model)
+    with _prompt_counts_lock:
+        _prompt_counts[key] = count
+        if len(_prompt_counts) > _PROMPT_CACHE_SIZE:
+            _prompt_counts.popitem(last=False)
+    return count
+
+
+def _reinit_after_fork():
+    """The lock may have been held by another thread when the process forked."""
+    global _prompt_counts, _prompt_counts_lock
+    _prompt_counts = OrderedDict()
+    _prompt_counts_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def _count_content(tokenizer: Tokenizer, content, model: Optional[str]) -> int:
+    if isinstance(content, str):
+        return _count_cached(tokenizer, content, model)
+    if isinstance(content, list):
+        # Content parts. Only text is counted.
+        return sum(
+            _count_cached(tokenizer, part["text"], model)
+            for part in content
+            if isinstance(part, dict) and isinstance(part.get("text"), str)
+        )
+    return 0
+
+
+def prompt_tokens(tokenizer: Tokenizer, request_payload: dict, model: Optional[str]) -> int:
+    messages = request_payload.get("messages")
+    if messages:
+        count = _REPLY_PRIMING_TOKENS
+        for message in messages:
+            if not isinstance(message, dict):
+                continue
+            count += _TOKENS_PER_MESSAGE
+            for key in ("role", "content", "name"):
+                count += _count_content(tokenizer, message.get(key), model)
+            if message.get("name"):
+                count += _TOKENS_PER_NAME
+        return count
+
+    prompt = request_payload.get("prompt")
+    if isinstance(prompt, list):
+        if prompt and isinstance(prompt[0], int):
+            # Already tokenized.
+            return len(prompt)
+        return sum(_count_content(tokenizer, p, model) for p in prompt)
+    return _count_content(tokenizer, prompt, model)
+
+
+def completion_tokens(tokenizer: Tokenizer, response_payload: dict, model: Optional[str]) -> int:
+    # Completions are rarely repeated, so they skip the cache.
+    texts = []
+    for choice in response_payload.get("choices") or []:
+        message = choice.get("message")
+        if message is None:
+            texts.append(choice.get("text"))
+            continue
+        texts.append(message.get("content"))
+        texts.append(message.get("refusal"))
+        for tool_call in message.get("tool_calls") or []:
+            texts.append(tool_call["function"]["name"])
+            texts.append(tool_call["function"]["arguments"])
+        function_call = message.get("function_call")
+        if function_call:
+            texts.append(function_call["name"])
+            texts.append(function_call["arguments"])
+    return sum(tokenizer.count(text, model) for text in texts if text)
+
+
+def add_usage(
+    event: AIRequestFinish,
+    request_payload: dict,
+    tokenizer: Tokenizer,
+    response_payload: Callable[[], dict] = None,
+):
+    """Add counted usage to the response payload of a streamed finish event.
+
+    `response_payload` returns the full response to count completion tokens
+    from, as the event's own may have been truncated.
+    """
+    payload = event.response_payload
+    if not payload or payload.get("usage"):
+        return
+    model = payload.get("model") or event.ai_model
+    prompt = prompt_tokens(tokenizer, request_payload or {}, model)
+    full_payload = payload if response_payload is None else response_payload()
+    completion = completion_tokens(tokenizer, full_payload, model)
+    payload["usage"] = {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+    }
+    event._metadata.counted_usage = True
+
+
+def usage_counter(
+    request_payload: dict, response_payload: Callable[[], dict] = None
+) -> Optional[Callable[[AIRequestFinish], None]]:
+    """Return a function that adds counted usage to a finish event for
+    `request_payload`, or None if counting is off or there's no tokenizer.
+    """
+    if not config.Config.count_tokens:
+        return None
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return None
+    return functools.partial(
+        add_usage,
+        # Counted later, on the worker.
+        request_payload=queue.capture_payload(request_payload),
+        tokenizer=tokenizer,
+        response_payload=response_payload,
+    )
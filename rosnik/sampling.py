@@ -0,0 +1,67 @@
+"""Head-based sampling of AI request telemetry.
+
+Whether a call is tracked is decided once, before any event is built, so
+the start and finish events of a call are always kept or dropped together.
+Rates come from `config.Config`:
+
+- `sample_rules` picks a rate by `model`, then `ai_action`, then `environment`,
+  e.g. `{"model": {"gpt-4": 0.1}, "environment": {"production": 0.5}}`.
+- `sample_rate` applies to everything else.
+
+With `sample_by_journey`, the decision is derived from the journey ID instead
+of chosen at random, so every call in a journey is kept or dropped together.
+"""
+import random
+import zlib
+from typing import Callable, Optional, Sequence
+
+from rosnik import config, state
+
+
+def _journey_fraction(journey_id: str) -> float:
+    """Map a journey ID to a stable value in [0, 1)."""
+    return zlib.crc32(journey_id.encode("utf-8")) / 2**32
+
+
+def sample_rate(ai_model: Optional[str] = None, ai_action: Optional[str] = None) -> float:
+    rules = config.Config.sample_rules
+    if rules:
+        for key, value in (
+            ("model", ai_model),
+            ("ai_action", ai_action),
+            ("environment", config.Config.environment),
+        ):
+            rates = rules.get(key)
+            if rates and value in rates:
+                return rates[value]
+    return config.Config.sample_rate
+
+
+def should_sample(ai_model: Optional[str] = None, ai_action: Optional[str] = None) -> bool:
+    rate = sample_rate(ai_model, ai_action)
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    if config.Config.sample_by_journey:
+        return _journey_fraction(state.get_journey_id()) < rate
+    return random.random() < rate
+
+
+def sampler(ai_action: str, model_keys: Sequence[str] = ("model",)) -> Callable[[dict], bool]:
+    """Build a `wrap_class_method` sampler for calls to `ai_action`.
+
+    The model is read from the first of `model_keys` present in the call's kwargs.
+    """
+
+    def sample(kwargs: dict) -> bool:
+        if not config.Config.sample_rules and config.Config.sample_rate >= 1:
+            return True
+        ai_model = None
+        for key in model_keys:
+            ai_model = kwargs.get(key)
+            if ai_model:
+                break
+        return should_sample(ai_model, ai_action)
+
+    return sample
@@ -0,0 +1,125 @@
+"""Fast event serialization.
+
+`DataClassJsonMixin.to_dict` walks type hints and fields reflectively on
+every call. Instead, we generate a specialized encoder once per dataclass
+(the same way `dataclasses` generates `__init__`) and reuse it for every
+instance. Dict and list fields are passed through as-is and left to the
+JSON encoder, whose `default` hook handles anything JSON can't represent.
+
+Fields marked `static` in their metadata, such as the runtime in `Metadata`,
+are the same for every event. `to_dict(obj, include_static=False)` leaves
+them out, for batches that send them once.
+
+`dumps` uses orjson when it's installed and the standard library otherwise.
+Both produce equivalent JSON with compact separators and unescaped UTF-8,
+though the bytes can differ, e.g. orjson writes `1e-7` where the standard
+library writes `1e-07`. NaN and infinities aren't valid JSON, so both write
+them as `null`.
+"""
+import dataclasses
+import json
+import math
+import typing
+from typing import Any, Callable, Dict, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoders: Dict[Tuple[type, bool], Callable[[Any], dict]] = {}
+
+
+def _dataclass_type(hint):
+    """Return the dataclass in `hint` (including `Optional[...]`), if any."""
+    if dataclasses.is_dataclass(hint):
+        return hint
+    if typing.get_origin(hint) is typing.Union:
+        args = [arg for arg in typing.get_args(hint) if arg is not type(None)]
+        if len(args) == 1 and dataclasses.is_dataclass(args[0]):
+            return args[0]
+    return None
+
+
+def _generate_encoder(cls, include_static: bool) -> Callable[[Any], dict]:
+    hints = typing.get_type_hints(cls)
+    namespace = {}
+    items = []
+    for f in dataclasses.fields(cls):
+        if not include_static and f.metadata.get("static"):
+            continue
+        nested = _dataclass_type(hints.get(f.name))
+        if nested is None:
+            items.append(f"{f.name!r}: obj.{f.name}")
+            continue
+        encoder_name = f"_encode_{f.name}"
+        namespace[encoder_name] = encoder_for(nested, include_static)
+        items.append(f"{f.name!r}: None if obj.{f.name} is None else {encoder_name}(obj.{f.name})")
+    source = "def encode(obj):\n    return {" + ", ".join(items) + "}\n"
+    exec(source, namespace)  # nosec: source is built from dataclass field names only
+    encoder = namespace["encode"]
+    encoder.__qualname__ = f"encode_{cls.__name__}"
+    return encoder
+
+
+def encoder_for(cls, include_static: bool = True) -> Callable[[Any], dict]:
+    key = (cls, include_static)
+    encoder = _encoders.get(key)
+    if encoder is None:
+        encoder = _encoders[key] = _generate_encoder(cls, include_static)
+    return encoder
+
+
+def to_dict(obj, include_static: bool = True) -> dict:
+    """Convert a dataclass instance to a JSONable dict, equivalent to `to_dict()`."""
+    return encoder_for(obj.__class__, include_static)(obj)
+
+
+def _default(obj):
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return to_dict(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, "model_dump"):
+        # Pydantic models, e.g. OpenAI v1 request params.
+        return obj.model_dump()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def _finite(obj):
+    """Copy `obj` with NaN and infinities replaced by None, as orjson does."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _json_dumps(obj) -> bytes:
+    try:
+        body = json.dumps(
+            obj, default=_default, separators=(",", ":"), ensure_ascii=False, allow_nan=False
+        )
+    except ValueError as e:
+        if "Out of range float" not in str(e):
+            raise
+        # Rare, so the copy is only made when it's needed.
+        body = json.dumps(
+            _finite(obj),
+            default=lambda value: _finite(_default(value)),
+            separators=(",", ":"),
+            ensure_ascii=False,
+            allow_nan=False,
+        )
+    return body.encode("utf-8")
+
+
+if orjson is not None:
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+else:
+    dumps = _json_dumps
@@ -10,14 +10,20 @@ We also manage context here, which is a user-defined
 JSONable dictionary of key-value pairs that get
 collected and sent with every event. See `rosnik.context`
 for the context manager and details on how to use it.
+
+All of it lives in one immutable `Snapshot`, held in a single
+ContextVar, so a request sets its state with one `set()` and
+an event reads everything it needs with one `get()`.
 """
 import contextvars
+import dataclasses
 from enum import Enum
 import logging
+import time
 from contextvars import ContextVar
 from typing import Optional
 
-import ulid
+from rosnik import config, ids
 
 logger = logging.getLogger(__name__)
 
@@ -26,37 +32,65 @@ _user_interaction_id_key = "user_interaction_id"
 _device_id_key = "device_id"
 _context_key = "context"
 
-journey_id_cv: ContextVar[Optional[str]] = ContextVar(_journey_id_key)
-user_interaction_id_cv: ContextVar[Optional[str]] = ContextVar(_user_interaction_id_key)
-device_id_cv: ContextVar[Optional[str]] = ContextVar(_device_id_key)
-context_cv: ContextVar[Optional[dict[str, str]]] = ContextVar(_context_key)
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Snapshot:
+    journey_id: Optional[str] = None
+    user_interaction_id: Optional[str] = None
+    device_id: Optional[str] = None
+    context: Optional[dict[str, str]] = None
+    # Result of `event_context_hook` for the current request, and the journey it was for.
+    hook_context: Optional[tuple] = None
+
+
+_empty = Snapshot()
+state_cv: ContextVar[Snapshot] = ContextVar("state", default=_empty)
+
+
+class ContextCache(str, Enum):
+    EVENT = "event"
+    REQUEST = "request"
+    TTL = "ttl"
 
 
 class State(Enum):
+    # Values are the names of `Snapshot` fields.
     JOURNEY_ID = _journey_id_key
     USER_INTERACTION_ID = _user_interaction_id_key
     DEVICE_ID = _device_id_key
     CONTEXT_ID = _context_key
 
 
-_state = {
-    State.JOURNEY_ID: journey_id_cv,
-    State.USER_INTERACTION_ID: user_interaction_id_cv,
-    State.DEVICE_ID: device_id_cv,
-    State.CONTEXT_ID: context_cv,
-}
+def snapshot() -> Snapshot:
+    return state_cv.get()
 
 
 def store(state_type: State, value: str):
-    return _state[state_type].set(value)
+    return state_cv.set(dataclasses.replace(state_cv.get(), **{state_type.value: value}))
 
 
 def retrieve(state_type: State):
-    return _state[state_type].get(None)
+    return getattr(state_cv.get(), state_type.value)
+
+
+def store_request(
+    journey_id: Optional[str], user_interaction_id: Optional[str], device_id: Optional[str]
+):
+    """Set the state for a new request in one go, creating a journey ID if
+    one wasn't supplied. Context is kept, but the cached hook result isn't.
+    """
+    return state_cv.set(
+        Snapshot(
+            journey_id=journey_id or ids.new(),
+            user_interaction_id=user_interaction_id,
+            device_id=device_id,
+            context=state_cv.get().context,
+        )
+    )
 
 
 def create_journey_id():
-    journey_id = ulid.new().str
+    journey_id = ids.new()
     store(State.JOURNEY_ID, journey_id)
     return journey_id
 
@@ -80,12 +114,51 @@ def get_context():
     return retrieve(State.CONTEXT_ID) or {}
 
 
+# Process-wide result of `event_context_hook` under the `ttl` cache:
+# (hook, expiry, context).
+_ttl_hook_context = None
+
+
+def get_hook_context() -> dict:
+    """Return the result of `event_context_hook`, reusing it according to
+    `event_context_cache`. Callers must not mutate it, as it may be shared.
+    """
+    global _ttl_hook_context
+    hook = config.Config.event_context_hook
+    if not callable(hook):
+        return {}
+
+    cache = config.Config.event_context_cache
+    if cache == ContextCache.REQUEST:
+        current = state_cv.get()
+        cached = current.hook_context
+        if cached is not None and cached[0] == current.journey_id:
+            return cached[1]
+        context = hook() or {}
+        hook_context = (current.journey_id, context)
+        state_cv.set(dataclasses.replace(state_cv.get(), hook_context=hook_context))
+        return context
+
+    if cache == ContextCache.TTL:
+        now = time.monotonic()
+        cached = _ttl_hook_context
+        if cached is not None and cached[0] is hook and now < cached[1]:
+            return cached[2]
+        context = hook() or {}
+        _ttl_hook_context = (hook, now + config.Config.event_context_ttl_ms / 1000, context)
+        return context
+
+    return hook() or {}
+
+
 def reset_context(token: contextvars.Token):
-    return context_cv.reset(token)
+    """Undo the `store` of context that returned `token`. Only the context is
+    restored, so e.g. a journey created since then is kept.
+    """
+    previous = token.old_value
+    context = None if previous is contextvars.Token.MISSING else previous.context
+    return store(State.CONTEXT_ID, context)
 
 
 def _reset():
-    journey_id_cv.set(None)
-    user_interaction_id_cv.set(None)
-    device_id_cv.set(None)
-    context_cv.set(None)
+    state_cv.set(_empty)
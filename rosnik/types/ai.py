@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import List, Optional
 
 from dataclasses_json import DataClassJsonMixin
 
@@ -45,6 +45,26 @@ class AIFunctionMetadata(DataClassJsonMixin):
     openai_attributes: Optional[OpenAIAttributes] = None
 
 
+@dataclass(kw_only=True, slots=True)
+class StreamMetrics(DataClassJsonMixin):
+    # Nanoseconds from sending the request to the first chunk,
+    # and to the first chunk with content.
+    # Null if the request's start time isn't known.
+    time_to_first_chunk_ns: Optional[int] = None
+    time_to_first_token_ns: Optional[int] = None
+    # Nanoseconds from sending the request to the last chunk
+    duration_ns: Optional[int] = None
+    chunks: int
+    # Completion tokens if the stream reported usage,
+    # otherwise the number of chunks with content.
+    tokens: int
+    # Tokens per second after the first token
+    tokens_per_second: Optional[float] = None
+    # Gaps between chunks as [upper bound in µs, count] pairs
+    # for each non-empty power-of-two bucket.
+    inter_chunk_histogram: List[List[int]]
+
+
 @dataclass(kw_only=True, slots=True)
 class AIRequestStart(AIEvent):
     event_type: str = "ai.request.start"
@@ -73,6 +93,11 @@ class AIRequestFinish(AIEvent):
     response_ms: int
     # null on success
     error_data: Optional[ErrorResponseData] = None
+    # Only set on streamed responses
+    stream_metrics: Optional[StreamMetrics] = None
+    # Why a stream ended before every choice finished:
+    # "aborted", "error" or "incomplete". Null if it completed.
+    stream_end_reason: Optional[str] = None
 
 
 @dataclass(kw_only=True, slots=True)
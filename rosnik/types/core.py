@@ -2,37 +2,55 @@ import logging
 import time
 import platform
 from dataclasses import dataclass, field
-from typing import Callable, Optional
+from typing import Callable, List, Optional
 
 from dataclasses_json import DataClassJsonMixin
-import ulid
 
 from rosnik import config
+from rosnik import ids
 from rosnik import state
 
 logger = logging.getLogger(__name__)
 
 
 def _generate_event_id():
-    return ulid.new().str
+    return ids.new()
 
 
-@dataclass(kw_only=True, slots=True)
+@dataclass(frozen=True, slots=True)
 class StaticMetadata:
-    environment: Optional[str] = field(default_factory=lambda: config.Config.environment)
+    """Describes the process sending events, so it's the same for all of them."""
+
     runtime: str = platform.python_implementation()
     runtime_version: str = platform.python_version()
     # TODO: how to sync pyproject version to this
     sdk_version: str = "0.0.37"
 
 
+# Captured once and shared by every event.
+static_metadata = StaticMetadata()
+# Marks `Metadata` fields copied from `static_metadata`. Batches send those
+# once for the whole batch instead of in every event.
+_STATIC = {"static": True}
+
+
 @dataclass(kw_only=True, slots=True)
-class Metadata(StaticMetadata):
+class Metadata:
+    environment: Optional[str] = field(default_factory=lambda: config.Config.environment)
+    runtime: str = field(default=static_metadata.runtime, metadata=_STATIC)
+    runtime_version: str = field(default=static_metadata.runtime_version, metadata=_STATIC)
+    sdk_version: str = field(default=static_metadata.sdk_version, metadata=_STATIC)
     function_fingerprint: str
     stream: bool = False
+    # Payload fields that were cut down to their size limit.
+    truncated_fields: Optional[List[str]] = None
+    # Usage in the response payload was counted locally, not reported by the API.
+    counted_usage: bool = False
 
 
 _reserved_words = ["environment"]
+# Default for fields filled in from `state` by `Event.__post_init__`.
+_FROM_STATE = object()
 
 
 @dataclass(kw_only=True, slots=True)
@@ -40,7 +58,7 @@ class Event(DataClassJsonMixin):
     # Unique event ID
     event_id: str = field(default_factory=_generate_event_id)
     event_type: str
-    journey_id: str = field(default_factory=state.get_journey_id)
+    journey_id: str = _FROM_STATE
     # Epoch in ms
     sent_at: int = field(default_factory=lambda: int(time.time_ns() / 1000000))
     # Epoch unless not set, which will be -1
@@ -49,54 +67,59 @@ class Event(DataClassJsonMixin):
     context: Optional[dict] = None
     # Users could be part of an AI event or a User event
     user_id: Optional[str] = None
-    device_id: Optional[str] = field(default_factory=state.get_device_id)
+    device_id: Optional[str] = _FROM_STATE
     # Our own metadata
     _metadata: Metadata
     # User Interaction ID: this is the causal user.interaction.track
     # event ID for this event. If it's unset then something else
     # we're not tracking caused this action.
-    user_interaction_id: Optional[str] = field(default_factory=state.get_user_interaction_id)
+    user_interaction_id: Optional[str] = _FROM_STATE
 
     def __post_init__(self):
         """We have two different contexts:
         1. Hook-level context which request-level / global
         2. Event-level context which is per-event / via a context manager
         Here we merge them together.
+
+        State is read from a single snapshot, as are any IDs left unset.
         """
-        stored_context = state.get_context()
+        current = state.snapshot()
+        if self.journey_id is _FROM_STATE:
+            self.journey_id = current.journey_id or state.create_journey_id()
+        if self.device_id is _FROM_STATE:
+            self.device_id = current.device_id
+        if self.user_interaction_id is _FROM_STATE:
+            self.user_interaction_id = current.user_interaction_id
+        stored_context = current.context or {}
 
         # If both contexts are empty, we don't need to do anything.
         if not isinstance(config.Config.event_context_hook, Callable) and not stored_context:
             return
 
-        # Make this a callable so we can call it later if needed.
-        event_hook = config.Config.event_context_hook
-        if not isinstance(event_hook, Callable):
-
-            def event_hook():
-                return {}
-
         try:
-            global_context = event_hook()
-            # Following the same precedence as below, pull environment if set.
+            global_context = state.get_hook_context()
             # Event-level context takes precedence over stored context, which takes precedence
-            # over global context. If none of them have an environment, then we don't set it.
-            env = global_context.pop("environment", None)
-            if env:
-                self._metadata.environment = env
-
-            env = stored_context.pop("environment", None)
+            # over global context. Environment follows the same precedence, and if none of
+            # them have one, then we don't set it.
+            contexts = [c for c in (global_context, stored_context, self.context) if c]
+            if not contexts:
+                return
+            env = None
+            for context in contexts:
+                env = context.get("environment") or env
             if env:
                 self._metadata.environment = env
 
-            if self.context is not None:
-                env = self.context.pop("environment", None)
-                if env:
-                    self._metadata.environment = env
-
-            # Merge everything together with this event's specific context taking precedence,
-            # then the stored context, then the global context.
-            self.context = {**global_context, **stored_context, **(self.context or {})}
+            # None of them are mutated, as the hook's result may be cached. With only one
+            # context and no environment to remove, it's shared rather than copied.
+            if len(contexts) == 1 and "environment" not in contexts[0]:
+                self.context = contexts[0]
+                return
+            merged = {}
+            for context in contexts:
+                merged.update(context)
+            merged.pop("environment", None)
+            self.context = merged
         except Exception:
             logger.exception(
                 f"Could not generate context from {config.Config.event_context_hook.__name__}"
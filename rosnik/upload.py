@@ -0,0 +1,226 @@
+"""Upload NDJSON event files, such as those written by the `file` exporter
+or left in a spool directory, to the ingest API.
+
+```sh
+python -m rosnik upload --api-key api-key --concurrency 8 /var/log/rosnik/
+```
+
+Each line is validated against the event dataclass for its `event_type`,
+then sent as-is in batches. Progress is recorded in a checkpoint file after
+every batch, so an interrupted upload picks up where it left off when rerun
+with the same checkpoint.
+"""
+import concurrent.futures
+import dataclasses
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from rosnik import api
+from rosnik.types import ai, user
+
+logger = logging.getLogger(__name__)
+
+_EVENT_CLASSES = [
+    ai.AIRequestStart,
+    ai.AIRequestFinish,
+    ai.AIRequestStartStream,
+    user.UserGoalSuccess,
+    user.UserInteractionTrack,
+    user.UserFeedbackTrack,
+]
+EVENT_TYPES = {cls.__dataclass_fields__["event_type"].default: cls for cls in _EVENT_CLASSES}
+DEFAULT_CHECKPOINT = ".rosnik-upload-checkpoint.json"
+
+
+def validate(payload) -> Optional[str]:
+    """Return why `payload` isn't a valid event, or None if it is."""
+    if not isinstance(payload, dict):
+        return "not a JSON object"
+    cls = EVENT_TYPES.get(payload.get("event_type"))
+    if cls is None:
+        return f"unknown event_type {payload.get('event_type')!r}"
+    try:
+        cls.from_dict(payload)
+    except Exception as e:
+        return f"invalid {cls.__name__}: {e!r}"
+    return None
+
+
+def find_files(paths: List[str]) -> List[str]:
+    """Expand directories into the NDJSON files inside them, oldest first."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        found = set(glob.glob(os.path.join(path, "*.ndjson")))
+        # Rotated exports, e.g. events.ndjson.1
+        found.update(glob.glob(os.path.join(path, "*.ndjson.*")))
+        files.extend(sorted(found, key=os.path.getmtime))
+    return files
+
+
+def file_key(file: str) -> str:
+    """Identify `file` by its device, inode and first line, so its progress
+    is kept when the `file` exporter renames it on rotation, but not when
+    it's replaced or rewritten.
+    """
+    stat = os.stat(file)
+    with open(file, "rb") as f:
+        first_line = f.readline()
+    return f"{stat.st_dev}:{stat.st_ino}:{hashlib.sha256(first_line).hexdigest()}"
+
+
+class Checkpoint:
+    """Number of lines already uploaded from each file, by `file_key`, saved atomically as JSON."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.lines: Dict[str, int] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.lines = json.load(f)
+
+    def get(self, key: str) -> int:
+        return self.lines.get(key, 0)
+
+    def set(self, key: str, lines: int):
+        self.lines[key] = lines
+        if not self.path:
+            return
+        temp = f"{self.path}.tmp"
+        with open(temp, "w") as f:
+            json.dump(self.lines, f)
+        os.replace(temp, self.path)
+
+
+@dataclasses.dataclass
+class UploadResult:
+    uploaded: int = 0
+    invalid: int = 0
+    failed: bool = False
+
+
+def _read_batches(
+    file: str, start: int, batch_size: int, result: UploadResult
+) -> Iterator[Tuple[int, List[dict]]]:
+    """Yield (line number after the batch, valid payloads) from line `start` onwards."""
+    batch = []
+    line_number = last_end = start
+    with open(file, "rb") as f:
+        for line_number, line in enumerate(f, start=1):
+            if line_number <= start or not line.strip():
+                continue
+            try:
+                payload = json.loads(line)
+            except ValueError as e:
+                reason = f"malformed JSON: {e}"
+            else:
+                reason = validate(payload)
+            if reason is not None:
+                result.invalid += 1
+                logger.warning(f"Skipping {file}:{line_number}: {reason}")
+                continue
+            batch.append(payload)
+            if len(batch) >= batch_size:
+                yield line_number, batch
+                batch = []
+                last_end = line_number
+    if line_number < start:
+        # Shorter than its checkpoint, so it isn't the file that was checkpointed.
+        logger.warning(f"{file} is shorter than its checkpoint. Uploading it from the start.")
+        yield from _read_batches(file, 0, batch_size, result)
+        return
+    # Also covers trailing invalid lines, so the checkpoint moves past them.
+    if line_number > last_end:
+        yield line_number, batch
+
+
+class Uploader:
+    def __init__(
+        self,
+        base_url: str = api._base_url,
+        batch_size: int = 100,
+        concurrency: int = 4,
+        checkpoint: Checkpoint = None,
+        dry_run: bool = False,
+    ):
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.concurrency = max(concurrency, 1)
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.dry_run = dry_run
+        # Sessions aren't thread-safe, so each upload thread gets its own client.
+        self._local = threading.local()
+        self._circuit_breaker = api.CircuitBreaker()
+
+    def _client(self) -> api.IngestClient:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = api.IngestClient(
+                base_url=self.base_url, circuit_breaker=self._circuit_breaker
+            )
+        return client
+
+    def _send(self, payloads: List[dict]) -> bool:
+        if self.dry_run or not payloads:
+            return True
+        return self._client().send_serialized_batch(payloads)
+
+    def upload_file(self, file: str, executor, result: UploadResult):
+        """Upload `file` in concurrent batches, checkpointing the longest
+        prefix of it that's been fully uploaded.
+        """
+        pending = {}
+        # Line numbers of batches in the order they were read, and which have completed.
+        order = []
+        done = {}
+
+        def collect(futures):
+            for future in futures:
+                end, count = pending.pop(future)
+                done[end] = future.result()
+                if done[end]:
+                    result.uploaded += count
+                else:
+                    result.failed = True
+            # Advance the checkpoint past every leading batch that was delivered.
+            advanced = None
+            while order and done.get(order[0]):
+                advanced = order.pop(0)
+                del done[advanced]
+            if advanced is not None:
+                self.checkpoint.set(key, advanced)
+
+        # Taken once, as the file may be rotated while it's uploaded.
+        key = file_key(file)
+        start = self.checkpoint.get(key)
+        for end, batch in _read_batches(file, start, self.batch_size, result):
+            if result.failed:
+                break
+            if len(pending) >= self.concurrency * 2:
+                finished, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                collect(finished)
+                if result.failed:
+                    break
+            order.append(end)
+            pending[executor.submit(self._send, batch)] = (end, len(batch))
+        collect(concurrent.futures.wait(pending).done)
+
+    def upload(self, files: List[str]) -> UploadResult:
+        result = UploadResult()
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+            for file in files:
+                logger.info(f"Uploading {file}")
+                self.upload_file(file, executor, result)
+                if result.failed:
+                    logger.error(f"Stopped uploading at {file}. Rerun to resume.")
+                    break
+        return result
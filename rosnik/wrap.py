@@ -1,13 +1,20 @@
 import inspect
 import logging
 import sys
+import time
 from typing import Callable
 
 
 import wrapt
 
+from rosnik import config
+
 logger = logging.getLogger(__name__)
 
+# Fingerprint strings keyed by the ids of the code objects on the call stack.
+_fingerprints = {}
+_MAX_CACHED_FINGERPRINTS = 4096
+
 
 def get_stack_frames(num, use_get_frame=True):
     """Quickly get stack frames via:
@@ -28,6 +35,46 @@ def get_stack_frames(num, use_get_frame=True):
         return inspect.stack()[:num]
 
 
+def get_function_fingerprint(depth: int) -> str:
+    """Period separated names of the `depth` functions calling into this one,
+    innermost first, so we can do function chain search later.
+
+    A call site's chain of code objects identifies its fingerprint, so we only
+    build the string the first time we see that chain.
+    """
+    if depth <= 0:
+        return ""
+    if not hasattr(sys, "_getframe"):
+        return ".".join(frame.function for frame in inspect.stack()[1 : depth + 1])
+
+    frame = sys._getframe(1)
+    code_ids = []
+    append = code_ids.append
+    for _ in range(depth):
+        if frame is None:
+            break
+        # Hashing ids is much cheaper than hashing code objects.
+        append(id(frame.f_code))
+        frame = frame.f_back
+    key = tuple(code_ids)
+
+    cached = _fingerprints.get(key)
+    if cached is not None:
+        return cached[0]
+
+    codes = []
+    frame = sys._getframe(1)
+    while frame is not None and len(codes) < depth:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    fingerprint = ".".join(code.co_name for code in codes)
+    if len(_fingerprints) >= _MAX_CACHED_FINGERPRINTS:
+        _fingerprints.clear()
+    # Holding on to the code objects keeps their ids from being reused while cached.
+    _fingerprints[key] = (fingerprint, codes)
+    return fingerprint
+
+
 def wrap_class_method(
     klass,
     method_name: str,
@@ -35,13 +82,38 @@ def wrap_class_method(
     response_hook: Callable,
     error_hook: Callable,
     streamed_response_hook: Callable,
+    is_async: bool = False,
+    sampler: Callable[[dict], bool] = None,
 ):
+    """Instrument `klass.method_name` with our hooks.
+
+    Set `is_async` for methods that return a coroutine. SDKs often decorate
+    their async methods with plain functions, so we can't reliably detect it.
+
+    `sampler` is called with the call's kwargs before anything else. If it
+    returns False, no hooks run, unless the call raises and errors are kept
+    regardless of sampling.
+    """
+
     def rosnik_wrapper(wrapped, instance, args, kwargs):
-        limited_frames = get_stack_frames(10)
-        # Flatten into a period separated sequence so we can do function chain search later.
-        calling_functions = ".".join([frame.f_code.co_name for frame in limited_frames])
+        if sampler is not None and not sampler(kwargs):
+            if not config.Config.sample_keep_errors:
+                return wrapped(*args, **kwargs)
+            sent_at = int(time.time_ns() / 1000000)
+            try:
+                return wrapped(*args, **kwargs)
+            except Exception as e:
+                calling_functions = get_function_fingerprint(config.Config.fingerprint_depth)
+                request_event = request_hook(
+                    kwargs, calling_functions, instance=instance, sent_at=sent_at
+                )
+                error_hook(e, calling_functions, request_event, instance=instance)
+                raise e
+
+        calling_functions = get_function_fingerprint(config.Config.fingerprint_depth)
 
         request_event = request_hook(kwargs, calling_functions, instance=instance)
+        started_ns = time.perf_counter_ns()
         try:
             result = wrapped(*args, **kwargs)
         except Exception as e:
@@ -54,9 +126,55 @@ def wrap_class_method(
         # and final output.
         if kwargs.get("stream") is True:
             return streamed_response_hook(
-                result, calling_functions, prior_event=request_event, instance=instance
+                result,
+                calling_functions,
+                prior_event=request_event,
+                instance=instance,
+                started_ns=started_ns,
+                request_payload=kwargs,
+            )
+
+        return result
+
+    async def rosnik_async_wrapper(wrapped, instance, args, kwargs):
+        if sampler is not None and not sampler(kwargs):
+            if not config.Config.sample_keep_errors:
+                return await wrapped(*args, **kwargs)
+            sent_at = int(time.time_ns() / 1000000)
+            try:
+                return await wrapped(*args, **kwargs)
+            except Exception as e:
+                calling_functions = get_function_fingerprint(config.Config.fingerprint_depth)
+                request_event = request_hook(
+                    kwargs, calling_functions, instance=instance, sent_at=sent_at
+                )
+                error_hook(e, calling_functions, request_event, instance=instance)
+                raise e
+
+        calling_functions = get_function_fingerprint(config.Config.fingerprint_depth)
+
+        request_event = request_hook(kwargs, calling_functions, instance=instance)
+        started_ns = time.perf_counter_ns()
+        try:
+            result = await wrapped(*args, **kwargs)
+        except Exception as e:
+            error_hook(e, calling_functions, request_event, instance=instance)
+            raise e
+
+        response_hook(result, calling_functions, prior_event=request_event, instance=instance)
+
+        if kwargs.get("stream") is True:
+            return streamed_response_hook(
+                result,
+                calling_functions,
+                prior_event=request_event,
+                instance=instance,
+                started_ns=started_ns,
+                request_payload=kwargs,
             )
 
         return result
 
-    wrapt.wrap_function_wrapper(klass, method_name, rosnik_wrapper)
+    wrapt.wrap_function_wrapper(
+        klass, method_name, rosnik_async_wrapper if is_async else rosnik_wrapper
+    )
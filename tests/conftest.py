@@ -1,11 +1,16 @@
+import gzip
+import http.server
+import json
 import logging
 import os
 import sys
+import threading
 
 import pytest
 
 from rosnik import config
 from rosnik.events import queue
+from rosnik.types.core import Event, Metadata
 
 
 @pytest.fixture(scope="module")
@@ -68,3 +73,58 @@ def event_queue(mocker):
     while queue.event_queue.qsize() > 0:
         queue.event_queue.get(block=False)
     assert queue.event_queue.qsize() == 0
+
+
+class _IngestStub(http.server.BaseHTTPRequestHandler):
+    """Stand-in for the ingest API that records events and can simulate an outage."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        body = json.loads(body)
+        # `budget` is how many more requests succeed before the outage starts.
+        if self.server.budget is not None:
+            self.server.down = self.server.budget <= 0
+            self.server.budget -= 1
+        if self.server.down:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if isinstance(body, dict) and "events" in body:
+            # A batch, with its static metadata in the header.
+            body = body["events"]
+        self.server.received.extend(body if isinstance(body, list) else [body])
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ingest_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _IngestStub)
+    server.down = False
+    server.budget = None
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_event():
+    """Build a minimal event with the given ID."""
+
+    def _event(event_id):
+        return Event(
+            event_type="test.event",
+            event_id=event_id,
+            journey_id="journey_123",
+            _metadata=Metadata(function_fingerprint=""),
+        )
+
+    return _event
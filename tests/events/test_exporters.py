@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+from rosnik import config
+from rosnik.events import exporters
+from rosnik.events import queue as queue_module
+from rosnik.events.queue import EventProcessor, EventQueue
+
+
+def test_ingest_exporter(mocker, make_event):
+    client = mocker.Mock()
+    exporter = exporters.IngestExporter(client)
+    event = make_event("1")
+    exporter.export([event])
+    client.send_event.assert_called_once_with(event)
+    exporter.export([event, event])
+    client.send_batch.assert_called_once_with([event, event])
+    exporter.export_serialized([{"event_id": "1"}])
+    client.send_serialized_batch.assert_called_once_with([{"event_id": "1"}])
+
+
+def test_stdout_exporter(capsys, make_event):
+    assert exporters.StdoutExporter().export([make_event("1"), make_event("2")])
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line)["event_id"] for line in lines] == ["1", "2"]
+
+
+def test_in_memory_exporter(make_event):
+    exporter = exporters.InMemoryExporter()
+    event = make_event("1")
+    exporter.export([event])
+    assert exporter.events == [event.to_dict()]
+    exporter.clear()
+    assert exporter.events == []
+
+
+def test_ndjson_file_exporter(tmp_path, make_event):
+    path = tmp_path / "events" / "events.ndjson"
+    exporter = exporters.NDJSONFileExporter(str(path))
+    exporter.export([make_event("1"), make_event("2")])
+    exporter.shutdown()
+    lines = path.read_text().splitlines()
+    assert [json.loads(line)["event_id"] for line in lines] == ["1", "2"]
+
+
+def test_ndjson_file_exporter__rotates(tmp_path, make_event):
+    path = tmp_path / "events.ndjson"
+    exporter = exporters.NDJSONFileExporter(str(path), max_bytes=1, backup_count=2)
+    for i in range(4):
+        exporter.export([make_event(str(i))])
+    exporter.shutdown()
+
+    def event_ids(p):
+        return [json.loads(line)["event_id"] for line in p.read_text().splitlines()]
+
+    assert event_ids(path) == ["3"]
+    assert event_ids(tmp_path / "events.ndjson.1") == ["2"]
+    assert event_ids(tmp_path / "events.ndjson.2") == ["1"]
+    assert not (tmp_path / "events.ndjson.3").exists()
+
+
+def test_fan_out_exporter(mocker, make_event):
+    memory = exporters.InMemoryExporter()
+    client = mocker.Mock()
+    client.send_event.return_value = False
+    exporter = exporters.FanOutExporter([memory, exporters.IngestExporter(client)])
+
+    assert not exporter.export([make_event("1")])
+    assert [e["event_id"] for e in memory.events] == ["1"]
+    client.send_event.assert_called_once()
+
+
+def test_processor_dispatches_to_exporter(mocker, make_event):
+    api_client = mocker.Mock()
+    memory = exporters.InMemoryExporter()
+    processor = EventProcessor(EventQueue(), api_client, exporter=memory)
+    processor.send([make_event("1"), make_event("2")])
+    assert [e["event_id"] for e in memory.events] == ["1", "2"]
+    api_client.send_batch.assert_not_called()
+
+
+@pytest.fixture
+def shared_exporters(monkeypatch):
+    monkeypatch.setattr(queue_module, "_shared_exporters", {})
+
+
+def test_build_exporter__from_names(shared_exporters, tmp_path, mocker):
+    config.Config.exporter = "ingest, file"
+    config.Config.export_path = str(tmp_path / "events.ndjson")
+    client = mocker.Mock()
+
+    exporter = queue_module._build_exporter(client)
+    assert isinstance(exporter, exporters.FanOutExporter)
+    ingest, file_ = exporter.exporters
+    assert ingest.client is client
+    assert file_.path == str(tmp_path / "events.ndjson")
+    # File exporters are shared between workers.
+    assert queue_module._build_exporter(mocker.Mock()).exporters[1] is file_
+
+
+def test_build_exporter__default(shared_exporters, mocker):
+    assert queue_module._build_exporter(mocker.Mock()) is None
+
+
+def test_build_exporter__unknown(shared_exporters, mocker):
+    config.Config.exporter = "carrier-pigeon"
+    with pytest.raises(ValueError):
+        queue_module._build_exporter(mocker.Mock())
+
+
+def test_enqueue_event__sync_mode_uses_exporter(shared_exporters, make_event):
+    memory = exporters.InMemoryExporter()
+    config.Config.sync_mode = True
+    config.Config.exporter = memory
+    queue_module.enqueue_event(make_event("1"))
+    assert [e["event_id"] for e in memory.events] == ["1"]
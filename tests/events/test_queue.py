@@ -0,0 +1,384 @@
+import asyncio
+import contextvars
+import os
+import queue as queue_
+import threading
+
+import pytest
+
+from rosnik import api, config, state
+from rosnik.events import queue as queue_module
+from rosnik.events.queue import (
+    Deferred,
+    EventProcessor,
+    EventQueue,
+    OverflowPolicy,
+    dropped_events,
+    enqueue_event,
+    enqueue_new_event,
+)
+from rosnik.types.core import Event, Metadata
+
+
+@pytest.fixture
+def api_client(mocker):
+    return mocker.Mock()
+
+
+def test_next_batch__defaults_to_single_event(api_client, make_event):
+    q = queue_.Queue()
+    q.put(make_event("1"))
+    q.put(make_event("2"))
+
+    processor = EventProcessor(q, api_client)
+    batch = processor.next_batch()
+    assert [e.event_id for e in batch] == ["1"]
+    assert q.qsize() == 1
+
+
+def test_next_batch__drains_up_to_batch_size(api_client, make_event):
+    config.Config.batch_size = 2
+    config.Config.flush_interval_ms = 1000
+    q = queue_.Queue()
+    for i in range(3):
+        q.put(make_event(str(i)))
+
+    processor = EventProcessor(q, api_client)
+    batch = processor.next_batch()
+    assert [e.event_id for e in batch] == ["0", "1"]
+    assert q.qsize() == 1
+
+
+def test_next_batch__flushes_after_interval(api_client, make_event):
+    config.Config.batch_size = 10
+    config.Config.flush_interval_ms = 10
+    q = queue_.Queue()
+    q.put(make_event("1"))
+
+    processor = EventProcessor(q, api_client)
+    batch = processor.next_batch()
+    assert [e.event_id for e in batch] == ["1"]
+
+
+def _typed_event(event_id, event_type):
+    return Event(
+        event_type=event_type,
+        event_id=event_id,
+        journey_id="journey_123",
+        _metadata=Metadata(function_fingerprint=""),
+    )
+
+
+def test_offer__drop_newest(make_event):
+    q = EventQueue()
+    assert q.offer(make_event("1"), max_events=1)
+    assert not q.offer(make_event("2"), max_events=1)
+    assert q.get().event_id == "1"
+    assert q.dropped == {"test.event": 1}
+
+
+def test_offer__drop_oldest(make_event):
+    q = EventQueue()
+    for i in range(3):
+        assert q.offer(make_event(str(i)), policy=OverflowPolicy.DROP_OLDEST, max_events=2)
+    assert [q.get().event_id, q.get().event_id] == ["1", "2"]
+    assert q.dropped == {"test.event": 1}
+
+
+def test_offer__drop_priority():
+    q = EventQueue()
+    kwargs = {"policy": OverflowPolicy.DROP_PRIORITY, "max_events": 2}
+    assert q.offer(_typed_event("start", "ai.request.start"), **kwargs)
+    assert q.offer(_typed_event("stream", "ai.request.start.stream"), **kwargs)
+    # Sheds the stream event to make room for the finish event.
+    assert q.offer(_typed_event("finish", "ai.request.finish"), **kwargs)
+    # Nothing lower priority than another start event is left, so it is dropped.
+    assert not q.offer(_typed_event("start2", "ai.request.start"), **kwargs)
+
+    assert [q.get().event_id, q.get().event_id] == ["start", "finish"]
+    assert q.dropped == {"ai.request.start.stream": 1, "ai.request.start": 1}
+
+
+def test_offer__block_with_timeout(make_event):
+    q = EventQueue()
+    kwargs = {"policy": OverflowPolicy.BLOCK, "max_events": 1, "timeout": 0.01}
+    assert q.offer(make_event("1"), **kwargs)
+    assert not q.offer(make_event("2"), **kwargs)
+    assert q.dropped == {"test.event": 1}
+
+
+def test_offer__block_until_room(make_event):
+    q = EventQueue()
+    kwargs = {"policy": OverflowPolicy.BLOCK, "max_events": 1, "timeout": 5}
+    assert q.offer(make_event("1"), **kwargs)
+    threading.Timer(0.01, q.get).start()
+    assert q.offer(make_event("2"), **kwargs)
+    assert q.get().event_id == "2"
+
+
+def test_offer__max_bytes(make_event):
+    q = EventQueue()
+    big = _typed_event("1", "ai.request.start")
+    big.context = {"messages": [{"role": "user", "content": "x" * 1000}]}
+    # An empty queue always accepts an event, even an oversized one.
+    assert q.offer(big, max_bytes=100)
+    assert not q.offer(make_event("2"), max_bytes=100)
+    q.get()
+    assert q.bytes == 0
+
+
+def test_enqueue_event__counts_drops(event_queue, make_event):
+    config.Config.max_queue_size = 1
+    enqueue_event(make_event("1"))
+    enqueue_event(make_event("2"))
+    assert event_queue.qsize() == 1
+    assert dropped_events()["test.event"] >= 1
+
+
+def test_enqueue_event__starts_worker_pool(monkeypatch, event_queue, make_event):
+    monkeypatch.setattr(queue_module, "event_processors", [])
+    config.Config.num_workers = 3
+    enqueue_event(make_event("1"))
+    enqueue_event(make_event("2"))
+
+    assert len(queue_module.event_processors) == 3
+    assert queue_module.EventProcessor.call_count == 3
+    # Each worker gets its own client since sessions aren't thread-safe.
+    clients = {call.args[1] for call in queue_module.EventProcessor.call_args_list}
+    assert len(clients) == 3
+
+
+@pytest.fixture
+def running_processor(monkeypatch, api_client):
+    q = EventQueue()
+    processor = EventProcessor(q, api_client)
+    monkeypatch.setattr(queue_module, "event_queue", q)
+    monkeypatch.setattr(queue_module, "event_processors", [processor])
+    monkeypatch.setattr(queue_module, "_is_shutdown", False)
+    processor.start()
+    yield processor
+    if processor.is_alive():
+        q.put_stop()
+        processor.join(1)
+
+
+def test_flush(running_processor, api_client, make_event):
+    for i in range(3):
+        running_processor.event_queue.offer(make_event(str(i)))
+    assert queue_module.flush(timeout=5)
+    assert api_client.send_event.call_count == 3
+
+
+def test_flush__timeout(running_processor, api_client, make_event):
+    release = threading.Event()
+    api_client.send_event.side_effect = lambda event: release.wait(5)
+    running_processor.event_queue.offer(make_event("1"))
+    assert not queue_module.flush(timeout=0.01)
+    release.set()
+    assert queue_module.flush(timeout=5)
+
+
+def test_processor_survives_send_errors(running_processor, api_client, make_event):
+    api_client.send_event.side_effect = [Exception("oh no"), None]
+    running_processor.event_queue.offer(make_event("1"))
+    running_processor.event_queue.offer(make_event("2"))
+    assert queue_module.flush(timeout=5)
+    assert running_processor.is_alive()
+    assert api_client.send_event.call_count == 2
+
+
+def test_shutdown(running_processor, api_client, make_event):
+    for i in range(3):
+        running_processor.event_queue.offer(make_event(str(i)))
+    assert queue_module.shutdown(timeout=5)
+    assert not running_processor.is_alive()
+    assert api_client.send_event.call_count == 3
+    assert queue_module.event_processors == []
+
+    # Events tracked after shutdown are dropped.
+    enqueue_event(make_event("4"))
+    assert running_processor.event_queue.qsize() == 0
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    # Restore the module's pipeline after tests that rebuild it.
+    for attr in ("event_queue", "api_client", "event_processors", "_processors_lock", "_pid"):
+        monkeypatch.setattr(queue_module, attr, getattr(queue_module, attr))
+
+
+def test_enqueue_event__rebuilds_pipeline_after_fork(pipeline, monkeypatch, make_event):
+    parent_queue = queue_module.event_queue
+    parent_client = queue_module.api_client
+    monkeypatch.setattr(queue_module, "event_processors", [object()])
+    monkeypatch.setattr(queue_module, "_pid", -1)
+
+    enqueue_event(make_event("1"))
+
+    assert queue_module._pid == os.getpid()
+    assert queue_module.event_queue is not parent_queue
+    assert queue_module.api_client is not parent_client
+    assert queue_module.event_queue.get(block=False).event_id == "1"
+    assert len(queue_module.event_processors) == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")
+def test_fork_rebuilds_pipeline_in_child(pipeline, make_event):
+    parent_queue = queue_module.event_queue
+    parent_queue.offer(make_event("parent"))
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child: report whether we got a fresh, empty pipeline.
+        ok = (
+            queue_module.event_queue is not parent_queue
+            and queue_module.event_queue.qsize() == 0
+            and queue_module.event_processors == []
+            and queue_module._pid == os.getpid()
+        )
+        os.write(write_fd, b"1" if ok else b"0")
+        os._exit(0)
+
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == b"1"
+    os.close(read_fd)
+    assert queue_module.event_queue is parent_queue
+    assert parent_queue.get(block=False).event_id == "parent"
+
+
+def test_enqueue_event__never_blocks_event_loop(event_queue, make_event):
+    config.Config.max_queue_size = 1
+    config.Config.queue_overflow_policy = "block"
+    config.Config.enqueue_timeout_ms = 60_000
+
+    async def _enqueue():
+        enqueue_event(make_event("1"))
+        enqueue_event(make_event("2"))
+
+    asyncio.run(asyncio.wait_for(_enqueue(), timeout=5))
+    assert event_queue.qsize() == 1
+
+
+def test_processor_counts_undelivered_events(api_client, make_event):
+    api_client.send_batch.return_value = False
+    q = EventQueue()
+    processor = EventProcessor(q, api_client)
+    processor.send([make_event("1"), make_event("2")])
+    assert q.dropped["test.event"] == 2
+
+
+def test_processor_drops_only_unencodable_events(ingest_server, make_event):
+    host, port = ingest_server.server_address
+    client = api.IngestClient(base_url=f"http://{host}:{port}/api/v1/events")
+    q = EventQueue()
+    bad = make_event("2")
+    # e.g. an SDK object passed through in the request kwargs.
+    bad.context = {"timeout": object()}
+
+    EventProcessor(q, client).send([make_event("1"), bad, make_event("3")])
+    assert [e["event_id"] for e in ingest_server.received] == ["1", "3"]
+    assert q.dropped["test.event"] == 1
+
+
+def test_enqueue_event__defers_prepare_to_worker(event_queue, api_client, make_event):
+    def prepare(event):
+        event.context = {"prepared_on": threading.current_thread().name}
+
+    enqueue_event(make_event("1"), prepare=prepare)
+    deferred = event_queue.get()
+    assert isinstance(deferred, Deferred)
+    assert deferred.event_type == "test.event"
+    assert deferred.context is None
+
+    def _send():
+        EventProcessor(EventQueue(), api_client).send([deferred])
+
+    worker = threading.Thread(target=_send, name="worker")
+    worker.start()
+    worker.join()
+    sent = api_client.send_event.call_args.args[0]
+    assert sent.event_id == "1"
+    assert sent.context == {"prepared_on": "worker"}
+
+
+def test_deferred__sends_event_if_prepare_fails(make_event):
+    def prepare(event):
+        raise ValueError("oops")
+
+    event = make_event("1")
+    assert Deferred(event, prepare).resolve() is event
+
+
+def test_enqueue_new_event__builds_now_by_default(event_queue):
+    fields = {"event_type": "test.event", "_metadata": Metadata(function_fingerprint="")}
+    event = enqueue_new_event(Event, fields)
+    assert isinstance(event, Event)
+    assert event_queue.get() is event
+
+
+def test_enqueue_new_event__deferred(event_queue):
+    config.Config.defer_events = True
+    token = state.store(state.State.CONTEXT_ID, {"tenant": "a"})
+    built_on = []
+
+    def build(**fields):
+        built_on.append(threading.current_thread().name)
+        return Event(**fields)
+
+    fields = {
+        "event_type": "test.event",
+        "user_id": "user",
+        "_metadata": Metadata(function_fingerprint=""),
+    }
+    deferred = enqueue_new_event(Event, fields, build=build)
+    state.reset_context(token)
+    assert event_queue.get() is deferred
+    assert built_on == []
+    # Captured up front, so later events can refer to them.
+    assert deferred.event_id
+    assert deferred.sent_at
+    assert deferred.journey_id == state.get_journey_id()
+    assert deferred.user_id == "user"
+    assert deferred.event_type == "test.event"
+
+    events = []
+    worker = threading.Thread(target=lambda: events.append(deferred.resolve()), name="worker")
+    worker.start()
+    worker.join()
+    event = events[0]
+    assert built_on == ["worker"]
+    assert event.event_id == deferred.event_id
+    assert event.journey_id == deferred.journey_id
+    # Built with the caller's context at the time it was enqueued.
+    assert event.context == {"tenant": "a"}
+
+
+def test_enqueue_new_event__deferred_captures_request_payload(event_queue):
+    config.Config.defer_events = True
+    messages = [{"role": "user", "content": "Hi"}]
+    fields = {
+        "event_type": "test.event",
+        "request_payload": {"model": "gpt-4", "messages": messages},
+        "_metadata": Metadata(function_fingerprint=""),
+    }
+    deferred = enqueue_new_event(Event, fields, build=lambda request_payload, **f: request_payload)
+
+    # What callers commonly do once `create` returns.
+    messages.append({"role": "assistant", "content": "Hello"})
+    messages[0]["content"] = "Changed"
+    assert deferred.resolve() == {
+        "model": "gpt-4",
+        "messages": [{"role": "user", "content": "Hi"}],
+    }
+
+
+def test_deferred__drops_event_that_fails_to_build(api_client, make_event):
+    config.Config.defer_events = True
+
+    def build(**fields):
+        raise ValueError("oops")
+
+    deferred = Deferred(build=build, fields={"event_id": "1"}, context=contextvars.copy_context())
+    EventProcessor(EventQueue(), api_client).send([deferred, make_event("2")])
+    assert api_client.send_event.call_args.args[0].event_id == "2"
@@ -0,0 +1,177 @@
+import glob
+import json
+import os
+
+import pytest
+
+from rosnik import api, config
+from rosnik.events.queue import EventProcessor, EventQueue
+from rosnik.events.spool import FsyncPolicy, Spool
+
+
+def _payload(event_id):
+    return {"event_id": event_id, "event_type": "test.event"}
+
+
+def test_write_read_ack(tmp_path):
+    spool = Spool(str(tmp_path))
+    assert not spool.pending()
+    assert spool.write([_payload("1"), _payload("2"), _payload("3")])
+    assert spool.pending()
+
+    batch = spool.read_batch(2)
+    assert [p["event_id"] for p in batch] == ["1", "2"]
+    # Unacknowledged events are handed out again.
+    assert spool.read_batch(2) == batch
+
+    spool.ack()
+    assert [p["event_id"] for p in spool.read_batch(2)] == ["3"]
+    spool.ack()
+    assert not spool.pending()
+    assert os.listdir(tmp_path) == []
+
+
+def test_rotates_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=1, fsync=FsyncPolicy.NEVER)
+    spool.write([_payload("1")])
+    spool.write([_payload("2")])
+    assert len(glob.glob(str(tmp_path / "*.ndjson"))) == 2
+
+    assert [p["event_id"] for p in spool.read_batch(10)] == ["1"]
+    spool.ack()
+    assert [p["event_id"] for p in spool.read_batch(10)] == ["2"]
+
+
+def test_caps_disk_usage(tmp_path):
+    line_bytes = len(json.dumps(_payload("1"), separators=(",", ":"))) + 1
+    spool = Spool(str(tmp_path), max_bytes=line_bytes * 2, segment_bytes=1)
+    for i in range(3):
+        assert spool.write([_payload(str(i))])
+
+    # The oldest segment was discarded to make room.
+    assert spool.dropped == 1
+    assert [p["event_id"] for p in spool.read_batch(10)] == ["1"]
+    assert sum(f.stat().st_size for f in tmp_path.iterdir()) <= line_bytes * 2
+
+
+def test_drops_batch_larger_than_cap(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=10)
+    assert not spool.write([_payload("1")])
+    assert spool.dropped == 1
+    assert not spool.pending()
+
+
+def test_recovers_segments_from_dead_process(tmp_path):
+    # A segment left open by a process that no longer exists.
+    line = json.dumps(_payload("1")) + "\n"
+    (tmp_path / f"{0:020d}-999999999.open").write_text(line)
+
+    spool = Spool(str(tmp_path))
+    assert spool.pending()
+    assert [p["event_id"] for p in spool.read_batch(10)] == ["1"]
+
+
+def test_other_processes_segments_arent_pending(tmp_path):
+    # Segments owned by a process that's still alive can't be replayed here.
+    other = os.getppid()
+    line = json.dumps(_payload("1")) + "\n"
+    (tmp_path / f"{0:020d}-{other}.open").write_text(line)
+    (tmp_path / f"{1:020d}-{other}.{other}.replay").write_text(line)
+
+    spool = Spool(str(tmp_path))
+    assert not spool.pending()
+    assert spool.read_batch(10) == []
+    # They still count towards the cap.
+    assert spool._bytes == len(line) * 2
+
+
+def test_pending_after_another_process_claims(tmp_path):
+    line = json.dumps(_payload("1")) + "\n"
+    sealed = tmp_path / f"{0:020d}-1.ndjson"
+    sealed.write_text(line)
+    spool = Spool(str(tmp_path))
+    assert spool.pending()
+
+    other = os.getppid()
+    sealed.rename(tmp_path / f"{0:020d}-1.{other}.replay")
+    assert spool.read_batch(10) == []
+    assert not spool.pending()
+
+
+def test_close_seals_open_segment(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.write([_payload("1")])
+    spool.close()
+    assert len(glob.glob(str(tmp_path / "*.ndjson"))) == 1
+
+
+@pytest.fixture
+def ingest_client(ingest_server):
+    host, port = ingest_server.server_address
+    return api.IngestClient(base_url=f"http://{host}:{port}/api/v1/events")
+
+
+def test_processor_spools_during_outage_and_replays(
+    tmp_path, ingest_server, ingest_client, make_event
+):
+    spool = Spool(str(tmp_path))
+    processor = EventProcessor(EventQueue(), ingest_client, spool)
+
+    ingest_server.down = True
+    processor.send([make_event("1")])
+    processor.send([make_event("2"), make_event("3")])
+    assert ingest_server.received == []
+    assert spool.pending()
+
+    ingest_server.down = False
+    processor.send([make_event("4")])
+    assert [e["event_id"] for e in ingest_server.received] == ["4", "1", "2", "3"]
+    assert not spool.pending()
+
+
+def test_processor_replays_when_idle(tmp_path, ingest_server, ingest_client):
+    config.Config.flush_interval_ms = 10
+    spool = Spool(str(tmp_path))
+    spool.write([_payload("1")])
+    processor = EventProcessor(EventQueue(), ingest_client, spool)
+
+    # Nothing is queued, so the worker stops waiting and replays the spool.
+    batch = processor.next_batch()
+    assert batch == []
+    processor.send(batch)
+    assert [e["event_id"] for e in ingest_server.received] == ["1"]
+    assert not spool.pending()
+
+
+def test_processor_spools_above_high_water(tmp_path, mocker, make_event):
+    config.Config.spool_high_water = 1
+    api_client = mocker.Mock()
+    spool = Spool(str(tmp_path))
+    q = EventQueue()
+    q.put(make_event("2"))
+    q.put(make_event("3"))
+
+    processor = EventProcessor(q, api_client, spool)
+    processor.send([make_event("1")])
+    api_client.send_event.assert_not_called()
+    assert [p["event_id"] for p in spool.read_batch(10)] == ["1"]
+
+
+def test_processors_replay_one_at_a_time(tmp_path, mocker):
+    spool = Spool(str(tmp_path))
+    spool.write([_payload("0"), _payload("1"), _payload("2")])
+    q = EventQueue()
+    exported = []
+    other = EventProcessor(q, mocker.Mock(), spool, exporter=mocker.Mock())
+
+    def export_serialized(payloads):
+        # A second worker goes idle while the first is still sending.
+        other.replay()
+        exported.extend(p["event_id"] for p in payloads)
+        return True
+
+    exporter = mocker.Mock(export_serialized=export_serialized)
+    EventProcessor(q, mocker.Mock(), spool, exporter=exporter).replay()
+    other.exporter.export_serialized.assert_not_called()
+    assert exported == ["0", "1", "2"]
+    assert not spool.pending()
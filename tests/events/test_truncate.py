@@ -0,0 +1,78 @@
+import copy
+
+from rosnik import config
+from rosnik.events import truncate
+from rosnik.events.queue import enqueue_event
+from rosnik.types.ai import AIFunctionMetadata, AIRequestStart
+from rosnik.types.core import Metadata
+
+
+def _messages(*contents):
+    return {"model": "gpt-4", "messages": [{"role": "user", "content": c} for c in contents]}
+
+
+def test_truncate_payload__under_limit():
+    payload = _messages("hello")
+    truncated, was_truncated = truncate.truncate_payload(payload, 1000)
+    assert truncated is payload
+    assert not was_truncated
+
+
+def test_truncate_payload__disabled():
+    payload = _messages("a" * 10_000)
+    assert truncate.truncate_payload(payload, 0) == (payload, False)
+
+
+def test_truncate_payload__keeps_head_and_tail():
+    payload = _messages("short", "a" * 500 + "b" * 500)
+    original = copy.deepcopy(payload)
+    truncated, was_truncated = truncate.truncate_payload(payload, 500)
+
+    assert was_truncated
+    assert truncate.approximate_size(truncated) <= 500
+    assert truncated["messages"][0]["content"] == "short"
+    content = truncated["messages"][1]["content"]
+    assert content.startswith("aaa")
+    assert content.endswith("bbb")
+    assert "chars truncated]" in content
+    # The caller's payload is untouched, and unchanged parts are shared.
+    assert payload == original
+    assert truncated["messages"][0] is payload["messages"][0]
+
+
+def test_truncate_payload__is_deterministic():
+    payload = _messages(*("x" * n for n in range(100, 1000, 100)))
+    first, _ = truncate.truncate_payload(payload, 1500)
+    second, _ = truncate.truncate_payload(payload, 1500)
+    assert first == second
+
+
+def test_truncate_payload__caps_long_lists():
+    payload = _messages(*(f"message {i}" for i in range(1000)))
+    truncated, was_truncated = truncate.truncate_payload(payload, 2000)
+    assert was_truncated
+    assert truncate.approximate_size(truncated) <= 2000
+    messages = truncated["messages"]
+    assert messages[0]["content"] == "message 0"
+    assert messages[-1]["content"] == "message 999"
+    assert len(payload["messages"]) == 1000
+
+
+def test_enqueue_event__truncates_payloads(event_queue):
+    config.Config.max_request_payload_bytes = 200
+    payload = _messages("a" * 1000)
+    event = AIRequestStart(
+        ai_model="gpt-4",
+        ai_provider="openai",
+        ai_action="chat.completions",
+        ai_metadata=AIFunctionMetadata(ai_provider="openai", ai_action="chat.completions"),
+        request_payload=payload,
+        _metadata=Metadata(function_fingerprint=""),
+    )
+    enqueue_event(event)
+
+    queued = event_queue.get(block=False)
+    assert truncate.approximate_size(queued.request_payload) <= 200
+    assert queued.request_payload is not payload
+    assert queued._metadata.truncated_fields == ["request_payload"]
+    assert len(payload["messages"][0]["content"]) == 1000
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+import ulid
+
+from rosnik import headers, state
+from rosnik.frameworks.asgi import RosnikMiddleware
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    yield
+    state._reset()
+
+
+@pytest.fixture
+def app():
+    seen = {}
+
+    async def asgi_app(scope, receive, send):
+        seen["journey_id"] = state.get_journey_id()
+        seen["user_interaction_id"] = state.get_user_interaction_id()
+        seen["device_id"] = state.get_device_id()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    asgi_app.seen = seen
+    return asgi_app
+
+
+def _call(middleware, request_headers):
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": request_headers}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def _run():
+        await middleware(scope, receive, send)
+
+    # Each request gets its own context, as it would under an ASGI server.
+    asyncio.run(_run())
+    return messages
+
+
+def _journey_header(messages):
+    response_headers = dict(messages[0]["headers"])
+    return response_headers[headers.JOURNEY_ID_KEY.lower().encode()].decode()
+
+
+def test_middleware_headers(app):
+    middleware = RosnikMiddleware(app)
+    messages = _call(
+        middleware,
+        [
+            (b"x-rosnik-journey-id", b"test-journey"),
+            (b"x-rosnik-interaction-id", b"test-interaction"),
+            (b"x-rosnik-device-id", b"test-device"),
+        ],
+    )
+
+    assert app.seen == {
+        "journey_id": "test-journey",
+        "user_interaction_id": "test-interaction",
+        "device_id": "test-device",
+    }
+    assert _journey_header(messages) == "test-journey"
+    # Existing response headers are preserved.
+    assert (b"content-type", b"text/plain") in messages[0]["headers"]
+    assert messages[1] == {"type": "http.response.body", "body": b"ok"}
+
+
+def test_no_headers(app):
+    middleware = RosnikMiddleware(app)
+    messages = _call(middleware, [])
+
+    assert isinstance(ulid.parse(app.seen["journey_id"]), ulid.ULID)
+    assert app.seen["user_interaction_id"] is None
+    assert app.seen["device_id"] is None
+    assert _journey_header(messages) == app.seen["journey_id"]
+
+
+def test_distinct_journeys_per_request(app):
+    middleware = RosnikMiddleware(app)
+    first = _journey_header(_call(middleware, []))
+    second = _journey_header(_call(middleware, []))
+    assert first != second
+
+
+def test_non_http_scope_passthrough():
+    calls = []
+
+    async def asgi_app(scope, receive, send):
+        calls.append(scope["type"])
+
+    middleware = RosnikMiddleware(asgi_app)
+    asyncio.run(middleware({"type": "lifespan"}, None, None))
+    assert calls == ["lifespan"]
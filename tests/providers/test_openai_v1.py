@@ -1,7 +1,15 @@
+import asyncio
+import gc
 import json
 import os
+import threading
+import time
+from types import SimpleNamespace
+
 import pytest
-from rosnik import constants
+from rosnik import config, constants, state
+from rosnik.events.queue import Deferred
+from rosnik.providers.tokens import Tokenizer
 
 from rosnik.providers import openai_v1 as openai_
 from rosnik.types.ai import (
@@ -51,6 +59,19 @@ def azure_openai_chat_completions_class(azure_openai_client):
     cls.create = original_create
 
 
+@pytest.fixture
+def async_openai_client(openai):
+    return openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY", "test-key"))
+
+
+@pytest.fixture
+def async_openai_chat_completions_class(async_openai_client):
+    cls = async_openai_client.chat.completions.__class__
+    original_create = cls.create
+    yield cls
+    cls.create = original_create
+
+
 @pytest.mark.vcr
 def test_completion(
     openai_client,
@@ -111,6 +132,342 @@ def test_chat_completion(openai_client, openai_chat_completions_class, event_que
     assert json.dumps(request_finish.to_dict())
 
 
+@pytest.mark.vcr
+@pytest.mark.default_cassette("test_chat_completion.yaml")
+def test_chat_completion__async(
+    async_openai_client, async_openai_chat_completions_class, event_queue
+):
+    openai_._patch_chat_completion(async_openai_chat_completions_class, is_async=True)
+    assert event_queue.qsize() == 0
+
+    async def _create():
+        return await async_openai_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": "What is a dog?"},
+            ],
+        )
+
+    response = asyncio.run(_create())
+    assert response.model == "gpt-3.5-turbo-0613"
+    assert event_queue.qsize() == 2
+    request_start: AIRequestStart = event_queue.get()
+    assert request_start.ai_model == "gpt-3.5-turbo"
+    assert request_start.ai_action == "chat.completions"
+    # The `Async` prefix is stripped from the client class name.
+    assert request_start.ai_metadata.openai_attributes.api_type == "openai"
+
+    request_finish: AIRequestFinish = event_queue.get()
+    assert request_finish.ai_model == "gpt-3.5-turbo-0613"
+    assert request_finish.ai_request_start_event_id == request_start.event_id
+    assert request_finish.response_payload["model"] == "gpt-3.5-turbo-0613"
+
+
+def _chunk(content=None, finish_reason=None):
+    return SimpleNamespace(
+        id="chunk-id",
+        object="chat.completion.chunk",
+        created=123,
+        model="gpt-3.5-turbo-0613",
+        choices=[
+            SimpleNamespace(
+                index=0, delta=SimpleNamespace(content=content), finish_reason=finish_reason
+            )
+        ],
+    )
+
+
+def test_streamed_response_hook__async(mocker, openai_client, event_queue):
+    prior_event = openai_.request_hook(
+        {"model": "gpt-3.5-turbo", "stream": True},
+        "test_function_fingerprint",
+        generate_metadata=lambda: AIFunctionMetadata(
+            ai_provider=openai_._OAI, ai_action="chat.completions"
+        ),
+        instance=mocker.Mock(_client=openai_client),
+    )
+    event_queue.get()
+
+    async def _stream():
+        for chunk in [_chunk("Hello"), _chunk(" world"), _chunk(finish_reason="stop")]:
+            yield chunk
+
+    wrapped = openai_.streamed_response_hook(
+        _stream(),
+        "test_function_fingerprint",
+        prior_event=prior_event,
+        generate_metadata=lambda: AIFunctionMetadata(
+            ai_provider=openai_._OAI, ai_action="chat.completions"
+        ),
+        instance=mocker.Mock(_client=openai_client),
+        started_ns=time.perf_counter_ns(),
+    )
+
+    async def _consume():
+        return [chunk async for chunk in wrapped]
+
+    assert len(asyncio.run(_consume())) == 3
+    request_finish: AIRequestFinish = event_queue.get()
+    assert request_finish.ai_request_start_event_id == prior_event.event_id
+    assert request_finish._metadata.stream is True
+    message = request_finish.response_payload["choices"][0]["message"]
+    assert message["content"] == "Hello world"
+    assert request_finish.stream_metrics.chunks == 3
+    assert request_finish.stream_metrics.tokens == 2
+    assert request_finish.stream_metrics.time_to_first_token_ns > 0
+
+
+def _streamed(mocker, openai_client, event_queue, chunks):
+    """Wrap `chunks` as the stream of a request whose start event has been consumed."""
+    prior_event = openai_.request_hook(
+        {"model": "gpt-3.5-turbo", "stream": True},
+        "test_function_fingerprint",
+        generate_metadata=lambda: AIFunctionMetadata(
+            ai_provider=openai_._OAI, ai_action="chat.completions"
+        ),
+        instance=mocker.Mock(_client=openai_client),
+    )
+    event_queue.get()
+    return openai_.streamed_response_hook(
+        chunks,
+        "test_function_fingerprint",
+        prior_event=prior_event,
+        generate_metadata=lambda: AIFunctionMetadata(
+            ai_provider=openai_._OAI, ai_action="chat.completions"
+        ),
+        instance=mocker.Mock(_client=openai_client),
+    )
+
+
+def test_streamed_response_hook__aborted(mocker, openai_client, event_queue):
+    wrapped = _streamed(
+        mocker,
+        openai_client,
+        event_queue,
+        iter([_chunk("Hello"), _chunk(" world"), _chunk(finish_reason="stop")]),
+    )
+    for chunk in wrapped:
+        break
+    assert event_queue.qsize() == 0
+    wrapped.close()
+
+    request_finish: AIRequestFinish = event_queue.get()
+    assert request_finish.stream_end_reason == "aborted"
+    assert request_finish.error_data is None
+    choice = request_finish.response_payload["choices"][0]
+    assert choice["message"]["content"] == "Hello"
+    assert choice["finish_reason"] is None
+    assert request_finish.stream_metrics.chunks == 1
+
+
+def test_streamed_response_hook__garbage_collected(mocker, openai_client, event_queue):
+    wrapped = _streamed(
+        mocker, openai_client, event_queue, iter([_chunk("Hello"), _chunk(" world")])
+    )
+    next(wrapped)
+    del wrapped
+    gc.collect()
+
+    assert event_queue.get().stream_end_reason == "aborted"
+
+
+def test_streamed_response_hook__error(mocker, openai_client, event_queue):
+    def _stream():
+        yield _chunk("Hello")
+        raise ConnectionError("connection reset")
+
+    wrapped = _streamed(mocker, openai_client, event_queue, _stream())
+    with pytest.raises(ConnectionError):
+        list(wrapped)
+
+    request_finish: AIRequestFinish = event_queue.get()
+    assert request_finish.stream_end_reason == "error"
+    assert request_finish.error_data.message == "connection reset"
+    assert request_finish.response_payload["choices"][0]["message"]["content"] == "Hello"
+
+
+def test_streamed_response_hook__closed_elsewhere(mocker, openai_client, event_queue):
+    state.store_request("journey-A", "interaction-A", "device-A")
+    wrapped = _streamed(
+        mocker, openai_client, event_queue, iter([_chunk("Hello"), _chunk(" world")])
+    )
+    next(wrapped)
+    state._reset()
+
+    # Closed from a thread that knows nothing of the request.
+    thread = threading.Thread(target=wrapped.close)
+    thread.start()
+    thread.join()
+
+    request_finish: AIRequestFinish = event_queue.get()
+    assert request_finish.stream_end_reason == "aborted"
+    assert request_finish.journey_id == "journey-A"
+    assert request_finish.user_interaction_id == "interaction-A"
+    assert request_finish.device_id == "device-A"
+
+
+def test_streamed_response_hook__defer_events(mocker, openai_client, event_queue):
+    config.Config.defer_events = True
+    state.store_request("journey-A", "interaction-A", "device-A")
+    wrapped = _streamed(
+        mocker,
+        openai_client,
+        event_queue,
+        iter([_chunk("Hello"), _chunk(" world"), _chunk(finish_reason="stop")]),
+    )
+    # The start event hasn't been built by a worker yet.
+    assert len(list(wrapped)) == 3
+    state._reset()
+
+    assert event_queue.qsize() == 1
+    deferred = event_queue.get()
+    assert isinstance(deferred, Deferred)
+    request_finish: AIRequestFinish = deferred.resolve()
+    assert request_finish.response_payload["choices"][0]["message"]["content"] == "Hello world"
+    assert request_finish.journey_id == "journey-A"
+    assert request_finish.user_interaction_id == "interaction-A"
+    assert request_finish.device_id == "device-A"
+
+
+def test_streamed_response_hook__incomplete(mocker, openai_client, event_queue):
+    wrapped = _streamed(mocker, openai_client, event_queue, iter([_chunk("Hello")]))
+    assert len(list(wrapped)) == 1
+    assert event_queue.get().stream_end_reason == "incomplete"
+
+
+def test_streamed_response_hook__usage_without_content(mocker, openai_client, event_queue):
+    usage = SimpleNamespace(prompt_tokens=1, completion_tokens=4, total_tokens=5)
+    chunks = [
+        _chunk(finish_reason="length"),
+        SimpleNamespace(id="chunk-id", choices=[], usage=usage),
+    ]
+    prior_event = openai_.request_hook(
+        {"model": "gpt-3.5-turbo", "stream": True, "stream_options": {"include_usage": True}},
+        "test_function_fingerprint",
+        generate_metadata=lambda: AIFunctionMetadata(
+            ai_provider=openai_._OAI, ai_action="chat.completions"
+        ),
+        instance=mocker.Mock(_client=openai_client),
+    )
+    event_queue.get()
+    wrapped = openai_.streamed_response_hook(
+        iter(chunks),
+        "test_function_fingerprint",
+        prior_event=prior_event,
+        generate_metadata=lambda: AIFunctionMetadata(
+            ai_provider=openai_._OAI, ai_action="chat.completions"
+        ),
+        instance=mocker.Mock(_client=openai_client),
+        started_ns=time.perf_counter_ns(),
+    )
+    assert len(list(wrapped)) == 2
+
+    request_finish: AIRequestFinish = event_queue.get()
+    assert request_finish.stream_metrics.tokens == 4
+    assert request_finish.stream_metrics.tokens_per_second is None
+
+
+def test_streamed_response_hook__finish_failure(mocker, openai_client, event_queue):
+    mocker.patch(
+        "rosnik.providers.stream.StreamAccumulator.metrics", side_effect=RuntimeError("oh no")
+    )
+    wrapped = _streamed(
+        mocker, openai_client, event_queue, iter([_chunk("Hello"), _chunk(finish_reason="stop")])
+    )
+    # The caller still gets every chunk.
+    assert len(list(wrapped)) == 2
+    assert event_queue.qsize() == 0
+
+
+def test_streamed_response_hook__completed(mocker, openai_client, event_queue):
+    wrapped = _streamed(
+        mocker, openai_client, event_queue, iter([_chunk("Hello"), _chunk(finish_reason="stop")])
+    )
+    for chunk in wrapped:
+        pass
+    wrapped.close()
+
+    # Only the one finish event, as the stream completed.
+    assert event_queue.qsize() == 1
+    assert event_queue.get().stream_end_reason is None
+
+
+def test_streamed_response_hook__counts_tokens(mocker, openai_client, event_queue):
+    class _WordTokenizer(Tokenizer):
+        def count(self, text, model):
+            return len(text.split())
+
+    config.Config.tokenizer = _WordTokenizer()
+    wrapped = _streamed(
+        mocker,
+        openai_client,
+        event_queue,
+        iter([_chunk("Hello world"), _chunk(finish_reason="stop")]),
+    )
+    assert len(list(wrapped)) == 2
+
+    deferred = event_queue.get()
+    # Counted by the worker, not while streaming.
+    assert isinstance(deferred, Deferred)
+    assert "usage" not in deferred.response_payload
+    request_finish: AIRequestFinish = deferred.resolve()
+    assert request_finish.response_payload["usage"]["completion_tokens"] == 2
+    assert request_finish._metadata.counted_usage is True
+
+
+def test_streamed_response_hook__counts_untruncated_tokens(mocker, openai_client, event_queue):
+    class _WordTokenizer(Tokenizer):
+        def count(self, text, model):
+            return len(text.split())
+
+    config.Config.tokenizer = _WordTokenizer()
+    config.Config.max_response_payload_bytes = 200
+    content = " ".join(["word"] * 500)
+    wrapped = _streamed(
+        mocker, openai_client, event_queue, iter([_chunk(content), _chunk(finish_reason="stop")])
+    )
+    list(wrapped)
+
+    request_finish: AIRequestFinish = event_queue.get().resolve()
+    assert request_finish._metadata.truncated_fields == ["response_payload"]
+    assert request_finish.response_payload["usage"]["completion_tokens"] == 500
+
+
+def test_hooks__defer_events(mocker, openai_client, event_queue):
+    config.Config.defer_events = True
+    generate_metadata = lambda: AIFunctionMetadata(  # noqa: E731
+        ai_provider=openai_._OAI, ai_action="chat.completions"
+    )
+    instance = mocker.Mock(_client=openai_client)
+    request_start = openai_.request_hook(
+        {"model": "gpt-3.5-turbo"},
+        "test_function_fingerprint",
+        generate_metadata=generate_metadata,
+        instance=instance,
+    )
+    response = mocker.Mock(model="gpt-3.5-turbo-0613")
+    response.model_dump.return_value = {"id": "chatcmpl-123"}
+    openai_.response_hook(
+        response,
+        "test_function_fingerprint",
+        prior_event=request_start,
+        generate_metadata=generate_metadata,
+        instance=instance,
+    )
+
+    deferred_start, deferred_finish = event_queue.get(), event_queue.get()
+    assert isinstance(deferred_start, Deferred)
+    response.model_dump.assert_not_called()
+
+    request_finish = deferred_finish.resolve()
+    assert deferred_start.resolve().event_id == request_start.event_id
+    assert request_finish.ai_request_start_event_id == request_start.event_id
+    assert request_finish.ai_model == "gpt-3.5-turbo-0613"
+    assert request_finish.response_payload == {"id": "chatcmpl-123"}
+    assert json.dumps(request_finish.to_dict())
+
+
 @pytest.mark.vcr
 def test_chat_completion__with_user(openai_client, openai_chat_completions_class, event_queue):
     system_prompt = "You are a helpful assistant."
@@ -194,6 +551,10 @@ def test_chat_completion__streaming(openai_client, openai_chat_completions_class
     assert request_finish._metadata.stream is True
     streamed_completion = request_finish.response_payload["choices"][0]["message"]["content"]
     assert streamed_completion == expected_completion
+    metrics = request_finish.stream_metrics
+    assert 0 < metrics.time_to_first_chunk_ns <= metrics.time_to_first_token_ns
+    assert metrics.time_to_first_token_ns <= metrics.duration_ns
+    assert sum(count for _, count in metrics.inter_chunk_histogram) == metrics.chunks - 1
     assert json.dumps(request_finish.to_dict())
 
 
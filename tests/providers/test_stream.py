@@ -0,0 +1,214 @@
+from openai.types import Completion, CompletionChoice
+from openai.types.chat import ChatCompletionChunk
+
+from rosnik.providers.stream import StreamAccumulator
+
+
+def _chat_chunk(*choices, usage=None):
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": "chatcmpl-123",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "gpt-4",
+            "choices": list(choices),
+            "usage": usage,
+        }
+    )
+
+
+def _choice(index=0, finish_reason=None, logprobs=None, **delta):
+    return {"index": index, "delta": delta, "finish_reason": finish_reason, "logprobs": logprobs}
+
+
+def test_chat_content():
+    accumulator = StreamAccumulator()
+    assert not accumulator.add(_chat_chunk(_choice(role="assistant", content="")))
+    assert not accumulator.add(_chat_chunk(_choice(content="Hello")))
+    assert not accumulator.add(_chat_chunk(_choice(content=" world")))
+    assert accumulator.add(_chat_chunk(_choice(finish_reason="stop")))
+
+    assert accumulator.response_payload() == {
+        "choices": [
+            {
+                "finish_reason": "stop",
+                "index": 0,
+                "message": {"content": "Hello world", "role": "assistant"},
+            }
+        ],
+        "model": "gpt-4",
+        "created": 1700000000,
+        "object": "chat.completion.chunk",
+        "id": "chatcmpl-123",
+    }
+
+
+def test_chat_multiple_choices():
+    accumulator = StreamAccumulator.for_request({"n": 2})
+    accumulator.add(_chat_chunk(_choice(0, content="a"), _choice(1, content="b")))
+    assert not accumulator.add(_chat_chunk(_choice(1, finish_reason="stop")))
+    assert accumulator.add(_chat_chunk(_choice(0, content="c", finish_reason="length")))
+
+    choices = accumulator.response_payload()["choices"]
+    assert [c["message"]["content"] for c in choices] == ["ac", "b"]
+    assert [c["finish_reason"] for c in choices] == ["length", "stop"]
+
+
+def test_chat_tool_calls():
+    accumulator = StreamAccumulator()
+    accumulator.add(
+        _chat_chunk(
+            _choice(
+                tool_calls=[
+                    {
+                        "index": 0,
+                        "id": "call_1",
+                        "type": "function",
+                        "function": {"name": "get_weather", "arguments": ""},
+                    }
+                ]
+            )
+        )
+    )
+    accumulator.add(
+        _chat_chunk(_choice(tool_calls=[{"index": 0, "function": {"arguments": '{"city":'}}]))
+    )
+    accumulator.add(
+        _chat_chunk(_choice(tool_calls=[{"index": 0, "function": {"arguments": ' "Paris"}'}}]))
+    )
+    accumulator.add(_chat_chunk(_choice(finish_reason="tool_calls")))
+
+    message = accumulator.response_payload()["choices"][0]["message"]
+    assert message["tool_calls"] == [
+        {
+            "id": "call_1",
+            "type": "function",
+            "function": {"name": "get_weather", "arguments": '{"city": "Paris"}'},
+        }
+    ]
+
+
+def test_chat_function_call():
+    accumulator = StreamAccumulator()
+    accumulator.add(_chat_chunk(_choice(function_call={"name": "lookup", "arguments": "{"})))
+    accumulator.add(_chat_chunk(_choice(function_call={"arguments": "}"})))
+    accumulator.add(_chat_chunk(_choice(finish_reason="function_call")))
+
+    message = accumulator.response_payload()["choices"][0]["message"]
+    assert message["function_call"] == {"name": "lookup", "arguments": "{}"}
+
+
+def test_chat_logprobs():
+    def token(text):
+        return {"token": text, "logprob": -0.1, "bytes": None, "top_logprobs": []}
+
+    accumulator = StreamAccumulator()
+    accumulator.add(_chat_chunk(_choice(content="Hi", logprobs={"content": [token("Hi")]})))
+    accumulator.add(_chat_chunk(_choice(content="!", logprobs={"content": [token("!")]})))
+    accumulator.add(_chat_chunk(_choice(finish_reason="stop")))
+
+    logprobs = accumulator.response_payload()["choices"][0]["logprobs"]
+    assert [t.token for t in logprobs["content"]] == ["Hi", "!"]
+
+
+def test_waits_for_usage_chunk():
+    accumulator = StreamAccumulator.for_request({"stream_options": {"include_usage": True}})
+    assert not accumulator.add(_chat_chunk(_choice(content="Hi", finish_reason="stop")))
+    usage = {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+    assert accumulator.add(_chat_chunk(usage=usage))
+    assert accumulator.response_payload()["usage"]["total_tokens"] == 2
+
+
+def test_completion_text():
+    def chunk(text, finish_reason=None):
+        # Streamed completion chunks have no finish reason until the last one,
+        # which the response model doesn't allow, so skip validation.
+        return Completion.model_construct(
+            id="cmpl-123",
+            object="text_completion",
+            created=1700000000,
+            model="gpt-3.5-turbo-instruct",
+            choices=[
+                CompletionChoice.model_construct(
+                    index=0, text=text, finish_reason=finish_reason, logprobs=None
+                )
+            ],
+        )
+
+    accumulator = StreamAccumulator()
+    accumulator.add(chunk("Once"))
+    assert accumulator.add(chunk(" upon", finish_reason="length"))
+    assert accumulator.response_payload()["choices"] == [
+        {"finish_reason": "length", "index": 0, "text": "Once upon"}
+    ]
+
+
+def test_metrics():
+    accumulator = StreamAccumulator(started_ns=0)
+    accumulator.add(_chat_chunk(_choice(role="assistant", content="")), now_ns=100_000_000)
+    accumulator.add(_chat_chunk(_choice(content="Hello")), now_ns=150_000_000)
+    accumulator.add(_chat_chunk(_choice(content=" world")), now_ns=150_500_000)
+    accumulator.add(_chat_chunk(_choice(content="!")), now_ns=250_000_000)
+    accumulator.add(_chat_chunk(_choice(finish_reason="stop")), now_ns=250_000_500)
+
+    metrics = accumulator.metrics()
+    assert metrics.time_to_first_chunk_ns == 100_000_000
+    assert metrics.time_to_first_token_ns == 150_000_000
+    assert metrics.duration_ns == 250_000_500
+    assert metrics.chunks == 5
+    assert metrics.tokens == 3
+    # Two tokens in the 100ms after the first.
+    assert metrics.tokens_per_second == 20.0
+    # Gaps of 50ms, 500µs, ~100ms and 500ns.
+    assert metrics.inter_chunk_histogram == [[1, 1], [512, 1], [2**16, 1], [2**17, 1]]
+
+
+def test_metrics_prefer_reported_usage():
+    accumulator = StreamAccumulator.for_request({"stream_options": {"include_usage": True}})
+    accumulator.add(_chat_chunk(_choice(content="Hi there")), now_ns=0)
+    accumulator.add(_chat_chunk(_choice(content="!", finish_reason="stop")), now_ns=1_000_000_000)
+    usage = {"prompt_tokens": 1, "completion_tokens": 4, "total_tokens": 5}
+    accumulator.add(_chat_chunk(usage=usage), now_ns=1_000_000_000)
+
+    metrics = accumulator.metrics()
+    assert metrics.tokens == 4
+    assert metrics.tokens_per_second == 3.0
+    # Without the request's start time, only the stream's own duration is known.
+    assert metrics.time_to_first_chunk_ns is None
+    assert metrics.duration_ns == 1_000_000_000
+
+
+def test_metrics_usage_without_content():
+    # Only reasoning tokens, so usage reports tokens that no chunk carried.
+    accumulator = StreamAccumulator.for_request({"stream_options": {"include_usage": True}})
+    accumulator.add(_chat_chunk(_choice(role="assistant", finish_reason="length")), now_ns=0)
+    usage = {"prompt_tokens": 1, "completion_tokens": 4, "total_tokens": 5}
+    assert accumulator.add(_chat_chunk(usage=usage), now_ns=1_000_000)
+
+    metrics = accumulator.metrics()
+    assert metrics.tokens == 4
+    assert metrics.tokens_per_second is None
+    assert metrics.time_to_first_token_ns is None
+
+
+def test_azure_prompt_filter_chunk():
+    # Azure sends prompt filter results first, without an ID or model.
+    accumulator = StreamAccumulator()
+    accumulator.add(
+        ChatCompletionChunk.model_construct(
+            id="",
+            object="",
+            created=0,
+            model="",
+            choices=[],
+            prompt_filter_results=[{"prompt_index": 0, "content_filter_results": {}}],
+        )
+    )
+    accumulator.add(_chat_chunk(_choice(role="assistant", content="Hi", finish_reason="stop")))
+
+    payload = accumulator.response_payload()
+    assert payload["id"] == "chatcmpl-123"
+    assert payload["model"] == "gpt-4"
+    assert payload["created"] == 1700000000
+    assert payload["object"] == "chat.completion.chunk"
+    assert payload["choices"][0]["message"]["content"] == "Hi"
@@ -0,0 +1,134 @@
+from rosnik import config
+from rosnik.providers import tokens
+from rosnik.types.ai import AIFunctionMetadata, AIRequestFinish
+from rosnik.types.core import Metadata
+
+
+class _WordTokenizer(tokens.Tokenizer):
+    """One token per word."""
+
+    def __init__(self):
+        self.counted = []
+
+    def count(self, text, model):
+        self.counted.append(text)
+        return len(text.split())
+
+
+def _finish_event(response_payload):
+    return AIRequestFinish(
+        ai_model="gpt-4",
+        ai_provider="openai",
+        ai_action="chat.completions",
+        ai_metadata=AIFunctionMetadata(ai_provider="openai", ai_action="chat.completions"),
+        response_payload=response_payload,
+        response_ms=10,
+        ai_request_start_event_id="start",
+        _metadata=Metadata(function_fingerprint="", stream=True),
+    )
+
+
+def test_prompt_tokens__chat():
+    tokenizer = _WordTokenizer()
+    request_payload = {
+        "messages": [
+            {"role": "system", "content": "You are helpful."},
+            {"role": "user", "name": "nick", "content": [{"type": "text", "text": "Hi there"}]},
+        ]
+    }
+    # Reply priming, then each message's wrapping, role, content and name.
+    expected = 3 + (3 + 1 + 3) + (3 + 1 + 2 + 1 + 1)
+    assert tokens.prompt_tokens(tokenizer, request_payload, "gpt-4") == expected
+
+
+def test_prompt_tokens__completion():
+    tokenizer = _WordTokenizer()
+    assert tokens.prompt_tokens(tokenizer, {"prompt": "Once upon a time"}, None) == 4
+    assert tokens.prompt_tokens(tokenizer, {"prompt": ["a b", "c"]}, None) == 3
+    assert tokens.prompt_tokens(tokenizer, {"prompt": [1, 2, 3]}, None) == 3
+
+
+def test_prompt_tokens__cached():
+    tokenizer = _WordTokenizer()
+    request_payload = {"messages": [{"role": "system", "content": "A long system prompt"}]}
+    tokens.prompt_tokens(tokenizer, request_payload, "gpt-4")
+    tokens.prompt_tokens(tokenizer, request_payload, "gpt-4")
+    assert tokenizer.counted.count("A long system prompt") == 1
+
+
+def test_prompt_tokens__cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(tokens, "_PROMPT_CACHE_SIZE", 2)
+    monkeypatch.setattr(tokens, "_prompt_counts", tokens.OrderedDict())
+    tokenizer = _WordTokenizer()
+    for text in ("a", "b", "a", "c", "a", "b"):
+        tokens.prompt_tokens(tokenizer, {"prompt": text}, None)
+    # "b" was the least recently used when "c" arrived.
+    assert tokenizer.counted == ["a", "b", "c", "b"]
+    # Only digests are kept, not the prompts themselves.
+    assert all(isinstance(key[2], bytes) for key in tokens._prompt_counts)
+
+
+def test_reinit_after_fork(monkeypatch):
+    monkeypatch.setattr(tokens, "_prompt_counts", tokens.OrderedDict())
+    tokens.prompt_tokens(_WordTokenizer(), {"prompt": "a b"}, None)
+    # As if another thread held the lock when the process forked.
+    tokens._prompt_counts_lock.acquire()
+    tokens._reinit_after_fork()
+
+    assert not tokens._prompt_counts
+    assert tokens.prompt_tokens(_WordTokenizer(), {"prompt": "a b"}, None) == 2
+
+
+def test_add_usage():
+    event = _finish_event(
+        {
+            "model": "gpt-4",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": "Hello world",
+                        "tool_calls": [
+                            {"function": {"name": "lookup", "arguments": '{"q": "dogs"}'}}
+                        ],
+                    },
+                }
+            ],
+        }
+    )
+    request_payload = {"messages": [{"role": "user", "content": "Hi"}]}
+    tokens.add_usage(event, request_payload, _WordTokenizer())
+    assert event.response_payload["usage"] == {
+        "prompt_tokens": 8,
+        "completion_tokens": 5,
+        "total_tokens": 13,
+    }
+    assert event._metadata.counted_usage is True
+
+
+def test_add_usage__counts_full_response():
+    # The event's payload was truncated, so completions are counted from the original.
+    event = _finish_event({"choices": [{"index": 0, "message": {"content": "Hello"}}]})
+    full = {"choices": [{"index": 0, "message": {"content": "Hello there world"}}]}
+    tokens.add_usage(event, {"prompt": "Hi"}, _WordTokenizer(), response_payload=lambda: full)
+    assert event.response_payload["usage"]["completion_tokens"] == 3
+
+
+def test_add_usage__keeps_reported_usage():
+    usage = {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+    event = _finish_event({"choices": [], "usage": usage})
+    tokens.add_usage(event, {"prompt": "a b c"}, _WordTokenizer())
+    assert event.response_payload["usage"] is usage
+    assert event._metadata.counted_usage is False
+
+
+def test_usage_counter(monkeypatch):
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    assert tokens.usage_counter({}) is None
+
+    config.Config.tokenizer = _WordTokenizer()
+    assert tokens.usage_counter({}) is not None
+
+    config.Config.count_tokens = False
+    assert tokens.usage_counter({}) is None
@@ -1,9 +1,20 @@
+import dataclasses
+import gzip
+import json
+
 import pytest
 import requests
 import responses
 from rosnik import config
-from rosnik.api import IngestClient, _base_url, _retry_status_code
-from rosnik.types.core import Event, Metadata
+from rosnik.api import (
+    CircuitBreaker,
+    CircuitState,
+    IngestClient,
+    _base_url,
+    _batch_url,
+    _retry_status_code,
+)
+from rosnik.types.core import Event, Metadata, static_metadata
 
 
 @pytest.fixture
@@ -30,6 +41,35 @@ def test_send_event_successful(mocker, mock_event):
     )
 
 
+def test_send_batch_successful(mocker, mock_event):
+    mock_response = mocker.Mock()
+    mock_response.raise_for_status.return_value = None
+    mocker.patch.object(IngestClient, "_post", return_value=mock_response)
+
+    config.Config.api_key = "fake_key"
+    client = IngestClient()
+    client.send_batch([mock_event, mock_event])
+    payload = mock_event.to_dict()
+    metadata = {key: payload["_metadata"].pop(key) for key in dataclasses.asdict(static_metadata)}
+    IngestClient._post.assert_called_once_with(
+        _batch_url,
+        headers=client.headers,
+        json={"metadata": metadata, "events": [payload, payload]},
+    )
+
+
+def test_send_batch_http_error(mocker, mock_event):
+    mock_logger = mocker.patch("rosnik.api.logger.warning")
+    mock_response = mocker.Mock()
+    mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("An error occurred")
+    mocker.patch.object(IngestClient, "_post", return_value=mock_response)
+
+    config.Config.api_key = "fake_key"
+    client = IngestClient()
+    client.send_batch([mock_event, mock_event])
+    mock_logger.assert_called_once_with("Failed to send batch of 2 events: An error occurred")
+
+
 def test_send_event_http_error(mocker, mock_event):
     mock_logger = mocker.patch("rosnik.api.logger.warning")
     # Mock an HTTPError
@@ -45,6 +85,51 @@ def test_send_event_http_error(mocker, mock_event):
     mock_logger.assert_called_once_with("Failed to send event: An error occurred")
 
 
+def test_post_uncompressed_by_default(mocker, mock_event):
+    client = IngestClient()
+    mock_post = mocker.patch.object(client.session, "post")
+    client.send_event(mock_event)
+    kwargs = mock_post.call_args.kwargs
+    assert json.loads(kwargs["data"]) == mock_event.to_dict()
+    assert "Content-Encoding" not in kwargs["headers"]
+
+
+def test_post_gzip(mocker, mock_event):
+    config.Config.compression = "gzip"
+    config.Config.compression_threshold = 0
+    client = IngestClient()
+    mock_post = mocker.patch.object(client.session, "post")
+    client.send_event(mock_event)
+    kwargs = mock_post.call_args.kwargs
+    assert "json" not in kwargs
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert kwargs["headers"]["Content-Type"] == "application/json"
+    assert json.loads(gzip.decompress(kwargs["data"])) == mock_event.to_dict()
+
+
+def test_post_below_compression_threshold(mocker, mock_event):
+    config.Config.compression = "gzip"
+    config.Config.compression_threshold = 1_000_000
+    client = IngestClient()
+    mock_post = mocker.patch.object(client.session, "post")
+    client.send_event(mock_event)
+    kwargs = mock_post.call_args.kwargs
+    assert "Content-Encoding" not in kwargs["headers"]
+    assert json.loads(kwargs["data"]) == mock_event.to_dict()
+
+
+def test_post_zstd_falls_back_to_gzip(mocker, mock_event):
+    mocker.patch("rosnik.api.zstandard", None)
+    config.Config.compression = "zstd"
+    config.Config.compression_threshold = 0
+    client = IngestClient()
+    mock_post = mocker.patch.object(client.session, "post")
+    client.send_event(mock_event)
+    kwargs = mock_post.call_args.kwargs
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(kwargs["data"])) == mock_event.to_dict()
+
+
 @pytest.mark.parametrize("status_code", _retry_status_code)
 @responses.activate
 def test_retry_adapter(mocker, status_code):
@@ -79,3 +164,87 @@ def test_retry_adapter(mocker, status_code):
     assert mock_logger.call_count == 1
     assert "Failed to send event after 3 attempts:" in mock_logger.call_args_list[0][0][0]
     assert retry_count["count"] == 4
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker__opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=_Clock())
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+    assert breaker.rejected == 1
+
+
+def test_circuit_breaker__half_open_probe():
+    clock = _Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.state == CircuitState.HALF_OPEN
+    # Only one probe at a time.
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    # A failed probe opens the circuit again.
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    clock.now = 20
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_request()
+
+
+def test_circuit_breaker__disabled():
+    breaker = CircuitBreaker(failure_threshold=0, clock=_Clock())
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow_request()
+
+
+def test_circuit_breaker__defaults_from_config():
+    config.Config.circuit_failure_threshold = 3
+    config.Config.circuit_reset_timeout_ms = 500
+    breaker = CircuitBreaker()
+    assert breaker.failure_threshold == 3
+    assert breaker.reset_timeout == 0.5
+
+
+def test_send_event__short_circuits_while_open(mocker, mock_event):
+    mock_response = mocker.Mock()
+    mock_response.raise_for_status.side_effect = requests.exceptions.ConnectionError("down")
+    mocker.patch.object(IngestClient, "_post", return_value=mock_response)
+
+    client = IngestClient(circuit_breaker=CircuitBreaker(failure_threshold=2, clock=_Clock()))
+    assert not client.send_event(mock_event)
+    assert not client.send_event(mock_event)
+    assert not client.send_event(mock_event)
+    assert not client.send_batch([mock_event, mock_event])
+    assert IngestClient._post.call_count == 2
+    assert client.circuit_breaker.rejected == 2
+
+
+def test_send_event__client_errors_keep_circuit_closed(mocker, mock_event):
+    response = requests.Response()
+    response.status_code = 401
+    mock_response = mocker.Mock()
+    mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+        "Unauthorized", response=response
+    )
+    mocker.patch.object(IngestClient, "_post", return_value=mock_response)
+
+    client = IngestClient(circuit_breaker=CircuitBreaker(failure_threshold=1, clock=_Clock()))
+    assert not client.send_event(mock_event)
+    assert client.circuit_breaker.state == CircuitState.CLOSED
@@ -70,3 +70,24 @@ def test_client_init__with_params():
     assert rosnik.config.Config.sync_mode is True
     assert rosnik.config.Config.environment == "development"
     assert rosnik.config.Config.event_context_hook is _custom_hook
+
+
+def test_init__shutdown_on_exit(mocker):
+    mock_register = mocker.patch("rosnik.client.atexit.register")
+    rosnik.init(shutdown_on_exit=True)
+    mock_register.assert_called_once_with(rosnik.client._shutdown_at_exit)
+
+
+def test_init__no_shutdown_on_exit_by_default(mocker):
+    mock_register = mocker.patch("rosnik.client.atexit.register")
+    rosnik.init()
+    mock_register.assert_not_called()
+
+
+def test_flush_and_shutdown(mocker):
+    mock_flush = mocker.patch("rosnik.events.queue.flush", return_value=True)
+    mock_shutdown = mocker.patch("rosnik.events.queue.shutdown", return_value=True)
+    assert rosnik.flush(timeout=1)
+    assert rosnik.shutdown(timeout=2)
+    mock_flush.assert_called_once_with(1)
+    mock_shutdown.assert_called_once_with(2)
@@ -254,3 +254,46 @@ def test_no_environment_from_config():
     assert event._metadata.environment == "config_env"
     # Verify context merging without 'environment' key
     assert event.context == {"other": "value_stored"}
+
+
+def test_contexts_are_not_mutated(event_data):
+    stored_context = {"environment": "stored_env", "stored": "value"}
+    global_context = {"environment": "global_env", "other": "value"}
+    event_context = {"environment": "event_env", "specific": "data"}
+    state.store(state.State.CONTEXT_ID, stored_context)
+    config.Config.event_context_hook = lambda: global_context
+
+    for _ in range(2):
+        event = core.Event(**{**event_data, "context": event_context})
+        assert event._metadata.environment == "event_env"
+        assert event.context == {"stored": "value", "other": "value", "specific": "data"}
+
+    assert global_context == {"environment": "global_env", "other": "value"}
+    assert stored_context == {"environment": "stored_env", "stored": "value"}
+    assert event_context == {"environment": "event_env", "specific": "data"}
+
+
+def test_single_context_is_shared(event_data):
+    global_context = {"other": "value"}
+    config.Config.event_context_hook = lambda: global_context
+
+    event = core.Event(**event_data)
+    assert event.context is global_context
+
+
+def test_ids_from_state_snapshot(event_data, mocker):
+    state.store_request("journey", "interaction", "device")
+    snapshot = mocker.spy(state, "snapshot")
+    event = core.Event(**event_data)
+    assert snapshot.call_count == 1
+    assert (event.journey_id, event.user_interaction_id, event.device_id) == (
+        "journey",
+        "interaction",
+        "device",
+    )
+
+
+def test_explicit_ids_override_state(event_data):
+    state.store_request("journey", "interaction", "device")
+    event = core.Event(journey_id="other", user_interaction_id=None, device_id=None, **event_data)
+    assert (event.journey_id, event.user_interaction_id, event.device_id) == ("other", None, None)
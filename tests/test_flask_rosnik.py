@@ -5,6 +5,7 @@ import ulid
 from rosnik import config
 from rosnik import flask_rosnik, headers, state
 from rosnik.types.ai import AIRequestFinish, AIRequestStart
+from rosnik.types.core import Event, Metadata
 
 
 # Initialize your extension
@@ -198,3 +199,31 @@ def test_flask_with_context(app_with_event_context_hook, event_queue):
         assert finish_event.context == {"host": "localhost"}
 
         assert event_queue.qsize() == 0
+
+
+def test_flask_caches_context_per_request():
+    config.Config.event_context_cache = "request"
+    hosts = []
+
+    def _request_context():
+        hosts.append(request.headers.get("host"))
+        return {"host": hosts[-1]}
+
+    app = Flask(__name__)
+
+    @app.get("/")
+    def index():
+        events = [
+            Event(event_type="test.event", _metadata=Metadata(function_fingerprint=""))
+            for _ in range(3)
+        ]
+        return jsonify([event.context for event in events])
+
+    flask_rosnik.FlaskRosnik(app, event_context_hook=_request_context)
+    with app.test_client() as client:
+        # The same journey, but each request gets its own context.
+        for host in ("a.example.com", "b.example.com"):
+            res = client.get("/", headers={headers.JOURNEY_ID_KEY: "journey", "Host": host})
+            assert res.json == [{"host": host}] * 3
+    assert hosts == ["a.example.com", "b.example.com"]
+    state._reset()
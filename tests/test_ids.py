@@ -0,0 +1,60 @@
+import os
+
+import pytest
+import ulid
+
+from rosnik import ids
+
+
+@pytest.fixture(autouse=True)
+def fresh_generator():
+    ids._reinit_after_fork()
+
+
+def test_new_is_a_valid_ulid(mocker):
+    mocker.patch("rosnik.ids.time.time_ns", return_value=1_700_000_000_123_456_789)
+    value = ids.new()
+    assert len(value) == 26
+    parsed = ulid.parse(value)
+    assert parsed.timestamp().int == 1_700_000_000_123
+    assert parsed.str == value
+
+
+def test_new_is_monotonic_within_a_millisecond(mocker):
+    mocker.patch("rosnik.ids.time.time_ns", return_value=1_700_000_000_000_000_000)
+    values = [ids.new() for _ in range(1000)]
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+    assert ulid.parse(values[-1]).randomness().int - ulid.parse(values[0]).randomness().int == 999
+
+
+def test_new_is_monotonic_when_clock_goes_backwards(mocker):
+    time_ns = mocker.patch("rosnik.ids.time.time_ns", return_value=1_700_000_000_000_000_000)
+    first = ids.new()
+    time_ns.return_value -= 5_000_000
+    assert ids.new() > first
+
+
+def test_new_borrows_next_millisecond_on_overflow(mocker):
+    mocker.patch("rosnik.ids.time.time_ns", return_value=1_700_000_000_000_000_000)
+    ids.new()
+    ids._last_random = ids._RANDOM_LIMIT - 1
+    value = ids.new()
+    assert ulid.parse(value).timestamp().int == 1_700_000_000_001
+
+
+def test_child_gets_fresh_random_bits_after_fork():
+    parent = ids.new()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, ids.new().encode())
+        os._exit(0)
+    os.close(write)
+    child = os.read(read, 26).decode()
+    os.close(read)
+    os.waitpid(pid, 0)
+    # Not just the parent's next ID.
+    assert child[10:] != ids.new()[10:]
+    assert child != parent
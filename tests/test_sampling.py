@@ -0,0 +1,61 @@
+import pytest
+
+from rosnik import config, sampling, state
+
+
+@pytest.fixture(autouse=True)
+def journey():
+    state.store(state.State.JOURNEY_ID, "journey_123")
+    yield
+    state._reset()
+
+
+def test_sample_rate__defaults_to_everything():
+    assert sampling.sample_rate("gpt-4", "chat.completions") == 1
+    assert sampling.should_sample("gpt-4", "chat.completions")
+
+
+def test_sample_rate__rules_by_specificity():
+    config.Config.environment = "production"
+    config.Config.sample_rate = 0.5
+    config.Config.sample_rules = {
+        "model": {"gpt-4": 0.1},
+        "ai_action": {"completions": 0.2},
+        "environment": {"production": 0.3},
+    }
+    assert sampling.sample_rate("gpt-4", "completions") == 0.1
+    assert sampling.sample_rate("gpt-3.5-turbo", "completions") == 0.2
+    assert sampling.sample_rate("gpt-3.5-turbo", "chat.completions") == 0.3
+
+    config.Config = config._Config(sample_rate=0.5, sample_rules={"model": {"gpt-4": 0.1}})
+    assert sampling.sample_rate("gpt-3.5-turbo", "chat.completions") == 0.5
+
+
+def test_should_sample__rate(mocker):
+    config.Config.sample_rate = 0.25
+    mocker.patch("rosnik.sampling.random.random", return_value=0.2)
+    assert sampling.should_sample()
+    mocker.patch("rosnik.sampling.random.random", return_value=0.3)
+    assert not sampling.should_sample()
+
+
+def test_should_sample__zero():
+    config.Config.sample_rate = 0
+    assert not sampling.should_sample()
+
+
+def test_should_sample__by_journey():
+    config.Config.sample_by_journey = True
+    fraction = sampling._journey_fraction("journey_123")
+    config.Config.sample_rate = fraction + 0.01
+    assert all(sampling.should_sample() for _ in range(10))
+
+    config.Config = config._Config(sample_by_journey=True, sample_rate=fraction)
+    assert not any(sampling.should_sample() for _ in range(10))
+
+
+def test_sampler__reads_model_keys():
+    config.Config.sample_rules = {"model": {"my-deployment": 0}}
+    sample = sampling.sampler("chat.completions", model_keys=("model", "deployment_id"))
+    assert not sample({"deployment_id": "my-deployment"})
+    assert sample({"model": "gpt-4"})
@@ -0,0 +1,129 @@
+import dataclasses
+import json
+
+import pytest
+
+from rosnik import serialize
+from rosnik.types.ai import (
+    AIFunctionMetadata,
+    AIRequestFinish,
+    AIRequestStart,
+    AIRequestStartStream,
+    ErrorResponseData,
+    OpenAIAttributes,
+)
+from rosnik.types.core import Event, Metadata, static_metadata
+from rosnik.types.user import UserFeedbackTrack, UserGoalSuccess, UserInteractionTrack
+
+
+def _ai_metadata():
+    return AIFunctionMetadata(
+        ai_provider="openai",
+        ai_action="chat.completions",
+        openai_attributes=OpenAIAttributes(
+            api_base="https://api.openai.com/v1/", api_type="openai", api_version=None
+        ),
+    )
+
+
+def _events():
+    ai_kwargs = {
+        "ai_model": "gpt-3.5-turbo",
+        "ai_provider": "openai",
+        "ai_action": "chat.completions",
+        "ai_metadata": _ai_metadata(),
+        "_metadata": Metadata(function_fingerprint="a.b.c", stream=True),
+    }
+    return [
+        Event(event_type="test.event", _metadata=Metadata(function_fingerprint="")),
+        AIRequestStart(
+            request_payload={"messages": [{"role": "user", "content": "héllo ☃"}], "n": 1},
+            context={"prompt_name": "test"},
+            **ai_kwargs,
+        ),
+        AIRequestFinish(
+            response_payload={"choices": [{"index": 0, "logprobs": None}], "usage": {"x": 1.5}},
+            ai_request_start_event_id="start-id",
+            response_ms=10,
+            **ai_kwargs,
+        ),
+        AIRequestFinish(
+            ai_request_start_event_id="start-id",
+            response_ms=10,
+            error_data=ErrorResponseData(message="oh no", headers={"x-request-id": "1"}),
+            **ai_kwargs,
+        ),
+        AIRequestStartStream(ai_request_start_event_id="start-id", response_ms=5, **ai_kwargs),
+        UserInteractionTrack(
+            user_id="user",
+            interaction_type="ai-request",
+            _metadata=Metadata(function_fingerprint=""),
+        ),
+        UserFeedbackTrack(
+            user_id="user", score=1, open_response=None, _metadata=Metadata(function_fingerprint="")
+        ),
+        UserGoalSuccess(goal_name="goal", _metadata=Metadata(function_fingerprint="")),
+    ]
+
+
+@pytest.mark.parametrize("event", _events(), ids=lambda e: e.__class__.__name__)
+def test_to_dict_matches_dataclasses_json(event):
+    assert serialize.to_dict(event) == event.to_dict()
+
+
+@pytest.mark.parametrize("event", _events(), ids=lambda e: e.__class__.__name__)
+def test_dumps_matches_standard_library(event):
+    expected = json.dumps(event.to_dict(), separators=(",", ":"), ensure_ascii=False)
+    assert serialize.dumps(serialize.to_dict(event)) == expected.encode("utf-8")
+
+
+@pytest.mark.parametrize("backend", ["dumps", "_json_dumps"])
+def test_dumps_floats(backend):
+    dumps = getattr(serialize, backend)
+    # Including a float inside a dataclass, which is encoded by the `default` hook.
+    metadata = Metadata(function_fingerprint="", stream=float("-inf"))
+    payload = {"small": 1e-7, "values": [float("nan"), float("inf")], "metadata": metadata}
+    assert json.loads(dumps(payload), parse_constant=pytest.fail) == {
+        "small": 1e-7,
+        "values": [None, None],
+        "metadata": {**serialize.to_dict(Metadata(function_fingerprint="")), "stream": None},
+    }
+
+
+def test_dumps_orjson_matches_standard_library():
+    orjson = pytest.importorskip("orjson")
+    payload = {"small": 1e-7, "nan": float("nan"), "text": "héllo ☃", "n": [1, 2.5]}
+    assert orjson.loads(serialize.dumps(payload)) == json.loads(serialize._json_dumps(payload))
+
+
+def test_encoder_is_generated_once():
+    event = _events()[1]
+    serialize.to_dict(event)
+    encoder = serialize.encoder_for(AIRequestStart)
+    serialize.to_dict(event)
+    assert serialize.encoder_for(AIRequestStart) is encoder
+
+
+@pytest.mark.parametrize("event", _events(), ids=lambda e: e.__class__.__name__)
+def test_to_dict_without_static_metadata(event):
+    expected = event.to_dict()
+    for key in ("runtime", "runtime_version", "sdk_version"):
+        del expected["_metadata"][key]
+    assert serialize.to_dict(event, include_static=False) == expected
+
+
+def test_static_metadata_is_shared():
+    metadata = Metadata(function_fingerprint="")
+    assert metadata.runtime == static_metadata.runtime
+    assert metadata.sdk_version == static_metadata.sdk_version
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        static_metadata.sdk_version = "0"
+
+
+def test_dumps_default_hook():
+    payload = {"tags": {"a"}, "metadata": Metadata(function_fingerprint="f"), 1: (1, 2)}
+    assert json.loads(serialize.dumps(payload)) == {
+        "tags": ["a"],
+        "metadata": serialize.to_dict(Metadata(function_fingerprint="f")),
+        "1": [1, 2],
+    }
@@ -1,4 +1,6 @@
-from rosnik import state
+import pytest
+
+from rosnik import config, state
 
 
 def test_store_and_retrieve():
@@ -53,3 +55,94 @@ def test_reset():
     assert state.retrieve(state.State.JOURNEY_ID) is None
     assert state.retrieve(state.State.USER_INTERACTION_ID) is None
     assert state.retrieve(state.State.DEVICE_ID) is None
+
+
+@pytest.fixture
+def counting_hook():
+    calls = []
+
+    def hook():
+        calls.append(1)
+        return {"call": len(calls)}
+
+    config.Config.event_context_hook = hook
+    yield calls
+    state._ttl_hook_context = None
+
+
+def test_get_hook_context__per_event(counting_hook):
+    assert state.get_hook_context() == {"call": 1}
+    assert state.get_hook_context() == {"call": 2}
+
+
+def test_get_hook_context__per_request(counting_hook):
+    config.Config.event_context_cache = "request"
+    state._reset()
+    state.create_journey_id()
+    assert state.get_hook_context() == {"call": 1}
+    assert state.get_hook_context() == {"call": 1}
+
+    # A new journey, or the middleware starting a new request, calls the hook again.
+    state.create_journey_id()
+    assert state.get_hook_context() == {"call": 2}
+    state.store_request(state.get_journey_id(), None, None)
+    assert state.get_hook_context() == {"call": 3}
+    assert len(counting_hook) == 3
+
+
+def test_get_hook_context__ttl(counting_hook, mocker):
+    config.Config.event_context_cache = "ttl"
+    config.Config.event_context_ttl_ms = 1000
+    monotonic = mocker.patch("rosnik.state.time.monotonic", return_value=100.0)
+    assert state.get_hook_context() == {"call": 1}
+    monotonic.return_value = 100.5
+    assert state.get_hook_context() == {"call": 1}
+    monotonic.return_value = 101.0
+    assert state.get_hook_context() == {"call": 2}
+
+
+def test_store_request():
+    state._reset()
+    token = state.store(state.State.CONTEXT_ID, {"tenant": "a"})
+    state.store_request(None, "test_interaction", None)
+    journey_id = state.get_journey_id()
+    assert journey_id is not None
+    assert state.get_user_interaction_id() == "test_interaction"
+    assert state.get_device_id() is None
+    # Context set outside the request is kept.
+    assert state.get_context() == {"tenant": "a"}
+
+    state.store_request("test_journey", None, "test_device")
+    assert state.snapshot() == state.Snapshot(
+        journey_id="test_journey", device_id="test_device", context={"tenant": "a"}
+    )
+    state.reset_context(token)
+
+
+def test_reset_context_only_restores_context():
+    state._reset()
+    outer = state.store(state.State.CONTEXT_ID, {"a": "1"})
+    inner = state.store(state.State.CONTEXT_ID, {"b": "2"})
+    journey_id = state.create_journey_id()
+
+    state.reset_context(inner)
+    assert state.get_context() == {"a": "1"}
+    assert state.get_journey_id() == journey_id
+    state.reset_context(outer)
+    assert state.get_context() == {}
+    assert state.get_journey_id() == journey_id
+
+
+def test_get_hook_context__per_request_store_request(counting_hook):
+    config.Config.event_context_cache = "request"
+    state.store_request("test_journey", None, None)
+    assert state.get_hook_context() == {"call": 1}
+    # Nested context doesn't lose the cached result.
+    with_context = state.store(state.State.CONTEXT_ID, {"a": "1"})
+    assert state.get_hook_context() == {"call": 1}
+    state.reset_context(with_context)
+    assert state.get_hook_context() == {"call": 1}
+
+    # Starting a new request calls the hook again, even for the same journey.
+    state.store_request("test_journey", None, None)
+    assert state.get_hook_context() == {"call": 2}
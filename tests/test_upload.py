@@ -0,0 +1,146 @@
+import json
+import os
+
+import pytest
+
+from rosnik import __main__ as cli
+from rosnik import serialize, upload
+from rosnik.types.ai import AIFunctionMetadata, AIRequestStart
+from rosnik.types.core import Metadata
+
+
+def _payload(event_id):
+    return serialize.to_dict(
+        AIRequestStart(
+            event_id=event_id,
+            journey_id="journey_123",
+            ai_model="gpt-4",
+            ai_provider="openai",
+            ai_action="chat.completions",
+            ai_metadata=AIFunctionMetadata(ai_provider="openai", ai_action="chat.completions"),
+            request_payload={"model": "gpt-4"},
+            _metadata=Metadata(function_fingerprint=""),
+        )
+    )
+
+
+def _write(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+    return str(path)
+
+
+@pytest.fixture
+def url(ingest_server):
+    host, port = ingest_server.server_address
+    return f"http://{host}:{port}/api/v1/events"
+
+
+def test_validate():
+    assert upload.validate(_payload("1")) is None
+    assert upload.validate([]) == "not a JSON object"
+    assert "unknown event_type" in upload.validate({"event_type": "nope"})
+    invalid = _payload("1")
+    del invalid["ai_model"]
+    assert "invalid AIRequestStart" in upload.validate(invalid)
+
+
+def test_find_files(tmp_path):
+    _write(tmp_path / "events.ndjson", [])
+    _write(tmp_path / "events.ndjson.1", [])
+    _write(tmp_path / "segment.open", [])
+    _write(tmp_path / "other.txt", [])
+    found = upload.find_files([str(tmp_path), "explicit.ndjson"])
+    assert sorted(found[:2]) == [
+        str(tmp_path / "events.ndjson"),
+        str(tmp_path / "events.ndjson.1"),
+    ]
+    assert found[2:] == ["explicit.ndjson"]
+
+
+def test_upload(tmp_path, ingest_server, url):
+    lines = [json.dumps(_payload(str(i))) for i in range(10)]
+    lines.insert(3, "not json")
+    lines.insert(5, json.dumps({"event_type": "nope"}))
+    file = _write(tmp_path / "events.ndjson", lines)
+
+    uploader = upload.Uploader(base_url=url, batch_size=3, concurrency=3)
+    result = uploader.upload([file])
+
+    assert result == upload.UploadResult(uploaded=10, invalid=2, failed=False)
+    assert sorted(e["event_id"] for e in ingest_server.received) == [str(i) for i in range(10)]
+    assert uploader.checkpoint.get(upload.file_key(file)) == 12
+
+
+def test_upload__resumes_from_checkpoint(tmp_path, ingest_server, url):
+    file = _write(tmp_path / "events.ndjson", [json.dumps(_payload(str(i))) for i in range(6)])
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    # The endpoint goes down after two batches.
+    ingest_server.budget = 2
+    uploader = upload.Uploader(
+        base_url=url, batch_size=2, concurrency=1, checkpoint=upload.Checkpoint(checkpoint_path)
+    )
+    result = uploader.upload([file])
+    assert result.failed
+    assert upload.Checkpoint(checkpoint_path).get(upload.file_key(file)) == 4
+
+    ingest_server.budget = None
+    ingest_server.down = False
+    uploader = upload.Uploader(
+        base_url=url, batch_size=2, concurrency=1, checkpoint=upload.Checkpoint(checkpoint_path)
+    )
+    result = uploader.upload([file])
+    assert not result.failed
+    assert result.uploaded == 2
+    assert [e["event_id"] for e in ingest_server.received] == [str(i) for i in range(6)]
+
+
+def test_upload__follows_rotated_files(tmp_path, ingest_server, url):
+    file = _write(tmp_path / "events.ndjson", [json.dumps(_payload(str(i))) for i in range(5)])
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    uploader = upload.Uploader(base_url=url, checkpoint=upload.Checkpoint(checkpoint_path))
+    uploader.upload([file])
+
+    # Rotated the way the `file` exporter does it, then written to again.
+    os.rename(file, f"{file}.1")
+    _write(tmp_path / "events.ndjson", [json.dumps(_payload(str(i))) for i in range(5, 8)])
+    uploader = upload.Uploader(base_url=url, checkpoint=upload.Checkpoint(checkpoint_path))
+    result = uploader.upload([f"{file}.1", file])
+
+    assert result.uploaded == 3
+    assert [e["event_id"] for e in ingest_server.received] == [str(i) for i in range(8)]
+
+
+def test_upload__file_shorter_than_checkpoint(tmp_path, ingest_server, url):
+    file = _write(tmp_path / "events.ndjson", [json.dumps(_payload(str(i))) for i in range(2)])
+    checkpoint = upload.Checkpoint(None)
+    checkpoint.set(upload.file_key(file), 5)
+
+    result = upload.Uploader(base_url=url, checkpoint=checkpoint).upload([file])
+    assert result.uploaded == 2
+    assert checkpoint.get(upload.file_key(file)) == 2
+
+
+def test_cli_upload(tmp_path, ingest_server, url, capsys):
+    file = _write(tmp_path / "events.ndjson", [json.dumps(_payload(str(i))) for i in range(3)])
+    exit_code = cli.main(
+        [
+            "upload",
+            "--api-key",
+            "api-key",
+            "--url",
+            url,
+            "--checkpoint",
+            str(tmp_path / "checkpoint.json"),
+            file,
+        ]
+    )
+    assert exit_code == 0
+    assert len(ingest_server.received) == 3
+    assert "Uploaded 3 events from 1 files" in capsys.readouterr().out
+
+
+def test_cli_upload__dry_run(tmp_path, ingest_server, url):
+    file = _write(tmp_path / "events.ndjson", [json.dumps(_payload("1"))])
+    assert cli.main(["upload", "--dry-run", "--no-checkpoint", "--url", url, file]) == 0
+    assert ingest_server.received == []
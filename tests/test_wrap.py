@@ -1,6 +1,8 @@
 """We test wrap_class_method via test_openai."""
 
-from rosnik import wrap
+import pytest
+
+from rosnik import config, wrap
 
 
 def test_get_stack_frames():
@@ -11,3 +13,96 @@ def test_get_stack_frames():
 def test_get_stack_frames__false():
     frames = wrap.get_stack_frames(3, use_get_frame=False)
     assert len(frames) == 3
+
+
+def _outer(depth):
+    return _inner(depth)
+
+
+def _inner(depth):
+    return wrap.get_function_fingerprint(depth)
+
+
+def test_get_function_fingerprint():
+    fingerprint = _outer(3)
+    assert fingerprint == "_inner._outer.test_get_function_fingerprint"
+
+
+def test_get_function_fingerprint__cached():
+    wrap._fingerprints.clear()
+    fingerprints = [_outer(3) for _ in range(2)]
+    assert fingerprints[0] is fingerprints[1]
+    assert len(wrap._fingerprints) == 1
+
+
+def test_get_function_fingerprint__disabled():
+    assert _outer(0) == ""
+
+
+def test_get_function_fingerprint__bounded_cache(monkeypatch):
+    monkeypatch.setattr(wrap, "_MAX_CACHED_FINGERPRINTS", 1)
+    wrap._fingerprints.clear()
+    _outer(2)
+    _inner(2)
+    assert [fingerprint for fingerprint, _ in wrap._fingerprints.values()] == [
+        "_inner.test_get_function_fingerprint__bounded_cache"
+    ]
+
+
+class _Client:
+    def create(self, **kwargs):
+        if kwargs.get("fail"):
+            raise ValueError("oh no")
+        return "result"
+
+
+@pytest.fixture
+def hooks(mocker):
+    return {
+        "request_hook": mocker.Mock(return_value="request_event"),
+        "response_hook": mocker.Mock(),
+        "error_hook": mocker.Mock(),
+        "streamed_response_hook": mocker.Mock(),
+    }
+
+
+@pytest.fixture
+def client_class():
+    original_create = _Client.create
+    yield _Client
+    _Client.create = original_create
+
+
+def test_wrap_class_method__sampled(client_class, hooks):
+    wrap.wrap_class_method(client_class, "create", **hooks, sampler=lambda kwargs: True)
+    assert client_class().create(model="gpt-4") == "result"
+    hooks["request_hook"].assert_called_once()
+    hooks["response_hook"].assert_called_once()
+
+
+def test_wrap_class_method__unsampled_skips_hooks(client_class, hooks, mocker):
+    fingerprint = mocker.spy(wrap, "get_function_fingerprint")
+    wrap.wrap_class_method(client_class, "create", **hooks, sampler=lambda kwargs: False)
+    assert client_class().create(model="gpt-4") == "result"
+    for hook in hooks.values():
+        hook.assert_not_called()
+    fingerprint.assert_not_called()
+
+
+def test_wrap_class_method__unsampled_keeps_errors(client_class, hooks):
+    wrap.wrap_class_method(client_class, "create", **hooks, sampler=lambda kwargs: False)
+    with pytest.raises(ValueError):
+        client_class().create(model="gpt-4", fail=True)
+    assert "sent_at" in hooks["request_hook"].call_args.kwargs
+    hooks["error_hook"].assert_called_once()
+    assert hooks["error_hook"].call_args.args[2] == "request_event"
+    hooks["response_hook"].assert_not_called()
+
+
+def test_wrap_class_method__unsampled_drops_errors(client_class, hooks):
+    config.Config.sample_keep_errors = False
+    wrap.wrap_class_method(client_class, "create", **hooks, sampler=lambda kwargs: False)
+    with pytest.raises(ValueError):
+        client_class().create(model="gpt-4", fail=True)
+    hooks["request_hook"].assert_not_called()
+    hooks["error_hook"].assert_not_called()